@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import copy
+import numpy as np
 '''
 @author: Wei Zhang
 @date: Feb 26, 2020
@@ -10,6 +11,9 @@ ETROC1 Array Pixel class
 ## Manage ETROC1 Array chip's internal registers map
 # Allow combining and disassembling individual registers
 class ETROC1_ArrayReg(object):
+    ## @var _slaveASize number of registers behind I2C slave A, the rest of the config vector is slave B
+    _slaveASize = 32
+
     ## @var _defaultRegMap default register values
     _defaultRegMap = {
         ## Slave I2C A
@@ -409,3 +413,94 @@ class ETROC1_ArrayReg(object):
         reg_value += [self._regMap['QInj_enableRx'] << 5 | self._regMap['QInj_setCommMode'] << 4 | self._regMap['QInj_enTermination'] << 3 | self._regMap['QInj_invertData'] << 2  | self._regMap['QInj_equ']]
         reg_value += [self._regMap['Dataout_disBIAS'] << 7 | self._regMap['Dataout_AmplSel'] << 4 | self._regMap['CLKTO_disBIAS'] << 3 | self._regMap['CLKTO_AmplSel']]
         return reg_value
+
+    ## get I2C register values split by slave
+    # return (slave A register values, slave B register values)
+    def get_config_vectors(self):
+        reg_value = self.get_config_vector()
+        return reg_value[:self._slaveASize], reg_value[self._slaveASize:]
+
+#--------------------------------------------------------------------------#
+## Shadow copy of the register images known to be on the chips
+# Images are uint8 arrays keyed by I2C slave address, bytes never written (or invalidated) are
+# unknown and always written. write() only sends the bytes that differ from the shadow.
+class ETROC1_ShadowReg(object):
+    ## constructor
+    # @param[in] write_byte function(slave_addr, reg_addr, data) doing one I2C register write,
+    #            e.g. lambda slave_addr, reg_addr, data: iic_write(1, slave_addr, 0, reg_addr, data, cmd_interpret)
+    def __init__(self, write_byte):
+        self.write_byte = write_byte
+        self._images = {}                                           # slave_addr -> register image
+        self._known = {}                                            # slave_addr -> True where the image byte is on the chip
+        self.writes = 0
+        self.skipped = 0
+
+    def _image(self, slave_addr, size):
+        if slave_addr not in self._images or len(self._images[slave_addr]) < size:
+            image = np.zeros(size, dtype=np.uint8)
+            known = np.zeros(size, dtype=bool)
+            if slave_addr in self._images:
+                image[:len(self._images[slave_addr])] = self._images[slave_addr]
+                known[:len(self._known[slave_addr])] = self._known[slave_addr]
+            self._images[slave_addr] = image
+            self._known[slave_addr] = known
+        return self._images[slave_addr], self._known[slave_addr]
+
+    ## register addresses whose value differs from the chip
+    def dirty(self, slave_addr, reg_value):
+        reg_value = np.asarray(reg_value, dtype=np.uint8)
+        image, known = self._image(slave_addr, len(reg_value))
+        return np.flatnonzero((image[:len(reg_value)] != reg_value) | ~known[:len(reg_value)])
+
+    ## write the changed registers of one slave
+    # @param[in] reg_value register values starting at register address 0
+    # @param[in] force write all registers
+    # @param[in] mask only consider the registers where mask is True
+    # return number of I2C writes
+    def write(self, slave_addr, reg_value, force=False, mask=None):
+        reg_value = np.asarray(reg_value, dtype=np.uint8)
+        image, known = self._image(slave_addr, len(reg_value))
+        changed = np.ones(len(reg_value), dtype=bool) if force else (image[:len(reg_value)] != reg_value) | ~known[:len(reg_value)]
+        if mask is not None: changed &= mask
+        reg_addrs = np.flatnonzero(changed)
+        for reg_addr in reg_addrs:
+            self.write_byte(slave_addr, int(reg_addr), int(reg_value[reg_addr]))
+            image[reg_addr] = reg_value[reg_addr]
+            known[reg_addr] = True
+        self.writes += len(reg_addrs)
+        self.skipped += len(reg_value) - len(reg_addrs)
+        return len(reg_addrs)
+
+    ## write the changed registers of an ETROC1_ArrayReg to its two slaves
+    def write_array_reg(self, array_reg, slave_addr_A, slave_addr_B, force=False):
+        reg_value_A, reg_value_B = array_reg.get_config_vectors()
+        return self.write(slave_addr_A, reg_value_A, force) + self.write(slave_addr_B, reg_value_B, force)
+
+    ## forget what is on the chip (power cycle, reset), the next write sends everything
+    def invalidate(self, slave_addr=None):
+        for addr in ([slave_addr] if slave_addr is not None else list(self._known)):
+            if addr in self._known: self._known[addr][:] = False
+
+    ## register image of one slave as last written, None where unknown
+    def image(self, slave_addr):
+        if slave_addr not in self._images: return []
+        return [int(value) if known else None for value, known in zip(self._images[slave_addr], self._known[slave_addr])]
+
+    ## save all the known register images (.npz)
+    def snapshot(self, path):
+        arrays = {}
+        for slave_addr in self._images:
+            arrays['image_0x%02x'%slave_addr] = self._images[slave_addr]
+            arrays['known_0x%02x'%slave_addr] = self._known[slave_addr]
+        np.savez(path, **arrays)
+
+    ## write the register images of a snapshot back to the chips, only the bytes that differ
+    # return number of I2C writes
+    def restore(self, path, force=False):
+        writes = 0
+        with np.load(path) as snapshot:
+            for name in snapshot.files:
+                if not name.startswith('image_'): continue
+                slave_addr = int(name[len('image_'):], 16)
+                writes += self.write(slave_addr, snapshot[name], force, mask=snapshot['known_0x%02x'%slave_addr])
+        return writes
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import shutil
+import platform
+import resource
+import datetime
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from optparse import OptionParser
+
+import run_script
+from command_interpret import *
+from daq_helpers import *
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script measures the throughput of the DAQ: the real Receive_data, Write_data and
+Translate_data threads of run_script.main read a mock_fpga.py server over TCP, for a sweep of
+fill rates, --num_fifo_read sizes and output options. Every run reports the words/s read during
+the time limit and the words/s sustained until everything was written and translated, CPU time
+of every stage, queue depths, peak RSS and lost words, all runs are saved as JSON so versions can
+be compared. With unbounded queues a run only ends once the slowest stage caught up, bound them
+(--extra "--translate_queue_size 64 --queue_policy drop") to measure losses instead.
+Example: python3 benchmark_daq.py --rates 1e5,1e6,4e6 --num_fifo_reads 16384,65536 -t 10
+'''
+#--------------------------------------------------------------------------#
+## Output options of the sweep, as run_script arguments
+benchmark_outputs = {
+    'default':                [],
+    'binary_only':            ['--binary_only'],
+    'compressed_binary':      ['--compressed_binary'],
+    'skip_binary':            ['--skip_binary'],
+    'compressed_translation': ['--compressed_translation'],
+}
+benchmark_sample_time = 0.5                 # seconds between samples of CPU, queues and RSS
+benchmark_version = 1
+clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+#--------------------------------------------------------------------------#
+## CPU seconds (user + system) of a thread or process from /proc, None where there is no /proc
+def proc_cpu_time(path):
+    try:
+        with open(path) as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12]))/clock_ticks
+    except (OSError, IndexError, ValueError):
+        return None
+
+def proc_rss(pid='self'):
+    try:
+        with open('/proc/%s/status'%pid) as status_file:
+            for line in status_file:
+                if line.startswith('VmRSS:'): return int(line.split()[1])*1024
+    except OSError:
+        pass
+    return None
+
+#--------------------------------------------------------------------------#
+## Samples the DAQ threads of this process (and the processes they start) while main() runs
+## CPU time is kept per thread/process name, the last sample of every one is its total
+class DAQ_sampler(threading.Thread):
+    def __init__(self, name, sample_time=benchmark_sample_time):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.sample_time = sample_time
+        self.alive = True
+        self.cpu = {}
+        self.queues = {}                    # attribute name -> queue
+        self.depths = {}                    # attribute name -> sampled depths
+        self.rss = []
+
+    def sample(self):
+        for thread in threading.enumerate():
+            if thread is self or thread.native_id is None: continue
+            cpu = proc_cpu_time('/proc/self/task/%d/stat'%thread.native_id)
+            if cpu is not None: self.cpu[thread.name] = max(cpu, self.cpu.get(thread.name, 0))
+            for attribute in ('read_queue', 'translate_queue', 'plot_queue'):
+                daq_queue = getattr(thread, attribute, None)
+                if daq_queue is not None: self.queues[attribute] = daq_queue
+        rss = proc_rss()
+        for child in multiprocessing.active_children():
+            cpu = proc_cpu_time('/proc/%d/stat'%child.pid)
+            if cpu is not None: self.cpu[child.name] = max(cpu, self.cpu.get(child.name, 0))
+            child_rss = proc_rss(child.pid)
+            if rss is not None and child_rss is not None: rss += child_rss
+        if rss is not None: self.rss.append(rss)
+        for attribute, daq_queue in self.queues.items():
+            try:
+                self.depths.setdefault(attribute, []).append(daq_queue.qsize())
+            except (AttributeError, TypeError, ValueError):
+                pass                        # ring buffer already released
+
+    def run(self):
+        while self.alive:
+            self.sample()
+            time.sleep(self.sample_time)
+
+    def stop(self):
+        self.alive = False
+        self.join()
+
+    ## Queue depths (chunks, words for the ring buffer) and what the queues dropped
+    def queue_summary(self):
+        summary = {}
+        for attribute, daq_queue in self.queues.items():
+            depths = self.depths.get(attribute, [0])
+            summary[attribute] = {'mean': float(np.mean(depths)), 'max': int(np.max(depths)),
+                                  'high_water': int(getattr(daq_queue, 'high_water', 0)),
+                                  'dropped_words': int(getattr(daq_queue, 'dropped_words', 0) + getattr(daq_queue, 'words_lost', 0))}
+        return summary
+
+#--------------------------------------------------------------------------#
+## One run of run_script.main in this (child) process, the result dictionary goes to result_queue
+def benchmark_run(arguments, port, work_directory, log_file, result_queue):
+    os.chdir(work_directory)
+    sys.stdout = open(log_file, 'w')
+    (options, args) = run_script.getOptionParser().parse_args(['--hostname', '127.0.0.1', '--port', str(port), '-o', 'benchmark', '-w', '-f'] + arguments)
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.connect((options.hostname, options.port))
+    sampler = DAQ_sampler('DAQ_sampler')
+    sampler.start()
+    cpu_start = time.process_time()
+    start_time = time.time()
+    stats = run_script.main(options, command_interpret(s), None)
+    wall_seconds = time.time() - start_time
+    sampler.stop()
+    s.close()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    seconds = max(stats['seconds'], 1e-9)
+    stages = {name: cpu for name, cpu in sampler.cpu.items() if name != 'MainThread'}
+    result_queue.put({
+        'words_read': stats['words'],
+        'data_words': stats['data_words'],
+        'chunks': stats['chunks'],
+        'seconds': stats['seconds'],
+        'wall_seconds': wall_seconds,
+        'words_per_s': stats['data_words']/seconds,
+        'read_words_per_s': stats['words']/seconds,
+        'sustained_words_per_s': stats['data_words']/wall_seconds,
+        'stage_cpu_s': stages,
+        'stage_cpu_fraction': {name: cpu/wall_seconds for name, cpu in stages.items()},
+        'process_cpu_s': time.process_time() - cpu_start,
+        'children_cpu_s': children.ru_utime + children.ru_stime,
+        'queues': sampler.queue_summary(),
+        'peak_rss_mb': own.ru_maxrss/1024.,                 # ru_maxrss is in kB on Linux
+        'children_peak_rss_mb': children.ru_maxrss/1024.,
+        'peak_total_rss_mb': max(sampler.rss, default=0)/2**20,
+    })
+    sys.stdout.close()
+
+#--------------------------------------------------------------------------#
+## Start mock_fpga.py on a free port, return (process, port)
+def start_mock_fpga(options, rate):
+    mock = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_fpga.py')
+    process = subprocess.Popen([sys.executable, '-u', mock, '--port', '0', '--rate', str(rate), '--fifo_depth', str(options.fifo_depth),
+                                '--hits', str(options.hits), '--seed', str(options.seed)], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    line = process.stdout.readline()
+    if(not line.startswith("Mock FPGA listening on")):
+        process.kill()
+        raise RuntimeError("mock_fpga.py did not start: %s"%line)
+    return process, int(line.split(':')[-1])
+
+## Stop the mock, return (words sent, words lost to FIFO overflow) of its connection
+def stop_mock_fpga(process):
+    process.terminate()
+    output, unused = process.communicate()
+    sent, lost = 0, 0
+    for line in output.splitlines():
+        if(line.startswith("Mock_FPGA_client") and "words sent" in line):
+            words = line.replace(',', '').split()
+            sent += int(words[words.index('sent')-2])
+            lost += int(words[words.index('lost')-2])
+    return sent, lost
+
+#--------------------------------------------------------------------------#
+def benchmark(options):
+    rates = [float(rate) for rate in options.rates.split(',')]
+    num_fifo_reads = [int(num_fifo_read) for num_fifo_read in options.num_fifo_reads.split(',')]
+    outputs = options.outputs.split(',')
+    for output in outputs:
+        if output not in benchmark_outputs:
+            print("Unknown output %s, choose from %s"%(output, ', '.join(benchmark_outputs)))
+            sys.exit(1)
+    work_directory = options.work_directory if options.work_directory is not None else tempfile.mkdtemp(prefix="benchmark_daq_")
+    try:
+        git_version = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip()
+    except OSError:
+        git_version = None
+    results = {'version': benchmark_version, 'git': git_version, 'host': platform.node(), 'python': platform.python_version(),
+               'cpus': os.cpu_count(), 'date': datetime.datetime.now().isoformat(), 'time_limit': options.time_limit,
+               'extra': options.extra, 'runs': []}
+    runs = [(rate, num_fifo_read, output) for rate in rates for num_fifo_read in num_fifo_reads for output in outputs]
+    print("%d runs of %d s, output in %s"%(len(runs), options.time_limit, work_directory))
+    print("{:>10} {:>8} {:>22} {:>12} {:>12} {:>10} {:>8} {:>10}  {}".format("rate", "fifo", "output", "words/s", "sustained", "lost", "rss MB", "max queue", "stage CPU fraction"))
+    for i, (rate, num_fifo_read, output) in enumerate(runs):
+        # main() writes to ../ETROC-Data/<date>_Array_Test_Results/benchmark
+        run_directory = os.path.join(work_directory, "run")
+        os.makedirs(run_directory, exist_ok=True)
+        os.makedirs(os.path.join(work_directory, "ETROC-Data"), exist_ok=True)
+        arguments = ['-t', str(options.time_limit), '-r', str(num_fifo_read)] + benchmark_outputs[output] + options.extra.split()
+        mock, port = start_mock_fpga(options, rate)
+        result_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=benchmark_run, args=(arguments, port, run_directory, os.path.join(work_directory, "run_%d.log"%i), result_queue))
+        process.start()
+        try:
+            result = result_queue.get(True, options.time_limit + options.timeout)
+        except queue.Empty:
+            result = None
+        process.join(options.timeout)
+        if process.is_alive(): process.terminate()
+        time.sleep(benchmark_sample_time)             # the mock prints its counts once the connection is closed
+        words_sent, fifo_lost = stop_mock_fpga(mock)
+        run = {'rate': rate, 'num_fifo_read': num_fifo_read, 'output': output, 'arguments': arguments, 'words_sent': words_sent, 'fifo_lost_words': fifo_lost}
+        if(result is None):
+            run['error'] = "not finished %d s after the time limit, see run_%d.log"%(options.timeout, i)
+            print("{:>10.3g} {:>8d} {:>22} not finished {:d} s after the time limit, see {}".format(rate, num_fifo_read, output, options.timeout, os.path.join(work_directory, "run_%d.log"%i)))
+        else:
+            run.update(result)
+            run['lost_words'] = fifo_lost + sum(daq_queue['dropped_words'] for daq_queue in result['queues'].values())
+            max_queue = max([daq_queue['max'] for daq_queue in result['queues'].values()], default=0)
+            stages = " ".join("{}={:.2f}".format(name, fraction) for name, fraction in sorted(result['stage_cpu_fraction'].items()))
+            print("{:>10.3g} {:>8d} {:>22} {:>12.0f} {:>12.0f} {:>10d} {:>8.0f} {:>10d}  {}".format(rate, num_fifo_read, output, result['words_per_s'], result['sustained_words_per_s'], run['lost_words'], result['peak_total_rss_mb'], max_queue, stages))
+        results['runs'].append(run)
+        # Raw and translated files are only needed for the run itself
+        if(not options.keep_output): shutil.rmtree(os.path.join(work_directory, "ETROC-Data"), ignore_errors=True)
+        with open(options.output, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+    print("Results saved in %s"%options.output)
+    if(options.work_directory is None and not options.keep_output): shutil.rmtree(work_directory, ignore_errors=True)
+
+#--------------------------------------------------------------------------#
+def getOptionParser():
+    parser = OptionParser()
+    parser.add_option("--rates", dest="rates", action="store", type="string", help="Comma separated mock FIFO fill rates (words/s), 0 for as fast as it is read", default="1e5,1e6,0")
+    parser.add_option("--num_fifo_reads", dest="num_fifo_reads", action="store", type="string", help="Comma separated --num_fifo_read values", default="16384,65535")
+    parser.add_option("--outputs", dest="outputs", action="store", type="string", help="Comma separated output options: %s"%", ".join(benchmark_outputs), default=",".join(benchmark_outputs))
+    parser.add_option("--extra", dest="extra", action="store", type="string", help="More run_script arguments for every run, e.g. \"--translate_process --raw_format bin\"", default="")
+    parser.add_option("-t", "--time_limit", dest="time_limit", action="store", type="int", help="Seconds of every run", default=10)
+    parser.add_option("--timeout", dest="timeout", action="store", type="int", help="Seconds a run may take after its time limit before it counts as failed", default=120)
+    parser.add_option("--fifo_depth", dest="fifo_depth", action="store", type="int", help="Mock FIFO depth in words, words beyond it are lost", default=1<<22)
+    parser.add_option("--hits", dest="hits", action="store", type="float", help="Mean number of hits per frame of the mock data", default=2.0)
+    parser.add_option("--seed", dest="seed", action="store", type="int", help="Random seed of the mock data", default=0)
+    parser.add_option("--work_directory", dest="work_directory", action="store", type="string", help="Where the runs write their files and logs (a temporary directory if not given)", default=None)
+    parser.add_option("--keep_output", action="store_true", dest="keep_output", default=False, help="Keep the files written by the runs")
+    parser.add_option("--output", dest="output", action="store", type="string", help="JSON file for the results", default="benchmark_daq.json")
+    return parser
+
+if __name__ == "__main__":
+    parser = getOptionParser()
+    (options, args) = parser.parse_args()
+    benchmark(options)
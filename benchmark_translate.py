@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+import numpy as np
+from collections import deque
+from optparse import OptionParser
+
+from translate_data import *
+from board_details import *
+from mock_fpga import etroc2_frame_bits, etroc2_filler_bits, bits_to_words, pattern_3c5c
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script is a golden-vector and timing harness for the decoders of translate_data.py.
+It generates bit-accurate FIFO word streams: ETROC2 channel streams (frames, fillers, misaligned
+starts, corrupt words) interleaved over the channels, ETROC1 words and control words. --record
+saves the streams and what the decoders make of them, --check decodes the saved streams again and
+compares word by word, every run times the decoders in lines (FIFO words) per second.
+Record with the reference version, then check the new one:
+    python3 benchmark_translate.py --record -g golden_vectors
+    python3 benchmark_translate.py --check -g golden_vectors
+'''
+#--------------------------------------------------------------------------#
+## Generated streams: name -> (timestamp mode, what is in it)
+vector_sets = {
+    'etroc2_clean':      (0x000C, "aligned ETROC2 frames and fillers on 4 channels"),
+    'etroc2_misaligned': (0x000C, "ETROC2 streams starting with junk bits, the decoder has to find 3c5c"),
+    'etroc2_corrupt':    (0x000C, "ETROC2 streams with flipped bits, lost, repeated and random words, wrong chip IDs and pixels hit twice"),
+    'etroc1':            (0x000C, "ETROC1 words, channel in bits 30:29"),
+    'etroc1_old':        (0x0001, "old ETROC1 words (timestamp 0x0001), channel in bits 31:30 and a hit flag"),
+    'control':           (0x000C, "NORMTRIG, RANDTRIG, FILLERTIME, MSBTIME, FILLER and unknown control words"),
+    'mixed':             (0x000C, "ETROC2 streams with control and ETROC1 words in between, as read from the FIFO"),
+    'etroc2_early_errors':    (0x000C, "ETROC2 streams damaged as etroc2_corrupt from the first frame on"),
+    'etroc2_repeated_errors': (0x000C, "ETROC2 streams damaged in four bursts, the first one at the start"),
+}
+golden_version = 2
+## Version 1 golden sets (before the decoding statistics) are still checked, without the statistics
+golden_versions = [1, 2]
+## FIFO words given to etroc2_decode_chunk at a time by the vectorized check: the large size is the
+## one timed, the small ones cut frames, damaged words and the bits held after them at chunk boundaries
+vector_chunk_sizes = [65536, 4096, 997]
+
+#--------------------------------------------------------------------------#
+## 40 bit words of one ETROC2 channel
+## etroc2_translate drops the bits it holds on any error and never looks for 3c5c again, so the
+## first damaged word puts the rest of the channel out of step: words are only damaged in a part
+## of the frames, the last quarter unless errors says otherwise
+# @param[in] corrupt probability of every word (of the damaged part) to be damaged
+# @param[in] errors damaged part, see damaged_part
+def etroc2_channel_bits(rng, board_ID, nframes, hits=2.0, fillers=0.2, corrupt=0.0, errors='late'):
+    words = []
+    damaged = damaged_part(errors, nframes)
+    for i in range(nframes):
+        while(rng.random()<fillers): words.append(etroc2_filler_bits(rng, i%256, i%3564))
+        frame = etroc2_frame_bits(rng, board_ID, i%256, i%3564, min(255, int(rng.poisson(hits))))
+        if(corrupt>0 and damaged[i] and len(frame)>2 and rng.random()<0.3):
+            frame.insert(int(rng.integers(1, len(frame)-1)), frame[1])                  # pixel hit twice
+        for word in frame:
+            if(corrupt==0 or not damaged[i] or rng.random()>=corrupt):
+                words.append(word)
+                continue
+            damage = int(rng.integers(5))
+            if(damage==0):                                                          # flipped bit
+                position = int(rng.integers(40))
+                words.append(word[:position] + ('1' if word[position]=='0' else '0') + word[position+1:])
+            elif(damage==1): words.append(''.join(rng.choice(['0', '1'], size=40)))  # random word
+            elif(damage==2 and word[0]=='0' and not word.startswith(pattern_3c5c)):  # trailer of another chip
+                words.append('0' + format(int(rng.integers(1<<17)), '017b') + word[18:])
+            elif(damage==3): pass                                                   # lost word
+            elif(damage==4): words += [word, word]                                  # repeated word
+            else: words.append(word)
+    return words
+
+## Which of count frames (or FIFO words) of a channel may be damaged
+## late: the last quarter, early: all of them, repeated: four bursts of an eighth, from the start on
+def damaged_part(errors, count):
+    index = np.arange(count)
+    if(errors=='early'): return index>=0
+    if(errors=='repeated'): return (8*index//max(count, 1))%2==0
+    return 4*index>=3*count
+
+## Junk bits without the 3c5c pattern
+def junk_bits(rng, nbits):
+    while True:
+        junk = ''.join(rng.choice(['0', '1'], size=nbits))
+        if(pattern_3c5c not in junk): return junk
+
+## FIFO words of all the channels, each channel keeps its order, the channels are mixed at random
+def interleave(rng, streams):
+    order = rng.permutation(np.repeat(np.arange(len(streams)), [len(stream) for stream in streams]))
+    words = np.zeros(len(order), dtype=np.uint32)
+    for i, stream in enumerate(streams): words[order==i] = stream
+    return words
+
+def etroc2_stream(rng, nframes, misaligned=False, corrupt=0.0, errors='late'):
+    streams = []
+    for channel in range(etroc2_channels):
+        bits = ''.join(etroc2_channel_bits(rng, board_ID[channel], nframes, corrupt=corrupt, errors=errors))
+        if(misaligned): bits = junk_bits(rng, int(rng.integers(1, 200))) + bits
+        streams.append(bits_to_words(bits + '0'*(-len(bits) % 28), channel))
+        if(corrupt>0):
+            # Random FIFO words of the channel (bit errors in the 28 bit payload), in the damaged part only
+            damaged = (rng.random(len(streams[-1])) < corrupt/4) & damaged_part(errors, len(streams[-1]))
+            streams[-1][damaged] = (rng.integers(0, 1<<28, np.sum(damaged)) | ((0xC | channel) << 28)).astype(np.uint32)
+    return interleave(rng, streams)
+
+## ETROC1 words, TOT 9 bits, TOA 10 bits, CAL 10 bits
+def etroc1_stream(rng, nwords, old=False):
+    channel = rng.integers(0, 4, nwords)
+    data = (rng.integers(0, 1<<9, nwords) << 20) | (rng.integers(0, 1<<10, nwords) << 10) | rng.integers(0, 1<<10, nwords)
+    if(old): return ((channel << 30) | (data << 1) | 1).astype(np.uint32)
+    return ((channel << 29) | data).astype(np.uint32)
+
+## Control words: timecodes with a 26 bit counter, fillers ('10'+'0110') and other control words
+def control_stream(rng, nwords):
+    kind = rng.integers(0, 6, nwords)
+    words = np.zeros(nwords, dtype=np.int64)
+    timecode = kind < 4
+    words[timecode] = 0x80000000 | (kind[timecode] << 26) | rng.integers(0, 1<<26, np.sum(timecode))
+    words[kind==4] = 0x98000000 | rng.integers(0, 1<<26, np.sum(kind==4))
+    other = rng.integers(0, 1<<30, np.sum(kind==5))
+    words[kind==5] = 0x80000000 | np.where((other >> 26) == 0x6, other ^ (1 << 27), other) | (1 << 28)    # '10' but not a timecode or a filler
+    return words.astype(np.uint32)
+
+## Words between the ETROC2 words, keeping their order
+def sprinkle(rng, words, extra):
+    positions = np.sort(rng.integers(0, len(words)+1, len(extra)))
+    return np.insert(words, positions, extra)
+
+def make_vectors(name, seed, scale):
+    rng = np.random.default_rng(seed)
+    nframes = int(500*scale)
+    if(name=='etroc2_clean'):      return etroc2_stream(rng, nframes)
+    if(name=='etroc2_misaligned'): return etroc2_stream(rng, nframes, misaligned=True)
+    if(name=='etroc2_corrupt'):    return etroc2_stream(rng, nframes, misaligned=True, corrupt=0.01)
+    if(name=='etroc2_early_errors'):    return etroc2_stream(rng, nframes, misaligned=True, corrupt=0.01, errors='early')
+    if(name=='etroc2_repeated_errors'): return etroc2_stream(rng, nframes, misaligned=True, corrupt=0.02, errors='repeated')
+    if(name=='etroc1'):            return etroc1_stream(rng, int(10000*scale))
+    if(name=='etroc1_old'):        return etroc1_stream(rng, int(10000*scale), old=True)
+    if(name=='control'):           return control_stream(rng, int(10000*scale))
+    words = etroc2_stream(rng, nframes, misaligned=True, corrupt=0.005)
+    return sprinkle(rng, words, np.concatenate((control_stream(rng, len(words)//32), etroc1_stream(rng, len(words)//64))))
+
+#--------------------------------------------------------------------------#
+## Run a decoder over a stream
+# return (golden text, seconds spent in the decoder, number of lines given to it)
+## Golden text has one "word index<TAB>flag<TAB>line" row per output line, "word index<TAB>flag<TAB>"
+## for words without output, and ends with the link state and the decoding statistics of every channel
+def run_decoder(decoder, words, timestamp, compressed_translation=False):
+    lines = [format(int(word), '032b') for word in words]
+    queues = [deque() for channel in range(etroc2_channels)]
+    links = ["" for channel in range(etroc2_channels)]
+    hitmap = {channel: np.zeros((16,16)) for channel in range(etroc2_channels)}
+    stats = np.zeros((etroc2_channels, len(etroc2_stat_names)), dtype=np.int64)
+    outputs = []
+    # The decoders print about errors, that is not part of the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        if(decoder=='etroc1_translate'):
+            outputs = [etroc1_translate(line, timestamp) for line in lines]
+        elif(decoder=='control_translate'):
+            outputs = [control_translate(line, timestamp) for line in lines]
+        elif(decoder=='etroc2_translate'):
+            outputs = [etroc2_translate(line, timestamp, queues, links, board_ID, hitmap, compressed_translation, stats) for line in lines]
+        else:
+            outputs = [etroc_translate_binary(line, timestamp, queues, links, board_ID, hitmap, compressed_translation, stats) for line in lines]
+        seconds = time.perf_counter() - start_time
+    rows = []
+    for index, (TDC_data, flag) in enumerate(outputs):
+        if(isinstance(TDC_data, str)): TDC_data = [TDC_data] if TDC_data else []
+        if(len(TDC_data)==0): rows.append("%d\t%d\t"%(index, flag))
+        for line in TDC_data: rows.append("%d\t%d\t%s"%(index, flag, line))
+    rows.append("# links %s"%json.dumps(links))
+    rows.append("# queues %s"%json.dumps([list(channel_queue) for channel_queue in queues]))
+    rows.append("# stats %s"%json.dumps(stats.tolist()))
+    return "\n".join(rows) + "\n", seconds, len(lines)
+
+## Lines of the vectorized decoder, as (word index, line) next to the ones of etroc2_translate,
+## and its decoding statistics
+def run_vectorized(words, timestamp, compressed_translation=False, chunk_size=65536):
+    links = ETROC2_links(board_ID)
+    link_states = links[0]
+    found = []
+    start_time = time.perf_counter()
+    for start in range(0, len(words), chunk_size):
+        for position, frame in etroc2_decode_chunk(words[start:start+chunk_size], link_states, timestamp, compressed_translation):
+            found.append((start + position, frame))
+    seconds = time.perf_counter() - start_time
+    rows = []
+    for position, frame in found:
+        rows += ["%d\t%s"%(position, etroc2_record_line(record)) for record in frame]
+    rows.append("# stats %s"%json.dumps(links.stats[0].tolist()))
+    return rows, seconds
+
+## (word index, line) rows of golden etroc2_translate text, without the HEADER_KEY markers, and its statistics
+def golden_lines(text):
+    rows = []
+    for row in text.splitlines():
+        if(row.startswith('# stats')): rows.append(row)
+        if(row.startswith('#')): continue
+        index, flag, line = row.split('\t', 2)
+        if(line and line!="HEADER_KEY"): rows.append("%s\t%s"%(index, line))
+    return rows
+
+#--------------------------------------------------------------------------#
+## Decoders run on every set: (name of the golden file, decoder, compressed translation)
+def set_decoders(name):
+    if(name.startswith('etroc2')):
+        return [('etroc2_translate', 'etroc2_translate', False), ('etroc2_translate_compressed', 'etroc2_translate', True)]
+    if(name.startswith('etroc1')): return [('etroc1_translate', 'etroc1_translate', False)]
+    if(name=='control'): return [('control_translate', 'control_translate', False)]
+    return [('etroc_translate_binary', 'etroc_translate_binary', False), ('etroc_translate_binary_compressed', 'etroc_translate_binary', True)]
+
+## Rows without the "# stats" row, for version 1 golden sets
+def without_stats(rows):
+    return [row for row in rows if not row.startswith('# stats')]
+
+def first_difference(expected, found):
+    for i, (a, b) in enumerate(zip(expected, found)):
+        if(a!=b): return "row %d: expected %r, found %r"%(i, a, b)
+    return "%d rows expected, %d found"%(len(expected), len(found))
+
+def harness(options):
+    names = options.sets.split(',') if options.sets else list(vector_sets)
+    manifest_path = os.path.join(options.golden_directory, "golden.json")
+    if(options.check):
+        with open(manifest_path) as infile:
+            manifest = json.load(infile)
+        if(manifest['version'] not in golden_versions):
+            print("Golden vectors of unknown version %d"%manifest['version'])
+            sys.exit(1)
+        names = [name for name in names if name in manifest['sets']]
+    else:
+        manifest = {'version': golden_version, 'seed': options.seed, 'scale': options.scale, 'board_ID': board_ID, 'sets': {}}
+        if(options.record): os.makedirs(options.golden_directory, exist_ok=True)
+    failures = 0
+    timing = {}
+    print("{:<22} {:<38} {:>9} {:>14}  {}".format("set", "decoder", "words", "lines/s", "golden"))
+    for name in names:
+        if(options.check):
+            words = np.load(os.path.join(options.golden_directory, "%s_words.npy"%name))
+            timestamp = manifest['sets'][name]['timestamp']
+        else:
+            words = make_vectors(name, options.seed + list(vector_sets).index(name), options.scale)
+            timestamp = vector_sets[name][0]
+            manifest['sets'][name] = {'timestamp': timestamp, 'words': len(words), 'description': vector_sets[name][1]}
+            if(options.record): np.save(os.path.join(options.golden_directory, "%s_words.npy"%name), words)
+        for golden_name, decoder, compressed_translation in set_decoders(name):
+            text, seconds, nlines = run_decoder(decoder, words, timestamp, compressed_translation)
+            if(manifest['version']==1): text = "".join(without_stats(text.splitlines(True)))
+            path = os.path.join(options.golden_directory, "%s_%s.txt"%(name, golden_name))
+            status = ""
+            if(options.record):
+                with open(path, 'w') as outfile: outfile.write(text)
+                status = "recorded"
+            elif(options.check):
+                with open(path) as infile: expected = infile.read()
+                status = "identical" if text==expected else "DIFFERENT, " + first_difference(expected.splitlines(), text.splitlines())
+                failures += text!=expected
+            timing["%s/%s"%(name, golden_name)] = nlines/seconds
+            print("{:<22} {:<38} {:>9d} {:>14.0f}  {}".format(name, golden_name, nlines, nlines/seconds, status))
+            # The vectorized decoder has to give the lines of etroc2_translate at the same words
+            if(decoder=='etroc2_translate'):
+                if(options.check):
+                    with open(path) as infile: text = infile.read()
+                expected = golden_lines(text)
+                for chunk_size in vector_chunk_sizes:
+                    rows, seconds = run_vectorized(words, timestamp, compressed_translation, chunk_size)
+                    if(manifest['version']==1): rows = without_stats(rows)
+                    status = "identical" if rows==expected else "DIFFERENT, " + first_difference(expected, rows)
+                    failures += rows!=expected
+                    vector_name = "etroc2_decode_chunk" + ("_compressed" if compressed_translation else "")
+                    if(chunk_size!=vector_chunk_sizes[0]): vector_name += "/%d"%chunk_size
+                    timing["%s/%s"%(name, vector_name)] = len(words)/seconds
+                    print("{:<22} {:<38} {:>9d} {:>14.0f}  {}".format(name, vector_name, len(words), len(words)/seconds, status))
+    if(options.record):
+        with open(manifest_path, 'w') as outfile: json.dump(manifest, outfile, indent=1)
+        print("Golden vectors saved in %s"%options.golden_directory)
+    if(options.output is not None):
+        with open(options.output, 'w') as outfile: json.dump({'lines_per_s': timing, 'failures': failures}, outfile, indent=1)
+    if(failures>0):
+        print("%d decoder outputs differ from the golden ones"%failures)
+        sys.exit(1)
+
+#--------------------------------------------------------------------------#
+def getOptionParser():
+    parser = OptionParser()
+    parser.add_option("-g", "--golden_directory", dest="golden_directory", action="store", type="string", help="Directory of the golden vectors", default="golden_vectors")
+    parser.add_option("--record", action="store_true", dest="record", default=False, help="Generate the streams and save them with the outputs of this version as golden vectors")
+    parser.add_option("--check", action="store_true", dest="check", default=False, help="Decode the saved streams and compare with the golden outputs")
+    parser.add_option("--sets", dest="sets", action="store", type="string", help="Comma separated sets to run: %s (all if not given)"%", ".join(vector_sets), default=None)
+    parser.add_option("--seed", dest="seed", action="store", type="int", help="Random seed of the generated streams", default=0)
+    parser.add_option("--scale", dest="scale", action="store", type="float", help="Size of the generated streams (1: 500 frames per channel, 10000 ETROC1 or control words)", default=1.0)
+    parser.add_option("--output", dest="output", action="store", type="string", help="JSON file for the timing results", default=None)
+    return parser
+
+if __name__ == "__main__":
+    parser = getOptionParser()
+    (options, args) = parser.parse_args()
+    if(options.record and options.check):
+        print("--record and --check can not be used together")
+        sys.exit(1)
+    harness(options)
@@ -48,6 +48,7 @@ register_12_key = 0x0006
 register_14_key = 0x000b
 
 # Use this to control how many boards are actually attempted for connection
+# One entry per channel, 4 channels per FPGA (FPGA after FPGA when reading out several)
 # ETROC version number
 board_type       = [2, 1, 1, 1]
 
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import struct
 import time
+import numpy as np
 '''
 @author: Wei Zhang, Murtaza Safdari
 @date: 2018-01-05
@@ -48,37 +49,135 @@ class command_interpret:
     # @param[in] Addr write address of memeoy 0-65535
     # @param[in] Data write into memory data 0-65535
     def write_memory(self, Addr, Data):
-        data = 0x00110000 + (0x0000ffff & Addr)             #memory address LSB register
-        self.ss.sendall(struct.pack('I',data)[::-1])
-        data = 0x00120000 + ((0xffff0000 & Addr) >> 16)     #memory address MSB register
-        self.ss.sendall(struct.pack('I',data)[::-1])
-        data = 0x00130000 + (0x0000ffff & Data)             #memory Data LSB register
-        self.ss.sendall(struct.pack('I',data)[::-1])
-        data = 0x00140000 + ((0xffff0000 & Data) >> 16)     #memory Data MSB register
-        self.ss.sendall(struct.pack('I',data)[::-1])
+        with self.transaction() as batch:
+            batch.write_memory(Addr, Data)
 
     ## read memory
-    # @param[in] Cnt read data counts 0-65535
+    # @param[in] Cnt read data counts 1-65535
     # @param[in] Addr start address of read memory 0-65535
     def read_memory(self, Cnt, Addr):
-        data = 0x00100000 + Cnt                             #write sMemioCnt
-        self.ss.sendall(struct.pack('I',data)[::-1])
-        data = 0x00110000 + (0x0000ffff & Addr)             #write memory address LSB register
-        self.ss.sendall(struct.pack('I',data)[::-1])
-        data = 0x00120000 + ((0xffff0000 & Addr) >> 16)     #write memory address MSB register
-        self.ss.sendall(struct.pack('I',data)[::-1])
-        data = 0x80140000                                   #read Cnt 32bit memory words
-        self.ss.sendall(struct.pack('I',data)[::-1])
-        for i in xrange(Cnt):
-            print(hex(struct.unpack('I', self.ss.recv(4)[::-1])[0]))
+        with self.transaction() as batch:
+            batch.read_memory(Cnt, Addr)
+        for word in batch.replies[0]:
+            print(hex(word))
 
     ## read_data_fifo
     # @param[in] Cnt read data counts 0-65535
     def read_data_fifo(self, Cnt):
+        return self.read_data_fifo_array(Cnt).tolist()
+
+    ## read_data_fifo_array
+    # Bulk version of read_data_fifo, the whole burst is received straight into one buffer
+    # @param[in] Cnt read data counts 0-65535
+    # return numpy array of Cnt 32bit words (big-endian view on the received bytes, no copy)
+    def read_data_fifo_array(self, Cnt):
         data = 0x00190000 + (Cnt -1)                        #write sDataFifoHigh address = 25
         self.ss.sendall(struct.pack('I', data)[::-1])
-        mem_data = []
-        for i in range(Cnt-1):
-            mem_data += [struct.unpack('I', self.ss.recv(4)[::-1])[0]]
-        mem_data += [struct.unpack('I', self.ss.recv(4)[::-1])[0]]
-        return mem_data
+        mem_data = bytearray(4*Cnt)
+        self.recv_into_buffer(mem_data)
+        return np.frombuffer(mem_data, dtype='>u4')
+
+    ## recv_into_buffer
+    # Fill the whole buffer from the socket, recv_into may return short reads
+    # @param[in] buffer writable bytes-like object
+    def recv_into_buffer(self, buffer):
+        view = memoryview(buffer)
+        received = 0
+        while received < len(view):
+            nbytes = self.ss.recv_into(view[received:])
+            if nbytes == 0:
+                raise ConnectionError("Socket closed after %d of %d bytes"%(received, len(view)))
+            received += nbytes
+        return received
+
+    ## transaction
+    # Start a pipelined transaction, see command_transaction
+    def transaction(self):
+        return command_transaction(self)
+
+#-------------------------------------------------------------------------------#
+## Pipelined multi-register transaction
+# Takes the same calls as command_interpret, but only queues the command words. They are
+# sent with one sendall when the transaction is sent, then all the read replies are
+# received in one go and returned in the order the reads were queued:
+#   with cmd_interpret.transaction() as batch:
+#       batch.write_config_reg(9, 0x0deb)
+#       batch.read_status_reg(2)
+#   register_2 = batch.replies[0]
+# Helpers taking a cmd_interpret can be handed a transaction, nested transactions are
+# sent with the outermost one.
+class command_transaction:
+    ## constructor
+    # @param[in] cmd_interpret command_interpret owning the socket
+    def __init__(self, cmd_interpret):
+        self.cmd_interpret = cmd_interpret
+        self.words = []
+        self.reads = []                                     # number of reply words of each read
+        self.replies = []
+        self.depth = 0
+
+    def transaction(self):
+        return self
+
+    def __enter__(self):
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0 and exc_type is None:
+            self.send()
+        return False
+
+    def write_config_reg(self, Addr, Data):
+        self.words.append(0x00200000 + (Addr << 16) + Data)
+
+    def read_config_reg(self, Addr):
+        self.words.append(0x80200000 + (Addr << 16))
+        self.reads.append(1)
+
+    def write_pulse_reg(self, Data):
+        self.words.append(0x000b0000 + Data)
+
+    def read_status_reg(self, Addr):
+        self.words.append(0x80000000 + (Addr << 16))
+        self.reads.append(1)
+
+    def write_memory(self, Addr, Data):
+        self.words += [0x00110000 + (0x0000ffff & Addr),              #memory address LSB register
+                       0x00120000 + ((0xffff0000 & Addr) >> 16),      #memory address MSB register
+                       0x00130000 + (0x0000ffff & Data),              #memory Data LSB register
+                       0x00140000 + ((0xffff0000 & Data) >> 16)]      #memory Data MSB register
+
+    ## read memory, the reply is the list of Cnt words
+    # Cnt of 0 would have no reply words to tell it from a scalar read, it is refused
+    def read_memory(self, Cnt, Addr):
+        if Cnt <= 0:
+            raise ValueError("read_memory needs at least one word, got Cnt=%d"%Cnt)
+        self.words += [0x00100000 + Cnt,                              #write sMemioCnt
+                       0x00110000 + (0x0000ffff & Addr),              #write memory address LSB register
+                       0x00120000 + ((0xffff0000 & Addr) >> 16),      #write memory address MSB register
+                       0x80140000]                                    #read Cnt 32bit memory words
+        self.reads.append(-Cnt)                                       # negative: reply is a list
+
+    ## send
+    # Send all queued commands, receive the replies
+    # return list of read replies, in order
+    def send(self):
+        words, reads = self.words, self.reads
+        self.words, self.reads = [], []
+        if len(words) == 0: return []
+        self.cmd_interpret.ss.sendall(struct.pack('>%dI'%len(words), *words))
+        nwords = sum(abs(n) for n in reads)
+        if nwords == 0: return []
+        mem_data = bytearray(4*nwords)
+        self.cmd_interpret.recv_into_buffer(mem_data)
+        values = struct.unpack('>%dI'%nwords, mem_data)
+        position = 0
+        replies = []
+        for n in reads:
+            if n < 0: replies.append(list(values[position:position-n]))
+            else: replies.append(values[position])
+            position += abs(n)
+        self.replies += replies
+        return replies
@@ -148,4 +148,16 @@ def config_etroc1(B_num, charge_injection, DAC_Value_List, Pixel_board, QSel_boa
     ETROC1_ArrayReg1.set_CLKTO_disBIAS(0)
     reg_val = ETROC1_ArrayReg1.get_config_vector()                      # Get Array Pixel Register default data
 
-    return reg_val
\ No newline at end of file
+    return reg_val
+#--------------------------------------------------------------------------#
+## Shadow register cache for the ETROC1 boards behind one cmd_interpret
+def etroc1_shadow_reg(cmd_interpret):
+    return ETROC1_ShadowReg(lambda slave_addr, reg_addr, data: iic_write(1, slave_addr, 0, reg_addr, data, cmd_interpret))
+
+#--------------------------------------------------------------------------#
+## Write the register vector from config_etroc1 to the two I2C slaves of a board
+## Only the registers that changed since the last write through shadow_reg are sent
+# return number of I2C writes
+def write_etroc1_config(reg_val, slave_addr_A, slave_addr_B, shadow_reg, force=False):
+    slave_A_size = ETROC1_ArrayReg._slaveASize
+    return shadow_reg.write(slave_addr_A, reg_val[:slave_A_size], force) + shadow_reg.write(slave_addr_B, reg_val[slave_A_size:], force)
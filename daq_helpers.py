@@ -3,19 +3,27 @@
 import time
 #import visa
 import threading
+import multiprocessing
 import numpy as np
 import matplotlib
 import os
+import pickle
+import tempfile
 # matplotlib.use('WebAgg')
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from queue import Queue
 from collections import deque
+from collections import namedtuple
 import queue
 from command_interpret import *
 from ETROC1_ArrayReg import *
 from translate_data import *
+from daq_io import *
+from daq_ring import *
+from event_builder import *
+from daq_metrics import *
 import datetime
 #========================================================================================#
 '''
@@ -24,298 +32,240 @@ import datetime
 This script is composed of all the helper functions needed for I2C comms, FPGA, etc
 '''
 #--------------------------------------------------------------------------#
-def start_periodic_L1A_WS(cmd_interpret):
-    ## 4-digit 16 bit hex, Duration is LSB 12 bits
-    ## This tells us how many memory slots to use
-    register_11(cmd_interpret, 0x0deb)
-    time.sleep(0.01)
-
-    ## 4-digit 16 bit hex, 0xWXYZ
-    ## WX (8 bit) -  Error Mask
-    ## Y - trigSize[1:0],Period,testTrig
-    ## Z - Input command
-    register_12(cmd_interpret, 0x0030)          # This is periodic Idle FC
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0deb)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0032)          # This is periodic BC Reset FC
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0000)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0035)          # This is periodic Qinj FC
-    cmd_interpret.write_config_reg(10, 0x0001)
-    cmd_interpret.write_config_reg(9, 0x0001)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0036)          # This is periodic L1A FC
-    cmd_interpret.write_config_reg(10, 0x01f0)
-    cmd_interpret.write_config_reg(9, 0x01ff)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)              # This initializes the memory and starts the FC cycles
-    time.sleep(0.01)
-    
-def start_onetime_L1A_WS(cmd_interpret):
-    ## 4-digit 16 bit hex, Duration is LSB 12 bits
-    ## This tells us how many memory slots to use
-    register_11(cmd_interpret, 0x0deb)
-    time.sleep(0.01)
-
-    ## 4-digit 16 bit hex, 0xWXYZ
-    ## WX (8 bit) -  Error Mask
-    ## Y - trigSize[1:0],Period,testTrig
-    ## Z - Input command
-    register_12(cmd_interpret, 0x0000)          # This is onetime Idle FC
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0deb)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0002)          # This is onetime BC Reset FC
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0000)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0005)          # This is onetime Qinj FC
-    cmd_interpret.write_config_reg(10, 0x0001)
-    cmd_interpret.write_config_reg(9, 0x0001)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0006)          # This is onetime L1A FC
-    cmd_interpret.write_config_reg(10, 0x01f0)
-    cmd_interpret.write_config_reg(9, 0x01ff)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)              # This initializes the memory and starts the FC cycles
-    time.sleep(0.01)
+## Words that the FPGA pads the FIFO readout with, never written or translated
+fifo_fillers = np.array([0, 38912, 9961472, 2550136832], dtype=np.uint32)
 
-def start_L1A(cmd_interpret):
-    ## dec = 3564
-    register_11(cmd_interpret, 0x0deb)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0030)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0deb)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0032)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0000)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0035)
-    cmd_interpret.write_config_reg(10, 0x0001)
-    cmd_interpret.write_config_reg(9, 0x0001)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0036)
-    cmd_interpret.write_config_reg(10, 0x01f9)
-    cmd_interpret.write_config_reg(9, 0x01f9)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)
-    time.sleep(0.01)
+#--------------------------------------------------------------------------#
+## Strip the FIFO fillers from a readout, returns native uint32 words
+def strip_fifo_fillers(words):
+    words = np.asarray(words, dtype=np.uint32)
+    return words[~np.isin(words, fifo_fillers)]
 
-def start_L1A_1MHz(cmd_interpret):
-    register_11(cmd_interpret, 0x0de7)
-    time.sleep(0.01)
-
-    register_12(cmd_interpret, 0x0030)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0de7)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-    
-    register_12(cmd_interpret, 0x0032)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0000)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    for index in range(89):
-        register_12(cmd_interpret, 0x0035)
-        cmd_interpret.write_config_reg(10, 0x0001 + index*40)
-        cmd_interpret.write_config_reg(9, 0x0001 + index*40)
-        fc_init_pulse(cmd_interpret)
-        time.sleep(0.01)
-
-        register_12(cmd_interpret, 0x0036)
-        cmd_interpret.write_config_reg(10, 0x019 + index*40)
-        cmd_interpret.write_config_reg(9, 0x019 + index*40)
-        fc_init_pulse(cmd_interpret)
-        time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)
-    time.sleep(0.01)
+#--------------------------------------------------------------------------#
+## Format words as '032b' text lines in one go
+def words_to_binary_text(words):
+    bits = (words[:, None] >> np.arange(31, -1, -1, dtype=np.uint32)) & 1
+    text = np.empty((len(words), 33), dtype=np.uint8)
+    text[:, :32] = bits + ord('0')
+    text[:, 32] = ord('\n')
+    return text.tobytes()
 
-def start_L1A_trigger_bit(cmd_interpret):
-    register_11(cmd_interpret, 0x0deb)
+#--------------------------------------------------------------------------#
+## Format words as decimal text lines (compressed binary)
+def words_to_int_text(words):
+    if len(words) == 0: return b''
+    return ('\n'.join(map(str, words.tolist())) + '\n').encode()
 
-    time.sleep(0.01)
+#--------------------------------------------------------------------------#
+## Queue between two DAQ threads, with a capacity (items) and a policy for when it is full
+##  block    - put() waits for room, the reader falls behind (backpressure up to the FPGA FIFO)
+##  drop     - the new item is dropped and counted
+##  prescale - from half full on only every prescale-th item is kept, the rest is counted as dropped
+##  spill    - the new item is pickled to a temporary file and replayed, in order, once the queue drains
+## maxsize 0 is unbounded (plain Queue). High-water marks and counters are kept for summary()
+queue_policies = ['block', 'drop', 'prescale', 'spill']
+
+def queue_item_size(item):
+    if hasattr(item, 'words'): return len(item.words)
+    return len(item)
+
+class DAQ_queue(Queue):
+    def __init__(self, name, maxsize=0, policy='block', prescale=10, spill_dir=None):
+        # Only the block policy lets Queue itself wait on maxsize, the others never wait
+        Queue.__init__(self, maxsize if policy=='block' else 0)
+        self.name = name
+        self.capacity = maxsize
+        self.policy = policy
+        self.prescale = prescale
+        self.spill_dir = spill_dir
+        self.spill_file = None
+        self.spill_read_pos = 0
+        self.spill_items = 0
+        self.high_water = 0
+        self.spill_high_water = 0
+        self.put_items = 0
+        self.dropped_items = 0
+        self.dropped_words = 0
+        self.spilled_items = 0
+        self.prescale_counter = 0
+
+    # Called by Queue with self.mutex held
+    def _put(self, item):
+        self.put_items += 1
+        full = self.capacity > 0 and len(self.queue) >= self.capacity
+        if self.policy=='spill' and (full or self.spill_items > 0):
+            self.spill(item)
+        elif self.policy=='prescale' and self.capacity > 0 and len(self.queue) >= self.capacity//2:
+            self.prescale_counter += 1
+            if not full and self.prescale_counter % self.prescale == 0: self.queue.append(item)
+            else: self.drop(item)
+        elif self.policy=='drop' and full:
+            self.drop(item)
+        else:
+            self.queue.append(item)
+        self.high_water = max(self.high_water, len(self.queue))
+
+    def _get(self):
+        if len(self.queue) > 0: return self.queue.popleft()
+        return self.unspill()
+
+    def _qsize(self):
+        return len(self.queue) + self.spill_items
+
+    def drop(self, item):
+        self.dropped_items += 1
+        self.dropped_words += queue_item_size(item)
+
+    def spill(self, item):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="%s_spill_"%self.name, dir=self.spill_dir)
+        self.spill_file.seek(0, os.SEEK_END)
+        pickle.dump(item, self.spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spill_items += 1
+        self.spilled_items += 1
+        self.spill_high_water = max(self.spill_high_water, self.spill_items)
+
+    def unspill(self):
+        self.spill_file.seek(self.spill_read_pos)
+        item = pickle.load(self.spill_file)
+        self.spill_read_pos = self.spill_file.tell()
+        self.spill_items -= 1
+        if self.spill_items == 0:
+            # Drained, reuse the file from the start
+            self.spill_file.seek(0)
+            self.spill_file.truncate()
+            self.spill_read_pos = 0
+        return item
+
+    def summary(self):
+        with self.mutex:
+            text = "{}: capacity {} ({}), {} items in, high-water {}".format(self.name, self.capacity if self.capacity > 0 else "unbounded", self.policy, self.put_items, self.high_water)
+            if self.dropped_items > 0: text += ", dropped {} items ({} words)".format(self.dropped_items, self.dropped_words)
+            if self.spilled_items > 0: text += ", spilled {} items (high-water {} on disk)".format(self.spilled_items, self.spill_high_water)
+        return text
+
+    def close(self):
+        if self.spill_file is not None: self.spill_file.close()
 
-    # IDLE
-    register_12(cmd_interpret, 0x0070)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0deb)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-    
-    # BCR
-    # register_12(cmd_interpret, 0x0072)
-    # cmd_interpret.write_config_reg(10, 0x0000)
-    # cmd_interpret.write_config_reg(9, 0x0000)
-    # fc_init_pulse(cmd_interpret)
-    # time.sleep(0.01)
-
-    # QInj FC
-    register_12(cmd_interpret, 0x0075)
-    cmd_interpret.write_config_reg(10, 0x0005)
-    cmd_interpret.write_config_reg(9, 0x0005)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    ### Send L1A
-    register_12(cmd_interpret, 0x0076)
-    cmd_interpret.write_config_reg(10, 0x01fd)
-    cmd_interpret.write_config_reg(9, 0x01fd)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)
-
-    time.sleep(0.01)
+#--------------------------------------------------------------------------#
+## Fast command (FC) programs
+## A program is a list of segments, all sent as one register transaction (command_interpret.transaction)
+## Each segment:
+##   duration     - Register 11, 4-digit 16 bit hex, Duration is LSB 12 bits, how many memory slots to use (None: not written)
+##   steps        - (command, reg9, reg10) loaded into the FC memory one by one, command is the Register 12 key
+##                  0xWXYZ, WX (8 bit) - Error Mask, Y - trigSize[1:0],Period,testTrig, Z - Input command
+##                  e.g. 0x0030 periodic Idle, 0x0032 periodic BC Reset, 0x0035 periodic Qinj, 0x0036 periodic L1A
+##   command      - Register 12 key written after the steps (None: not written)
+##   clear_before - software_clear_fifo before the segment
+##   clear_after  - software_clear_fifo after fc_signal_start
+##   pause        - seconds to wait after the segment, splits the transaction
+fc_segment = namedtuple('fc_segment', ['duration', 'steps', 'command', 'clear_before', 'clear_after', 'pause'], defaults=(None, (), None, False, False, 0))
+
+fc_programs = {
+    'start L1A': [fc_segment(duration=0x0deb, steps=((0x0030, 0x0deb, 0x0000), (0x0032, 0x0000, 0x0000), (0x0035, 0x0001, 0x0001), (0x0036, 0x01f9, 0x01f9)))],   ## dec = 3564
+    'start L1A 1MHz': [fc_segment(duration=0x0de7, steps=((0x0030, 0x0de7, 0x0000), (0x0032, 0x0000, 0x0000))
+                                  + sum((((0x0035, 0x0001 + index*40, 0x0001 + index*40), (0x0036, 0x019 + index*40, 0x019 + index*40)) for index in range(89)), ()))],
+    'start L1A trigger bit': [fc_segment(duration=0x0deb, steps=((0x0070, 0x0deb, 0x0000), (0x0075, 0x0005, 0x0005), (0x0076, 0x01fd, 0x01fd)))],  # IDLE, QInj FC, L1A
+    'start L1A trigger bit data': [fc_segment(duration=0x0deb, steps=((0x0070, 0x0deb, 0x0000), (0x0072, 0x0000, 0x0000)))],                      # IDLE, BCR
+    'start periodic L1A WS': [fc_segment(duration=0x0deb, steps=((0x0030, 0x0deb, 0x0000), (0x0032, 0x0000, 0x0000), (0x0035, 0x0001, 0x0001), (0x0036, 0x01ff, 0x01f0)))],
+    'start onetime L1A WS': [fc_segment(duration=0x0deb, steps=((0x0000, 0x0deb, 0x0000), (0x0002, 0x0000, 0x0000), (0x0005, 0x0001, 0x0001), (0x0006, 0x01ff, 0x01f0)))],
+    'start L1A train': [fc_segment(duration=0x0021, command=0x0036, clear_after=True, pause=0.5),
+                        fc_segment(duration=0x0020, command=0x0035, clear_after=True)],
+    'stop L1A': [fc_segment(steps=((0x0030, 0x0deb, 0x0000),), clear_after=True)],
+    'stop L1A trigger bit': [fc_segment(steps=((0x0070, 0x0deb, 0x0000),))],
+    'stop L1A 1MHz': [fc_segment(steps=((0x0030, 0x0de7, 0x0000),), clear_after=True)],
+    'stop L1A 1MHz trigger bit': [fc_segment(steps=((0x0070, 0x0de7, 0x0000),), clear_after=True)],
+    'stop L1A train': [fc_segment(duration=0x0021, command=0x0006, clear_before=True, clear_after=True),
+                       fc_segment(duration=0x0020, command=0x0005, clear_after=True)],
+}
 
-def start_L1A_trigger_bit_data(cmd_interpret):
-    register_11(cmd_interpret, 0x0deb)
+#--------------------------------------------------------------------------#
+## Queue one FC program segment into a transaction
+# return the (register, value) pairs to read back
+def compile_fc_segment(batch, segment):
+    written = {}
+    if(segment.clear_before): software_clear_fifo(batch)
+    if(segment.duration is not None):
+        register_11(batch, segment.duration)
+        written[11] = segment.duration
+    for command, reg9, reg10 in segment.steps:
+        register_12(batch, command)
+        batch.write_config_reg(10, reg10)
+        batch.write_config_reg(9, reg9)
+        fc_init_pulse(batch)
+        written.update({12: command, 10: reg10, 9: reg9})
+    if(segment.command is not None):
+        register_12(batch, segment.command)
+        written[12] = segment.command
+    fc_signal_start(batch)                          # This initializes the memory and starts the FC cycles
+    if(segment.clear_after): software_clear_fifo(batch)
+    return written
 
-    time.sleep(0.01)
+#--------------------------------------------------------------------------#
+fc_barrier_timeout = 10                     # seconds to wait for the other FPGAs before each segment
+
+## Run a named FC program from fc_programs
+# With readback, the last written registers are read in the same transaction; the replies
+# only arrive once the firmware went through all the commands before them
+# With a barrier (threading.Barrier shared by the readers of several FPGAs) every segment is
+# sent once all the FPGAs have theirs ready, so the FC cycles start together
+# return True if the readback matched (always True without readback)
+def run_fc_program(cmd_interpret, name, readback=False, barrier=None):
+    segments = fc_programs[name]
+    matched = True
+    for index, segment in enumerate(segments):
+        batch = cmd_interpret.transaction()
+        written = compile_fc_segment(batch, segment)
+        if(readback):
+            for register in written: batch.read_config_reg(register)
+        if(barrier is not None):
+            try:
+                barrier.wait(fc_barrier_timeout)
+            except threading.BrokenBarrierError:
+                print("FC program '%s' could not be synchronized with the other FPGAs, sending anyway"%name)
+        batch.send()
+        if(readback and list(batch.replies) != list(written.values())):
+            print("FC program '%s' readback mismatch, wrote %s, read %s"%(name, list(written.values()), list(batch.replies)))
+            matched = False
+        if(segment.pause > 0 and index < len(segments) - 1): time.sleep(segment.pause)
+    return matched
 
-    # Idle
-    register_12(cmd_interpret, 0x0070)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0deb)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-    
-    # BCR
-    register_12(cmd_interpret, 0x0072)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0000)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-    
-    fc_signal_start(cmd_interpret)
+#--------------------------------------------------------------------------#
+def start_periodic_L1A_WS(cmd_interpret):
+    run_fc_program(cmd_interpret, 'start periodic L1A WS')
 
-    time.sleep(0.01)
-    
+def start_onetime_L1A_WS(cmd_interpret):
+    run_fc_program(cmd_interpret, 'start onetime L1A WS')
 
-def start_L1A_train(cmd_interpret):
+def start_L1A(cmd_interpret):
+    run_fc_program(cmd_interpret, 'start L1A')
 
-    ## Register 11, needs do_fc option
-    ## 4-digit 16 bit hex, Duration
-    register_11_key = 0x0021
-
-    ## Register 12, needs do_fc option
-    ## 4-digit 16 bit hex, 0xWXYZ
-    ## WX (8 bit) -  Error Mask
-    ## Y - trigSize[1:0],Period,testTrig
-    ## Z - Input command
-    register_12_key = 0x0036
-    register_11(cmd_interpret, key = register_11_key)
-    register_12(cmd_interpret, key = register_12_key)
-    fc_signal_start(cmd_interpret)
-    software_clear_fifo(cmd_interpret) 
-    time.sleep(0.5)
+def start_L1A_1MHz(cmd_interpret):
+    run_fc_program(cmd_interpret, 'start L1A 1MHz')
 
-    register_11_key = 0x0020
-    register_12_key = 0x0035
-    register_11(cmd_interpret, key = register_11_key)
-    register_12(cmd_interpret, key = register_12_key)
-    fc_signal_start(cmd_interpret)
-    software_clear_fifo(cmd_interpret) 
+def start_L1A_trigger_bit(cmd_interpret):
+    run_fc_program(cmd_interpret, 'start L1A trigger bit')
 
-def stop_L1A(cmd_interpret):
-    register_12(cmd_interpret, 0x0030)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0deb)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
+def start_L1A_trigger_bit_data(cmd_interpret):
+    run_fc_program(cmd_interpret, 'start L1A trigger bit data')
 
-    fc_signal_start(cmd_interpret)
-    time.sleep(0.01)
+def start_L1A_train(cmd_interpret):
+    run_fc_program(cmd_interpret, 'start L1A train')
 
-    software_clear_fifo(cmd_interpret)
-    time.sleep(0.01)
+def stop_L1A(cmd_interpret):
+    run_fc_program(cmd_interpret, 'stop L1A')
 
 def stop_L1A_trigger_bit(cmd_interpret):
-    register_12(cmd_interpret, 0x0070)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0deb)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)
-    time.sleep(0.01)
-
-    # software_clear_fifo(cmd_interpret)
-    time.sleep(0.01)
+    run_fc_program(cmd_interpret, 'stop L1A trigger bit')
 
 def stop_L1A_1MHz(cmd_interpret):
-    register_12(cmd_interpret, 0x0030)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0de7)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)
-    time.sleep(0.01)
-
-    software_clear_fifo(cmd_interpret)
-    time.sleep(0.01)
+    run_fc_program(cmd_interpret, 'stop L1A 1MHz')
 
 def stop_L1A_1MHz_trigger_bit(cmd_interpret):
-    register_12(cmd_interpret, 0x0070)
-    cmd_interpret.write_config_reg(10, 0x0000)
-    cmd_interpret.write_config_reg(9, 0x0de7)
-    fc_init_pulse(cmd_interpret)
-    time.sleep(0.01)
-
-    fc_signal_start(cmd_interpret)
-    time.sleep(0.01)
-
-    software_clear_fifo(cmd_interpret)
-    time.sleep(0.01)
+    run_fc_program(cmd_interpret, 'stop L1A 1MHz trigger bit')
 
 def stop_L1A_train(cmd_interpret):
-    software_clear_fifo(cmd_interpret)
-
-    register_11_key = 0x0021
-    register_12_key = 0x0006
-    register_11(cmd_interpret, key = register_11_key)
-    register_12(cmd_interpret, key = register_12_key)
-    fc_signal_start(cmd_interpret)
-    software_clear_fifo(cmd_interpret) 
-
-    register_11_key = 0x0020
-    register_12_key = 0x0005
-    register_11(cmd_interpret, key = register_11_key)
-    register_12(cmd_interpret, key = register_12_key)
-    fc_signal_start(cmd_interpret)
-    software_clear_fifo(cmd_interpret) 
+    run_fc_program(cmd_interpret, 'stop L1A train')
 
 def link_reset(cmd_interpret):
     software_clear_fifo(cmd_interpret) 
@@ -369,14 +319,18 @@ class Save_FPGA_data(threading.Thread):
         if not t.alive:
             print("Check Link Thread detected alive=False")
         time.sleep(sleep_time)
-        read_register   = self.cmd_interpret.read_config_reg(7)
-        fpga_duration   = int(format(read_register, '016b')[-6:], base=2)
-        read_register   = self.cmd_interpret.read_config_reg(8)
-        en_L1A          = format(read_register, '016b')[-11]
-        fpga_data       = int(format(self.cmd_interpret.read_status_reg(4), '016b')+format(self.cmd_interpret.read_status_reg(3), '016b'), base=2)
-        fpga_header     = int(format(self.cmd_interpret.read_status_reg(6), '016b')+format(self.cmd_interpret.read_status_reg(5), '016b'), base=2)
-        fpga_state      = int(format(self.cmd_interpret.read_status_reg(7), '016b'), base=2)
-        fpga_triggerbit = int(format(self.cmd_interpret.read_status_reg(9), '016b')+format(self.cmd_interpret.read_status_reg(8), '016b'), base=2)
+        # All registers in one round trip
+        with self.cmd_interpret.transaction() as batch:
+            batch.read_config_reg(7)
+            batch.read_config_reg(8)
+            for addr in range(3, 10): batch.read_status_reg(addr)
+        reg_7, reg_8, status_3, status_4, status_5, status_6, status_7, status_8, status_9 = batch.replies
+        fpga_duration   = int(format(reg_7, '016b')[-6:], base=2)
+        en_L1A          = format(reg_8, '016b')[-11]
+        fpga_data       = int(format(status_4, '016b')+format(status_3, '016b'), base=2)
+        fpga_header     = int(format(status_6, '016b')+format(status_5, '016b'), base=2)
+        fpga_state      = int(format(status_7, '016b'), base=2)
+        fpga_triggerbit = int(format(status_9, '016b')+format(status_8, '016b'), base=2)
         outfile.write(f'{fpga_state},{en_L1A},{fpga_duration},{fpga_data},{fpga_header},{fpga_triggerbit},{self.DAC_Val}\n')
         outfile.close()
         stop_L1A_trigger_bit(self.cmd_interpret)
@@ -384,8 +338,10 @@ class Save_FPGA_data(threading.Thread):
 #--------------------------------------------------------------------------#
 
 # define a receive data threading class
+## fc_barrier: see run_fc_program, for runs with several FPGAs
+## metrics: Stage_metrics of the thread (see daq_metrics.py), own one if not given
 class Receive_data(threading.Thread):
-    def __init__(self, name, queue, cmd_interpret, num_fifo_read, read_thread_handle, write_thread_handle, time_limit, use_IPC = False, stop_DAQ_event = None, IPC_queue = None):
+    def __init__(self, name, queue, cmd_interpret, num_fifo_read, read_thread_handle, write_thread_handle, time_limit, use_IPC = False, stop_DAQ_event = None, IPC_queue = None, fc_barrier = None, metrics = None):
         threading.Thread.__init__(self, name=name)
         self.queue = queue
         self.cmd_interpret = cmd_interpret
@@ -396,6 +352,11 @@ class Receive_data(threading.Thread):
         self.use_IPC = use_IPC
         self.stop_DAQ_event = stop_DAQ_event
         self.IPC_queue = IPC_queue
+        self.fc_barrier = fc_barrier
+        self.metrics = metrics if metrics is not None else Stage_metrics(name)
+        self.words_read = 0
+        self.chunks_read = 0
+        self.run_time = 0
         if self.use_IPC and self.IPC_queue is None:
             self.use_IPC = False
         if not self.use_IPC:
@@ -410,6 +371,7 @@ class Receive_data(threading.Thread):
         t = threading.current_thread()              # Local reference of THIS thread object
         t.alive = True                              # Thread is alive by default
         mem_data = []
+        seq = 0
         total_start_time = time.time()
         print("{} is reading data and pushing to the queue...".format(self.getName()))
         while ((time.time()-total_start_time<=self.time_limit)):
@@ -421,30 +383,16 @@ class Receive_data(threading.Thread):
                         self.daq_on = True
                     elif message == 'stop DAQ':
                         self.daq_on = False
-                    elif message == 'start L1A':
-                        start_L1A(self.cmd_interpret)
-                    elif message == 'start L1A 1MHz':
-                        start_L1A_1MHz(self.cmd_interpret)
-                    elif message == 'start L1A trigger bit':
-                        start_L1A_trigger_bit(self.cmd_interpret)
-                    # elif message == 'start L1A 1MHz trigger bit':
-                    #     start_L1A_1MHz_trigger_bit(self.cmd_interpret)
-                    elif message == 'start L1A trigger bit data':
-                        start_L1A_trigger_bit_data(self.cmd_interpret)
-                    elif message == 'stop L1A':
-                        stop_L1A(self.cmd_interpret)
-                    elif message == 'stop L1A 1MHz':
-                        stop_L1A_1MHz(self.cmd_interpret)
-                    elif message == 'stop L1A trigger bit':
-                        stop_L1A_trigger_bit(self.cmd_interpret)
-                    elif message == 'stop L1A 1MHz trigger bit':
-                        stop_L1A_1MHz_trigger_bit(self.cmd_interpret)
-                    elif message == 'stop L1A train':
-                        stop_L1A_train(self.cmd_interpret)
-                    elif message == 'start L1A train':
-                        start_L1A_train(self.cmd_interpret)
+                    ## 'start L1A', 'stop L1A 1MHz', ... see fc_programs
+                    elif message in fc_programs:
+                        switch_time = time.time()
+                        run_fc_program(self.cmd_interpret, message, readback=True, barrier=self.fc_barrier)
+                        print("{} took {:.1f} ms".format(message, 1000*(time.time()-switch_time)))
                     elif message == 'allow threads to exit':
                         self.stop_DAQ_event.set()
+                    ## Leave the read loop, the other threads finish what was read
+                    elif message == 'stop run':
+                        break
                     elif message == 'link reset':
                         link_reset(self.cmd_interpret)
                     ## Special if condition for delay change during the DAQ
@@ -459,9 +407,15 @@ class Receive_data(threading.Thread):
 
             if self.daq_on:
                 # max allowed by read_memory is 65535
-                mem_data = self.cmd_interpret.read_data_fifo(self.num_fifo_read)
-                for mem_line in mem_data:
-                    self.queue.put(mem_line) 
+                with self.metrics.timer('recv'):
+                    mem_data = self.cmd_interpret.read_data_fifo_array(self.num_fifo_read)
+                with self.metrics.timer('put_wait'):
+                    self.queue.put(fifo_chunk(seq, time.time(), mem_data))
+                seq += 1
+                self.words_read += len(mem_data)
+                self.chunks_read += 1
+                self.metrics.count('words_in', len(mem_data))
+                self.metrics.count('chunks')
             if not t.alive:
                 print("Read Thread detected alive=False")
                 # self.is_alive = False
@@ -474,6 +428,7 @@ class Receive_data(threading.Thread):
                 print("Stopping Read Thread")
                 # self.is_alive = False
                 break
+        self.run_time = time.time() - total_start_time
         print("Read Thread gracefully sending STOP signal to other threads") 
         self.read_thread_handle.set()
         # self.is_alive = False
@@ -484,7 +439,7 @@ class Receive_data(threading.Thread):
 
 # define a write data class
 class Write_data(threading.Thread):
-    def __init__(self, name, read_queue, translate_queue, num_line, store_dict, binary_only, compressed_binary, skip_binary, make_plots, read_thread_handle, write_thread_handle, translate_thread_handle, stop_DAQ_event = None):
+    def __init__(self, name, read_queue, translate_queue, num_line, store_dict, binary_only, compressed_binary, skip_binary, make_plots, read_thread_handle, write_thread_handle, translate_thread_handle, stop_DAQ_event = None, raw_format = 'txt', run_info = None, metrics = None):
         threading.Thread.__init__(self, name=name)
         self.read_queue = read_queue
         self.translate_queue = translate_queue
@@ -498,11 +453,24 @@ class Write_data(threading.Thread):
         self.write_thread_handle = write_thread_handle
         self.translate_thread_handle = translate_thread_handle
         self.stop_DAQ_event = stop_DAQ_event
+        self.raw_format = raw_format
+        self.run_info = run_info if run_info is not None else {}
+        self.metrics = metrics if metrics is not None else Stage_metrics(name)
+        self.words_written = 0                      # FIFO words without the fillers
         # self.is_alive = False
 
     # def check_alive(self):
     #     return self.is_alive
 
+    def open_outfile(self, file_counter):
+        if(self.raw_format=='bin'):
+            outfile = open("./%s/TDC_Data_%d.bin"%(self.store_dict, file_counter), 'wb')
+            write_raw_header(outfile, dict(self.run_info, file_counter=file_counter, file_time=time.time()))
+        else:
+            outfile = open("./%s/TDC_Data_%d.dat"%(self.store_dict, file_counter), 'wb')
+        print("{} is reading queue and writing file {}...".format(self.getName(), file_counter))
+        return outfile
+
     def run(self):
         t = threading.current_thread()              # Local reference of THIS thread object
         t.alive = True                              # Thread is alive by default
@@ -510,8 +478,7 @@ class Write_data(threading.Thread):
         file_lines = 0
         file_counter = 0
         if (not self.skip_binary):
-            outfile = open("./%s/TDC_Data_%d.dat"%(self.store_dict, file_counter), 'w')
-            print("{} is reading queue and writing file {}...".format(self.getName(), file_counter))
+            outfile = self.open_outfile(file_counter)
         else:
             print("{} is reading queue and pushing binary onwards...".format(self.getName()))
         retry_count = 0
@@ -525,15 +492,15 @@ class Write_data(threading.Thread):
                 outfile.close()
                 file_lines=0
                 file_counter = file_counter + 1
-                outfile = open("./%s/TDC_Data_%d.dat"%(self.store_dict, file_counter), 'w')
-                print("{} is reading queue and writing file {}...".format(self.getName(), file_counter))
+                outfile = self.open_outfile(file_counter)
             elif(file_lines>self.num_line):
                 file_lines=0
                 file_counter = file_counter + 1
-            mem_data = ""
+            chunk = None
             # Attempt to pop off the read_queue for 30 secs, fail if nothing found
             try:
-                mem_data = self.read_queue.get(True, 1)
+                with self.metrics.timer('get_wait'):
+                    chunk = self.read_queue.get(True, 1)
                 retry_count = 0
             except queue.Empty:
                 if not self.stop_DAQ_event.is_set():
@@ -549,20 +516,37 @@ class Write_data(threading.Thread):
                 # self.read_thread_handle.set()
                 # self.is_alive = False
                 break
-            # Handle the raw (binary) line
-            if int(mem_data) == 0: continue # Waiting for IPC
-            if int(mem_data) == 38912: continue # got a Filler
-            if int(mem_data) == 9961472: continue # got a Filler
-            if int(mem_data) == 2550136832: continue # got a Filler
-            binary = format(int(mem_data), '032b')
-            if(not self.skip_binary):
-                if(self.compressed_binary): outfile.write('%d\n'%int(mem_data))
-                else: outfile.write('%s\n'%binary)
-            # Increment line counters
-            file_lines = file_lines + 1
+            # Handle the raw (binary) words, zeros are sent while waiting for IPC, the rest are fillers
+            mem_data = strip_fifo_fillers(chunk.words)
+            self.words_written += len(mem_data)
+            self.metrics.count('words_in', len(chunk.words))
+            self.metrics.count('words_out', len(mem_data))
+            start = 0
+            while start < len(mem_data):
+                # Same rotation as line by line, every file gets num_line+1 lines
+                if(file_lines>self.num_line and (not self.skip_binary)):
+                    outfile.close()
+                    file_lines=0
+                    file_counter = file_counter + 1
+                    outfile = self.open_outfile(file_counter)
+                elif(file_lines>self.num_line):
+                    file_lines=0
+                    file_counter = file_counter + 1
+                block = mem_data[start:start+self.num_line+1-file_lines]
+                if(not self.skip_binary):
+                    if(self.raw_format=='bin'): data = block.astype('<u4', copy=False)
+                    elif(self.compressed_binary): data = words_to_int_text(block)
+                    else: data = words_to_binary_text(block)
+                    with self.metrics.timer('write'):
+                        outfile.write(data)
+                    self.metrics.count('bytes_written', data.nbytes if self.raw_format=='bin' else len(data))
+                # Increment line counters
+                file_lines = file_lines + len(block)
+                start = start + len(block)
             # Perform translation related activities if requested
-            if(self.make_plots or (not self.binary_only)):
-                self.translate_queue.put(binary)
+            if(len(mem_data)>0 and (self.make_plots or (not self.binary_only))):
+                with self.metrics.timer('put_wait'):
+                    self.translate_queue.put(fifo_chunk(chunk.seq, chunk.recv_time, mem_data))
             if self.write_thread_handle.is_set():
                 # print("Write Thread received STOP signal")
                 if not self.translate_thread_handle.is_set():
@@ -580,8 +564,66 @@ class Write_data(threading.Thread):
         print("%s finished!"%self.getName())
 
 #--------------------------------------------------------------------------#
+## Decoder of one ETROC2 channel in its own process, see Translate_data(channels=...)
+## Gets (seq, channel words, positions) from in_queue, puts the closed frames on out_queue in the
+## same order as packed frames (etroc2_decode_channel_packed): a few arrays per chunk, the text is
+## made by the merging thread for the whole chunk. The link state stays here for the whole run
+## (its decoding statistics go back with every chunk)
+translate_worker_inflight = 4               # chunks handed to the workers before the oldest is merged
+
+class Channel_translator(multiprocessing.Process):
+    def __init__(self, name, channel, board_ID, compressed_translation):
+        multiprocessing.Process.__init__(self, name=name, daemon=True)
+        self.channel = channel
+        self.board_ID = board_ID
+        self.compressed_translation = compressed_translation
+        self.in_queue = multiprocessing.Queue()
+        self.out_queue = multiprocessing.Queue()
+        self.stats = np.zeros(len(etroc2_stat_names), dtype=np.int64)
+
+    def run(self):
+        link_state = ETROC2_link_state(self.channel, self.board_ID)
+        try:
+            while True:
+                task = self.in_queue.get()
+                if task is None: break
+                seq, channel_words, positions = task
+                self.out_queue.put((etroc2_decode_channel_packed(channel_words, positions, link_state, self.compressed_translation), link_state.stats.copy()))
+        except KeyboardInterrupt as e:
+            pass
+
+    ## Packed frames of the oldest chunk not collected yet
+    def result(self):
+        while True:
+            try:
+                frames, self.stats = self.out_queue.get(True, 1)
+                return frames
+            except queue.Empty:
+                if not self.is_alive(): raise RuntimeError("%s died"%self.name)
+
+    def stop(self):
+        if self.is_alive(): self.in_queue.put(None)
+        self.join(5)
+        if self.is_alive(): self.terminate()
+
+#--------------------------------------------------------------------------#
+## channels: decode these channels in one Channel_translator process each (see active_channels_key),
+## the frames are merged back in stream order so the output is the same as decoding in this thread
+## fpga: which FPGA of the board lists (board_ID, ...) this data comes from
+## event_builder: Event_builder (see event_builder.py) fed with every frame
+## translated_format: 'text' TDC_Data_translated_N.dat files, 'columnar' numpy chunks (see Translated_columnar_writer)
+## metrics: Stage_metrics of the thread, decode_errors and frames_dropped from the decoding statistics
+## trigger_qinj: trigger times of Qinj operation, for the ns times of the columnar output (see trigger_time_ns)
+## The decoding errors (etroc2_stats_summary) are printed at most every link_stats_print_time seconds,
+## the statistics of the run are saved in TDC_Link_stats.json (see write_link_stats)
+## Chunks already waiting in the translate queue are decoded together up to translate_batch_words
+## words: at low fill rates the reader hands over many small chunks, and the fixed cost of every
+## decode and format call would dominate
+link_stats_print_time = 10
+translate_batch_words = 65536
+
 class Translate_data(threading.Thread):
-    def __init__(self, name, translate_queue, plot_queue, cmd_interpret, num_line, timestamp, store_dict, binary_only, make_plots, board_ID, write_thread_handle, translate_thread_handle, plotting_thread_handle, compressed_translation, stop_DAQ_event = None):
+    def __init__(self, name, translate_queue, plot_queue, cmd_interpret, num_line, timestamp, store_dict, binary_only, make_plots, board_ID, write_thread_handle, translate_thread_handle, plotting_thread_handle, compressed_translation, stop_DAQ_event = None, channels = None, fpga = 0, event_builder = None, translated_format = 'text', metrics = None, trigger_qinj = False):
         threading.Thread.__init__(self, name=name)
         self.translate_queue = translate_queue
         self.plot_queue = plot_queue
@@ -592,54 +634,146 @@ class Translate_data(threading.Thread):
         self.binary_only = binary_only
         self.make_plots = make_plots
         self.board_ID = board_ID
-        self.queue_ch = [deque() for i in range(4)]
-        self.link_ch  = ["" for i in range(4)]
+        self.fpga = fpga
+        self.event_builder = event_builder
+        self.translated_format = translated_format
+        self.metrics = metrics if metrics is not None else Stage_metrics(name, fpga)
+        self.trigger_qinj = trigger_qinj
+        self.trigger_state = Trigger_time_state()
+        self.links = ETROC2_links(board_ID, fpga+1)
+        self.link_states = self.links[fpga]
         self.write_thread_handle = write_thread_handle
         self.translate_thread_handle = translate_thread_handle
         self.plotting_thread_handle = plotting_thread_handle
         self.stop_DAQ_event = stop_DAQ_event
-        self.hitmap = {i:np.zeros((16,16)) for i in range(4)}
         self.compressed_translation = compressed_translation
+        self.channels = channels
+        self.workers = {}
+        self.pending = deque()                      # (packed frames decoded here, channels sent to workers, trigger times) per chunk
+        self.printed_stats = np.zeros((etroc2_channels, len(etroc2_stat_names)), dtype=np.int64)
+        self.stats_print_time = time.time()
         # self.is_alive = False
 
     # def check_alive(self):
     #     return self.is_alive
 
+    ## Trigger times of a chunk, for etroc2_attach_trigger_times
+    def chunk_triggers(self, chunk):
+        previous = self.trigger_state.last_time
+        return trigger_timestamps(*trigger_time_words(chunk.words), self.trigger_state) + (previous,)
+
+    ## The chunk and those waiting behind it (up to translate_batch_words words) as one chunk
+    def take_batch(self, chunk):
+        chunks = [chunk]
+        nwords = len(chunk.words)
+        while(nwords<translate_batch_words):
+            try:
+                chunk = self.translate_queue.get(False)
+            except queue.Empty:
+                break
+            chunks.append(chunk)
+            nwords = nwords + len(chunk.words)
+        if(len(chunks)==1): return chunks[0]
+        return fifo_chunk(chunks[0].seq, chunks[0].recv_time, np.concatenate([chunk.words for chunk in chunks]))
+
+    ## Demultiplex a chunk to the channel workers, channels without a worker are decoded here
+    def dispatch(self, chunk):
+        triggers = self.chunk_triggers(chunk)
+        packs = []
+        channels = []
+        for channel, (channel_words, positions) in etroc2_demux_chunk(chunk.words, self.timestamp).items():
+            if channel in self.workers:
+                self.workers[channel].in_queue.put((chunk.seq, channel_words, positions))
+                channels.append(channel)
+            else:
+                packs.append(etroc2_decode_channel_packed(channel_words, positions, self.link_states[channel], self.compressed_translation))
+        self.pending.append((packs, channels, triggers))
+
+    ## Packed frames (etroc2_merge_packed) of the oldest dispatched chunk in stream order
+    def merge(self):
+        packs, channels, triggers = self.pending.popleft()
+        with self.metrics.timer('worker_wait'):
+            for channel in channels: packs.append(self.workers[channel].result())
+        positions, records, lengths = etroc2_merge_packed(packs)
+        etroc2_attach_trigger_times_packed(positions, records, lengths, *triggers)
+        return records, lengths
+
+    ## Write the packed frames of a chunk and hand its hits to the plotter, return the number of lines
+    ## Whole chunks are formatted at once (see Translated_text_writer.write_records)
+    def output_frames(self, records, lengths, writer):
+        self.metrics.start_timer('output')
+        lines = len(records) + int(np.sum(records['KIND']==ETROC2_HEADER)) - len(lengths)
+        if(writer is not None): writer.write_records(records, lengths)
+        if(self.event_builder is not None and len(lengths)>0): self.event_builder.add_frames(np.split(records, np.cumsum(lengths)[:-1]))
+        # Hand the whole chunk of hits to the plotter at once, as (channel, row, col) rows
+        if(self.make_plots and len(records)>0):
+            hits = records[records['KIND']==ETROC2_DATA]
+            if(len(hits)>0): self.plot_queue.put(np.column_stack((hits['CHANNEL'], hits['ROW'], hits['COL'])).astype(np.int64))
+        self.metrics.stop_timer('output')
+        self.metrics.count('frames', len(lengths))
+        self.metrics.count('lines', lines)
+        return lines
+
+    ## Decoding statistics of the channels of this FPGA (channel, etroc2_stat_names)
+    def link_stats(self):
+        stats = self.links.stats[self.fpga].copy()
+        for channel, worker in self.workers.items(): stats[channel] = worker.stats
+        return stats
+
+    ## Decoding errors since the last print, at most every link_stats_print_time seconds (final: now)
+    ## The metrics follow the statistics on every call
+    def report_link_stats(self, final=False):
+        stats = self.link_stats()
+        self.metrics.set('decode_errors', int(stats[:, :etroc2_error_count].sum()))
+        self.metrics.set('frames_dropped', int(stats[:, etroc2_stat_frames_dropped].sum()))
+        if(not final and time.time() - self.stats_print_time < link_stats_print_time): return
+        summary = etroc2_stats_summary(stats, self.printed_stats)
+        if(summary): print("{} decoding errors in {:.0f} s: {}".format(self.getName(), time.time() - self.stats_print_time, summary))
+        self.printed_stats = stats
+        self.stats_print_time = time.time()
+
     def run(self):
         t = threading.current_thread()
         t.alive = True
         # self.is_alive = True
         total_lines = 0
-        file_lines = 0
-        file_counter = 0
-        if(not self.binary_only): 
-            outfile = open("./%s/TDC_Data_translated_%d.dat"%(self.store_dict, file_counter), 'w')
-            print("{} is reading queue and translating file {}...".format(self.getName(), file_counter))
+        if(not self.binary_only and self.translated_format=='columnar'):
+            writer = Translated_columnar_writer(self.store_dict, self.num_line, self.compressed_translation, self.getName(), self.trigger_qinj)
+        elif(not self.binary_only): 
+            writer = Translated_text_writer(self.store_dict, self.num_line, self.compressed_translation, self.getName())
         else:
+            writer = None
             print("{} is reading queue and translating...".format(self.getName()))
+        if(self.channels is not None and self.timestamp!=1):
+            for channel in self.channels:
+                self.workers[channel] = Channel_translator("Channel_translator_%d"%channel, channel, self.links.board_ID[self.fpga, channel], self.compressed_translation)
+                self.workers[channel].start()
+            print("{} decoding channels {} in separate processes".format(self.getName(), sorted(self.workers)))
         retry_count = 0
         while True:
             if not t.alive:
                 print("Translate Thread detected alive=False")
-                if(not self.binary_only): outfile.close()
+                for worker in self.workers.values(): worker.terminate()
+                self.workers = {}
+                self.pending.clear()
+                if(not self.binary_only): writer.close()
                 # self.is_alive = False
                 break 
             # if self.translate_thread_handle.is_set():
             #     print("Translate Thread received STOP signal from Write Thread")
             #     if(not self.binary_only): outfile.close()
             #     break
-            if((not self.binary_only) and file_lines>self.num_line):
-                outfile.close()
-                file_lines=0
-                file_counter = file_counter + 1
-                outfile = open("./%s/TDC_Data_translated_%d.dat"%(self.store_dict, file_counter), 'w')
-                print("{} is reading queue and translating file {}...".format(self.getName(), file_counter))
-            binary = ""
+            if(not self.binary_only): writer.check_rotation()
+            chunk = None
             # Attempt to pop off the translate_queue for 30 secs, fail if nothing found
             try:
-                binary = self.translate_queue.get(True, 1)
+                with self.metrics.timer('get_wait'):
+                    chunk = self.translate_queue.get(True, 1)
+                chunk = self.take_batch(chunk)
                 retry_count = 0
             except queue.Empty:
+                # Nothing new, finish what the workers have
+                while(len(self.pending)>0): total_lines = total_lines + self.output_frames(*self.merge(), writer)
                 if not self.stop_DAQ_event.is_set:
                     retry_count = 0
                     continue
@@ -653,39 +787,19 @@ class Translate_data(threading.Thread):
                 # self.read_write_handle.set()
                 # self.is_alive = False
                 break
-            TDC_data, write_flag = etroc_translate_binary(binary, self.timestamp, self.queue_ch, self.link_ch, self.board_ID, self.hitmap, self.compressed_translation)
-            if(write_flag==1):
-                pass
-                # if(not self.binary_only): 
-                #     outfile.write("%s\n"%TDC_data)
-                #     file_lines = file_lines + 1
-                # total_lines = total_lines + 1
-                # if(TDC_data[0:6]=='ETROC1'):
-                #     if(self.make_plots): self.plot_queue.put(TDC_data)
-            elif(write_flag==2):
-                TDC_len = len(TDC_data)
-                TDC_header_index = -1
-                for j,TDC_line in enumerate(TDC_data):
-                    if(TDC_line=="HEADER_KEY"):
-                        if(TDC_header_index<0):
-                            TDC_header_index = j
-                        else:
-                            print("ERROR! Found more than two headers in data block!!")
-                            sys.exit(1)
-                        continue
-                    if(not self.binary_only): 
-                        if(self.compressed_translation):
-                            if(TDC_header_index<0):
-                                pass
-                            else:
-                                outfile.write("%s\n"%TDC_line)
-                        else:
-                            outfile.write("%s\n"%TDC_line)
-                    if(TDC_line[9:13]!='DATA'): continue
-                    if(self.make_plots): self.plot_queue.put(TDC_line)
-                if(TDC_len>0):
-                    if(not self.binary_only): file_lines  = file_lines  + TDC_len - 1
-                    total_lines = total_lines + (TDC_len-1)
+            # ETROC1 and control words are not written out (see etroc_translate_binary), only ETROC2 frames are
+            self.metrics.count('words_in', len(chunk.words))
+            self.report_link_stats()
+            if(len(self.workers)==0):
+                with self.metrics.timer('decode'):
+                    triggers = self.chunk_triggers(chunk)
+                    positions, records, lengths = etroc2_decode_chunk_packed(chunk.words, self.link_states, self.timestamp, self.compressed_translation)
+                    etroc2_attach_trigger_times_packed(positions, records, lengths, *triggers)
+                total_lines = total_lines + self.output_frames(records, lengths, writer)
+            else:
+                with self.metrics.timer('decode'):
+                    self.dispatch(chunk)
+                while(len(self.pending)>translate_worker_inflight): total_lines = total_lines + self.output_frames(*self.merge(), writer)
             if self.translate_thread_handle.is_set():
                 # print("Translate Thread received STOP signal")
                 if not self.plotting_thread_handle.is_set():
@@ -698,6 +812,14 @@ class Translate_data(threading.Thread):
                 # self.is_alive = False
                 # break
         
+        while(len(self.pending)>0): total_lines = total_lines + self.output_frames(*self.merge(), writer)
+        self.report_link_stats(final=True)
+        if(not self.binary_only): write_link_stats(self.store_dict, self.printed_stats, self.getName(), self.fpga)
+        for worker in self.workers.values(): worker.stop()
+        if(self.event_builder is not None):
+            self.event_builder.close()
+            print(self.event_builder.summary())
+        if(not self.binary_only): writer.close()
         print("Translate Thread gracefully sending STOP signal to plotting thread") 
         self.translate_thread_handle.set()
         self.plotting_thread_handle.set()
@@ -705,18 +827,25 @@ class Translate_data(threading.Thread):
         print("%s finished!"%self.getName())
 
 #--------------------------------------------------------------------------#
+## Live hitmaps of the (channel, row, col) hit arrays put by Translate_data, one per board
+## The hits of every plot_queue_time (at most plot_max_fps frames per second) are shown, the
+## color scales and colorbars are only updated every plot_full_draw_time seconds: a full draw
+## of the figure costs more than ten blitted frames
+plot_max_fps        = 5
+plot_full_draw_time = 5
+
 class DAQ_Plotting(threading.Thread):
-    def __init__(self, name, queue, timestamp, store_dict, pixel_address, board_type, board_size, plot_queue_time, translate_thread_handle, plotting_thread_handle):
+    def __init__(self, name, queue, timestamp, store_dict, board_type, board_size, plot_queue_time, translate_thread_handle, plotting_thread_handle, metrics = None):
         threading.Thread.__init__(self, name=name)
         self.queue = queue
         self.timestamp = timestamp
         self.store_dict = store_dict
-        self.pixel_address = pixel_address
         self.board_type = board_type
         self.board_size = board_size
         self.plot_queue_time = plot_queue_time
         self.translate_thread_handle = translate_thread_handle
         self.plotting_thread_handle = plotting_thread_handle
+        self.metrics = metrics if metrics is not None else Stage_metrics(name)
         # self.is_alive = False
 
     def run(self):
@@ -724,150 +853,96 @@ class DAQ_Plotting(threading.Thread):
         t.alive = True
         # self.is_alive = True
 
-        ch0 = np.zeros((int(np.sqrt(self.board_size[0])),int(np.sqrt(self.board_size[0])))) 
-        ch1 = np.zeros((int(np.sqrt(self.board_size[1])),int(np.sqrt(self.board_size[1])))) 
-        ch2 = np.zeros((int(np.sqrt(self.board_size[2])),int(np.sqrt(self.board_size[2])))) 
-        ch3 = np.zeros((int(np.sqrt(self.board_size[3])),int(np.sqrt(self.board_size[3])))) 
+        # One square hitmap per board, all of them in one flat array of counts
+        sides = np.array([int(np.sqrt(size)) for size in self.board_size])
+        offsets = np.cumsum([0] + [side*side for side in sides])
+        counts = np.zeros(offsets[-1])
+        hitmaps = [counts[offsets[i]:offsets[i+1]].reshape(side, side) for i, side in enumerate(sides)]
 
         plt.ion()
         # fig, ((ax0, ax1), (ax2, ax3)) = plt.subplots(2,2, dpi=75)
-        fig = plt.figure(dpi=75, figsize=(5,5))
-        gs = fig.add_gridspec(8,8)
-        ax0 = fig.add_subplot(gs[0:int(np.sqrt(self.board_size[0]))//4, 0:int(np.sqrt(self.board_size[0]))//4])
-        ax1 = fig.add_subplot(gs[4:4+int(np.sqrt(self.board_size[1]))//4, 0:int(np.sqrt(self.board_size[1]))//4])
-        ax2 = fig.add_subplot(gs[0:int(np.sqrt(self.board_size[2]))//4, 4:4+int(np.sqrt(self.board_size[2]))//4])
-        ax3 = fig.add_subplot(gs[4:4+int(np.sqrt(self.board_size[3]))//4, 4:4+int(np.sqrt(self.board_size[3]))//4])
-
-        if(len(self.board_type)>0):
-            ax0.set_title('Channel 0: ETROC {:d}'.format(self.board_type[0]))       
-        if(len(self.board_type)>1):
-            ax1.set_title('Channel 1: ETROC {:d}'.format(self.board_type[1]))
-        if(len(self.board_type)>2):
-            ax2.set_title('Channel 2: ETROC {:d}'.format(self.board_type[2]))
-        if(len(self.board_type)>3):
-            ax3.set_title('Channel 3: ETROC {:d}'.format(self.board_type[3]))
-        
-        img0 = ax0.imshow(ch0, interpolation='none', vmin=1)
-        ax0.set_aspect('equal')
-        img1 = ax1.imshow(ch1, interpolation='none', vmin=1)
-        ax1.set_aspect('equal')
-        img2 = ax2.imshow(ch2, interpolation='none', vmin=1)
-        ax2.set_aspect('equal')
-        img3 = ax3.imshow(ch3, interpolation='none', vmin=1)
-        ax3.set_aspect('equal')
-
-        ax0.get_xaxis().set_visible(False)
-        ax0.get_yaxis().set_visible(False)
-        # ax0.set_frame_on(False)
-        ax1.get_xaxis().set_visible(False)
-        ax1.get_yaxis().set_visible(False)
-        # ax1.set_frame_on(False)
-        ax2.get_xaxis().set_visible(False)
-        ax2.get_yaxis().set_visible(False)
-        # ax2.set_frame_on(False)
-        ax3.get_xaxis().set_visible(False)
-        ax3.get_yaxis().set_visible(False)
-        # ax3.set_frame_on(False)
-
-        divider = make_axes_locatable(ax0)
-        cax = divider.append_axes('right', size='5%', pad=0.05)
-        fig.colorbar(img0, cax=cax, orientation='vertical')
-        divider = make_axes_locatable(ax1)
-        cax = divider.append_axes('right', size='5%', pad=0.05)
-        fig.colorbar(img1, cax=cax, orientation='vertical')
-        divider = make_axes_locatable(ax2)
-        cax = divider.append_axes('right', size='5%', pad=0.05)
-        fig.colorbar(img2, cax=cax, orientation='vertical')
-        divider = make_axes_locatable(ax3)
-        cax = divider.append_axes('right', size='5%', pad=0.05)
-        fig.colorbar(img3, cax=cax, orientation='vertical')
+        # Boards fill the columns top to bottom, two per column, each in a 4x4 block of the grid
+        ncols = (len(sides)+1)//2
+        fig = plt.figure(dpi=75, figsize=(2.5*ncols,5))
+        gs = fig.add_gridspec(8,4*ncols)
+        images = []
+        for i, side in enumerate(sides):
+            row, col = 4*(i%2), 4*(i//2)
+            ax = fig.add_subplot(gs[row:row+side//4, col:col+side//4])
+            if(len(self.board_type)>i):
+                ax.set_title('Channel {:d}: ETROC {:d}'.format(i, self.board_type[i]))
+            # Animated images are left out of the full draws, they are blitted on the saved background
+            img = ax.imshow(hitmaps[i], interpolation='none', vmin=1, animated=True)
+            ax.set_aspect('equal')
+            ax.get_xaxis().set_visible(False)
+            ax.get_yaxis().set_visible(False)
+            # ax.set_frame_on(False)
+            divider = make_axes_locatable(ax)
+            cax = divider.append_axes('right', size='5%', pad=0.05)
+            fig.colorbar(img, cax=cax, orientation='vertical')
+            images.append(img)
 
         # plt.tight_layout()
         # plt.draw()
-        # def init():etroc_translate_binary
-        #     line.set_data([], [])
-        #     return line,
-        # def animate(i):
-        #     x = np.linspace(0, 4, 1000)
-        #     y = np.sin(2 * np.pi * (x - 0.01 * i))
-        #     line.set_data(x, y)
-        #     return line,
-        # anim = FuncAnimation(fig, animate, init_func=init,
-        #                                frames=200, interval=20, blit=False)
-        # anim.save('sine_wave.gif', writer='imagemagick')
+        blit = getattr(fig.canvas, 'supports_blit', False)
+        if(not blit):
+            for img in images: img.set_animated(False)
+        plt.show(block=False)
+        background = None
+        frame_time = max(self.plot_queue_time, 1./plot_max_fps)
+        last_full_draw = 0
+        nhits = 0
+        next_draw = time.time() + frame_time
 
         while(True):
-            ch0 = np.zeros((int(np.sqrt(self.board_size[0])),int(np.sqrt(self.board_size[0])))) 
-            ch1 = np.zeros((int(np.sqrt(self.board_size[1])),int(np.sqrt(self.board_size[1])))) 
-            ch2 = np.zeros((int(np.sqrt(self.board_size[2])),int(np.sqrt(self.board_size[2])))) 
-            ch3 = np.zeros((int(np.sqrt(self.board_size[3])),int(np.sqrt(self.board_size[3])))) 
-            img0.set_data(ch0)
-            img0.autoscale()
-            img1.set_data(ch1)
-            img1.autoscale()
-            img2.set_data(ch2)
-            img2.autoscale()
-            img3.set_data(ch3)
-            img3.autoscale()
             if not t.alive:
                 print("Plotting Thread detected alive=False")
                 # self.is_alive = False
                 break
             if self.plotting_thread_handle.is_set():
                 print("Plot Thread received STOP signal from Translate Thread")
-                # wait for translate thread to die...
-                # while(self.translate_thread_handle.is_set() == False):
-                    # time.sleep(1)
                 # self.is_alive = False
                 break
-            start_time = time.time()
-            delta_time = 0
-            mem_data = []
-            while(delta_time < self.plot_queue_time):
-                try:
-                    task = self.queue.get(False)                # Empty exception is thrown right away
-                    mem_data.append(task)
-                except queue.Empty:                             # Handle empty queue here
-                    pass
-                # else:                                         # Handle task here and call q.task_done()
-                delta_time = time.time() - start_time
-
-            for line in mem_data:
-                words = line.split()
-                if(words[0]=="ETROC1"):
-                    if(words[1]=="0"):   ch0[(self.pixel_address[0]%4),self.pixel_address[0]//4] += 1
-                    elif(words[1]=="1"): ch1[(self.pixel_address[1]%4),self.pixel_address[1]//4] += 1
-                    elif(words[1]=="2"): ch2[(self.pixel_address[2]%4),self.pixel_address[2]//4] += 1
-                    elif(words[1]=="3"): ch3[(self.pixel_address[3]%4),self.pixel_address[3]//4] += 1
-                elif(words[0]=="ETROC2"):
-                    if(words[2]!="DATA"): continue
-                    if(words[1]=="0"):   ch0[15-int(words[8]),15-int(words[6])] += 1
-                    elif(words[1]=="1"): ch1[15-int(words[8]),15-int(words[6])] += 1
-                    elif(words[1]=="2"): ch2[15-int(words[8]),15-int(words[6])] += 1
-                    elif(words[1]=="3"): ch3[15-int(words[8]),15-int(words[6])] += 1
-                elif(words[0]=="ETROC3"): continue
-                else: continue
-
-            img0.set_data(ch0)
-            img0.autoscale()
-            img1.set_data(ch1)
-            img1.autoscale()
-            img2.set_data(ch2)
-            img2.autoscale()
-            img3.set_data(ch3)
-            img3.autoscale()
-            # ax0.relim()
-            # ax0.autoscale_view()
-            # ax1.relim()
-            # ax1.autoscale_view()
-            # ax2.relim()
-            # ax2.autoscale_view()
-            # ax3.relim()
-            # ax3.autoscale_view()
-            # plt.tight_layout()
-            fig.canvas.draw_idle()
-            plt.pause(0.01)
-            print("This pass of the Plotting function loop parsed {:d} lines of output".format(len(mem_data)))
+            # Sleep on the queue until hits come or it is time to draw
+            try:
+                with self.metrics.timer('get_wait'):
+                    hits = self.queue.get(True, max(0, next_draw - time.time()))
+                # (channel, row, col) of every hit, flat index into counts, counted all at once
+                channel = hits[:, 0].astype(np.int64)
+                hits = hits[channel < len(sides)]
+                channel = channel[channel < len(sides)]
+                side = sides[channel]
+                pixels = offsets[channel] + (side-1-hits[:, 1])*side + side-1-hits[:, 2]
+                if(len(pixels)>0): counts += np.bincount(pixels, minlength=len(counts))
+                nhits += len(pixels)
+                self.metrics.count('hits_in', len(pixels))
+            except queue.Empty:
+                pass
+            if(time.time() < next_draw): continue
+            next_draw = max(next_draw + frame_time, time.time())
+
+            # Color scales (and colorbars) follow the counts on full draws, blitting in between only redraws the images
+            full_draw = not blit or background is None or time.time() - last_full_draw > plot_full_draw_time
+            self.metrics.start_timer('draw')
+            for i, img in enumerate(images):
+                img.set_data(hitmaps[i])
+                if(full_draw): img.autoscale()
+            if(blit):
+                if(full_draw):
+                    fig.canvas.draw()
+                    background = fig.canvas.copy_from_bbox(fig.bbox)
+                    last_full_draw = time.time()
+                fig.canvas.restore_region(background)
+                for img in images: img.axes.draw_artist(img)
+                fig.canvas.blit(fig.bbox)
+            else:
+                fig.canvas.draw_idle()
+            fig.canvas.flush_events()
+            self.metrics.stop_timer('draw')
+            self.metrics.count('draws')
+            print("This pass of the Plotting function loop counted {:d} hits".format(nhits))
+            counts[:] = 0
+            nhits = 0
 
         plt.ioff()
         plt.show()
@@ -876,9 +951,161 @@ class DAQ_Plotting(threading.Thread):
         # self.is_alive = False
         print("Plotting Thread broke out of loop")
 
+#--------------------------------------------------------------------------#
+## Translation (and plotting) in a child process, so the reader thread has the interpreter to itself
+## Write_data puts the FIFO chunks into a Shared_ring_buffer (see daq_ring.py) instead of the
+## translate queue, the usual Translate_data and DAQ_Plotting threads run here on the other end
+## metrics_queue: multiprocessing queue the metrics of these threads go to (Metrics_registry.add_remote)
+class Translate_process(multiprocessing.Process):
+    def __init__(self, name, ring_name, num_line, timestamp, store_dict, binary_only, make_plots, board_ID, compressed_translation, plot_queue_size = 0, board_type = None, board_size = None, plot_queue_time = None, channels = None, fpga = 0, event_window = None, event_channels = None, translated_format = 'text', metrics_queue = None, trigger_qinj = False):
+        multiprocessing.Process.__init__(self, name=name)
+        self.ring_name = ring_name
+        self.num_line = num_line
+        self.timestamp = timestamp
+        self.store_dict = store_dict
+        self.binary_only = binary_only
+        self.make_plots = make_plots
+        self.board_ID = board_ID
+        self.compressed_translation = compressed_translation
+        self.plot_queue_size = plot_queue_size
+        self.board_type = board_type
+        self.board_size = board_size
+        self.plot_queue_time = plot_queue_time
+        self.channels = channels
+        self.fpga = fpga
+        self.event_window = event_window                # None: no event building
+        self.event_channels = event_channels
+        self.translated_format = translated_format
+        self.metrics_queue = metrics_queue
+        self.trigger_qinj = trigger_qinj
+
+    def run(self):
+        ring = Shared_ring_buffer(self.ring_name)
+        metrics = Metrics_registry()
+        write_thread_handle = threading.Event()
+        translate_thread_handle = threading.Event()
+        plotting_thread_handle = threading.Event()
+        stop_DAQ_event = threading.Event()
+        plot_queue = DAQ_queue('plot_queue', self.plot_queue_size, 'drop')
+        event_builder = Event_builder(self.event_channels, self.event_window, self.store_dict, trigger_qinj=self.trigger_qinj) if self.event_window is not None else None
+        metrics.add_queue('plot_queue', plot_queue, self.fpga)
+        threads = [Translate_data('Translate_data', ring, plot_queue, None, self.num_line, self.timestamp, self.store_dict, self.binary_only, self.make_plots, self.board_ID, write_thread_handle, translate_thread_handle, plotting_thread_handle, self.compressed_translation, stop_DAQ_event, self.channels, self.fpga, event_builder, self.translated_format, metrics.stage('Translate_data', self.fpga), self.trigger_qinj)]
+        if(self.make_plots):
+            threads.append(DAQ_Plotting('DAQ_Plotting', plot_queue, self.timestamp, self.store_dict, self.board_type, self.board_size, self.plot_queue_time, translate_thread_handle, plotting_thread_handle, metrics.stage('DAQ_Plotting', self.fpga)))
+        reporter = Metrics_reporter('Metrics_reporter', metrics, 0, self.metrics_queue) if self.metrics_queue is not None else None
+        if(reporter is not None): reporter.start()
+        for thread in threads: thread.start()
+        try:
+            # Write_data closes the ring after its last chunk, what is left in the ring is still translated
+            while not ring.closed() and threads[0].is_alive():
+                time.sleep(0.1)
+            write_thread_handle.set()
+            stop_DAQ_event.set()
+            translate_thread_handle.set()
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt as e:
+            for thread in threads: thread.alive = False
+            for thread in threads: thread.join()
+        if(reporter is not None): reporter.stop()
+        print(plot_queue.summary())
+        plot_queue.close()
+        ring.release()
+        print("%s finished!"%self.name)
 
 #--------------------------------------------------------------------------#
+## I2C engine of the FPGA
+## A transaction is config registers 4/5 (mode, slave, wr, reg_addr, data) plus a pulse on bit 0
+## of the pulse register, sent together once the previous transaction is done on the bus:
+##  - busy_status_reg set: poll read_status_reg(busy_status_reg) & busy_mask until it clears
+##  - otherwise: wait fallback_wait after the pulse, the 10 ms the transactions always had
+## The firmware busy flag is not documented, so status polling is off until it is known
+iic_busy_status_reg = None                  # Status register holding a busy flag, None if there is none
+iic_busy_mask       = 0x0000                # Busy flag(s) in that status register
+iic_fallback_wait   = 0.01                  # seconds a transaction is given without a busy flag
+
+class IIC_engine(object):
+    def __init__(self, cmd_interpret, busy_status_reg=iic_busy_status_reg, busy_mask=iic_busy_mask, timeout=0.01, fallback_wait=iic_fallback_wait):
+        self.cmd_interpret = cmd_interpret
+        self.busy_status_reg = busy_status_reg
+        self.busy_mask = busy_mask
+        self.timeout = timeout
+        self.fallback_wait = fallback_wait
+        self.busy_until = 0                 # time.time() when the bus is expected to be free
+        self.busy = False
+        self.transactions = 0               # running timing of the transaction calls
+        self.total_time = 0.
+        self.max_time = 0.
+        self.timeouts = 0
+
+    ## wait until the last transaction is done on the bus
+    def wait(self):
+        if not self.busy: return
+        if self.busy_status_reg is not None:
+            deadline = time.time() + self.timeout
+            while self.cmd_interpret.read_status_reg(self.busy_status_reg) & self.busy_mask:
+                if time.time() > deadline:
+                    self.timeouts += 1
+                    print("I2C transaction did not finish within {:.1f} ms".format(1000*self.timeout))
+                    break
+        else:
+            remaining = self.busy_until - time.time()
+            if remaining > 0: time.sleep(remaining)
+        self.busy = False
+
+    ## one I2C transaction, returns once it is started on the bus (after the previous one is done)
+    # @param mode[1:0] : '0'is 1 bytes read or wirte, '1' is 2 bytes read or write, '2' is 3 bytes read or write
+    # @param slave[6:0]: slave device address
+    # @param wr: 1-bit '0' is write, '1' is read
+    # @param reg_addr[7:0] : register address
+    # @param data[7:0] : 8-bit write data
+    def transaction(self, mode, slave_addr, wr, reg_addr, data=0x00):
+        start_time = time.time()
+        val = mode << 24 | slave_addr << 17 | wr << 16 | reg_addr << 8 | data
+        self.wait()
+        with self.cmd_interpret.transaction() as batch:
+            batch.write_config_reg(4, 0xffff & val)
+            batch.write_config_reg(5, 0xffff & (val>>16))
+            batch.write_pulse_reg(0x0001)                                     # Sent a pulse to IIC module
+        self.busy_until = time.time() + self.fallback_wait
+        self.busy = True
+        elapsed = time.time() - start_time
+        self.transactions += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    ## write consecutive registers of one slave, back to back
+    def write_block(self, slave_addr, start_reg, data):
+        for index, value in enumerate(data):
+            self.transaction(1, slave_addr, 0, start_reg + index, value)
+        self.wait()
+
+    ## read consecutive registers of one slave
+    def read_block(self, slave_addr, start_reg, count, mode=0):
+        values = []
+        for reg_addr in range(start_reg, start_reg + count):
+            self.transaction(mode, slave_addr, 0, reg_addr)                   # write device addr and reg addr
+            self.transaction(mode, slave_addr, 1, reg_addr)                   # write device addr and read one byte
+            self.wait()
+            values += [self.cmd_interpret.read_status_reg(0) & 0xff]
+        return values
+
+    ## timing of the transactions so far
+    def stats(self):
+        count = self.transactions
+        return {'transactions': count, 'total_s': self.total_time, 'mean_ms': 1000*self.total_time/count if count else 0,
+                'max_ms': 1000*self.max_time, 'timeouts': self.timeouts}
+
+## One I2C engine per connection, shared by iic_write/iic_read
+## It lives on the cmd_interpret, so it goes away with the connection
+def get_iic_engine(cmd_interpret):
+    engine = getattr(cmd_interpret, 'iic_engine', None)
+    if engine is None:
+        engine = cmd_interpret.iic_engine = IIC_engine(cmd_interpret)
+    return engine
 
+#--------------------------------------------------------------------------#
 ## IIC write slave device
 # @param mode[1:0] : '0'is 1 bytes read or wirte, '1' is 2 bytes read or write, '2' is 3 bytes read or write
 # @param slave[7:0] : slave device address
@@ -886,12 +1113,9 @@ class DAQ_Plotting(threading.Thread):
 # @param reg_addr[7:0] : register address
 # @param data[7:0] : 8-bit write data
 def iic_write(mode, slave_addr, wr, reg_addr, data, cmd_interpret):
-    val = mode << 24 | slave_addr << 17 | wr << 16 | reg_addr << 8 | data
-    cmd_interpret.write_config_reg(4, 0xffff & val)
-    cmd_interpret.write_config_reg(5, 0xffff & (val>>16))
-    time.sleep(0.01)
-    cmd_interpret.write_pulse_reg(0x0001)                                     # reset ddr3 data fifo
-    time.sleep(0.01)
+    engine = get_iic_engine(cmd_interpret)
+    engine.transaction(mode, slave_addr, wr, reg_addr, data)
+    engine.wait()
 
 #--------------------------------------------------------------------------#
 ## IIC read slave device
@@ -900,18 +1124,10 @@ def iic_write(mode, slave_addr, wr, reg_addr, data, cmd_interpret):
 # @param wr: 1-bit '0' is write, '1' is read
 # @param reg_addr[7:0] : register address
 def iic_read(mode, slave_addr, wr, reg_addr, cmd_interpret):
-    val = mode << 24 | slave_addr << 17 |  0 << 16 | reg_addr << 8 | 0x00	  # write device addr and reg addr
-    cmd_interpret.write_config_reg(4, 0xffff & val)
-    cmd_interpret.write_config_reg(5, 0xffff & (val>>16))
-    time.sleep(0.01)
-    cmd_interpret.write_pulse_reg(0x0001)				                      # Sent a pulse to IIC module
-
-    val = mode << 24 | slave_addr << 17 | wr << 16 | reg_addr << 8 | 0x00	  # write device addr and read one byte
-    cmd_interpret.write_config_reg(4, 0xffff & val)
-    cmd_interpret.write_config_reg(5, 0xffff & (val>>16))
-    time.sleep(0.01)
-    cmd_interpret.write_pulse_reg(0x0001)				                      # Sent a pulse to IIC module
-    time.sleep(0.01)									                      # delay 10ns then to read data
+    engine = get_iic_engine(cmd_interpret)
+    engine.transaction(mode, slave_addr, 0, reg_addr)                         # write device addr and reg addr
+    engine.transaction(mode, slave_addr, wr, reg_addr)                        # write device addr and read one byte
+    engine.wait()
     return cmd_interpret.read_status_reg(0) & 0xff
 #--------------------------------------------------------------------------#
 ## Enable FPGA Descrambler
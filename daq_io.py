@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import struct
+import numpy as np
+from translate_data import *
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script is composed of functions to write and read the binary DAQ files
+'''
+#----------------------------------------------------------------------------------------#
+## Raw data files (TDC_Data_N.bin)
+## magic (8 bytes) | version (uint32) | header length (uint32) | run info (JSON, space padded)
+## followed by little-endian uint32 FIFO words. The header length is a multiple of 8 so the
+## words can be memory-mapped in place.
+raw_magic   = b'ETROCRAW'
+raw_version = 1
+
+#----------------------------------------------------------------------------------------#
+## Write the header of a raw data file
+# @param[in] outfile file opened in 'wb'
+# @param[in] run_info dictionary with the run options, board_ID, timestamp mode, start time...
+def write_raw_header(outfile, run_info):
+    info = json.dumps(run_info, default=str).encode()
+    header_len = 16 + len(info)
+    header_len += (-header_len) % 8
+    outfile.write(raw_magic + struct.pack('<II', raw_version, header_len) + info.ljust(header_len-16))
+
+#----------------------------------------------------------------------------------------#
+## Read the header of a raw data file
+# return (run info dictionary, offset of the first word)
+def read_raw_header(path):
+    with open(path, 'rb') as infile:
+        magic = infile.read(8)
+        if(magic!=raw_magic):
+            raise ValueError("%s is not a binary raw data file"%path)
+        version, header_len = struct.unpack('<II', infile.read(8))
+        if(version!=raw_version):
+            raise ValueError("%s has unknown raw data version %d"%(path, version))
+        run_info = json.loads(infile.read(header_len-16).decode())
+    return run_info, header_len
+
+#----------------------------------------------------------------------------------------#
+## Memory-map the words of a raw data file, nothing is copied
+# return numpy.memmap of uint32 words
+def load_raw_words(path):
+    run_info, offset = read_raw_header(path)
+    if(os.path.getsize(path)<=offset): return np.zeros(0, dtype='<u4')
+    return np.memmap(path, dtype='<u4', mode='r', offset=offset)
+
+#----------------------------------------------------------------------------------------#
+## Read a TDC_Data_N.dat file, either '032b' lines or decimal lines (--compressed_binary)
+# return numpy array of uint32 words
+def load_raw_text(path):
+    with open(path, 'rb') as infile:
+        content = infile.read()
+    if(len(content)==0): return np.zeros(0, dtype=np.uint32)
+    if(content.find(b'\n')==32):
+        lines = np.frombuffer(content, dtype=np.uint8)[:(len(content)//33)*33].reshape(-1, 33)
+        bits = np.packbits(lines[:, :32] - ord('0'), axis=1)
+        return bits.view('>u4').ravel().astype(np.uint32)
+    # Malformed lines raise a ValueError instead of ending the array early
+    return np.array(content.split(), dtype=np.int64).astype(np.uint32)
+
+#----------------------------------------------------------------------------------------#
+## Read the words of a raw data file of any of the Write_data formats
+def load_raw_file(path):
+    if(path.endswith('.bin')): return load_raw_words(path)
+    return load_raw_text(path)
+
+#----------------------------------------------------------------------------------------#
+## Raw data files of a run directory in the order Write_data wrote them
+def raw_file_list(directory):
+    files = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if(not stem.startswith('TDC_Data_') or ext not in ('.dat', '.bin')): continue
+        counter = stem[len('TDC_Data_'):]
+        if(counter.isdigit()): files.append((int(counter), os.path.join(directory, name)))
+    return [path for counter, path in sorted(files)]
+
+#----------------------------------------------------------------------------------------#
+## Writes decoded ETROC2 frames as TDC_Data_translated_N.dat text files
+## Every frame is written to one file, files rotate once they hold more than num_line lines
+class Translated_text_writer(object):
+    def __init__(self, store_dict, num_line, compressed_translation, name="Translate_data"):
+        self.store_dict = store_dict
+        self.num_line = num_line
+        self.compressed_translation = compressed_translation
+        self.name = name
+        self.file_lines = 0
+        self.file_counter = 0
+        self.outfile = None
+        self.open_outfile()
+
+    def open_outfile(self):
+        self.outfile = open(os.path.join(self.store_dict, "TDC_Data_translated_%d.dat"%self.file_counter), 'w')
+        print("{} is reading queue and translating file {}...".format(self.name, self.file_counter))
+
+    def check_rotation(self):
+        if(self.file_lines>self.num_line):
+            self.outfile.close()
+            self.file_lines = 0
+            self.file_counter = self.file_counter + 1
+            self.open_outfile()
+
+    ## Write one frame (records ending with a trailer)
+    def write_frame(self, frame):
+        self.write_records(frame, [len(frame)])
+
+    ## Write consecutive frames given as concatenated records and number of records per frame,
+    ## formatted all at once (etroc2_records_text). Same files and lines as write_lines frame by frame
+    def write_records(self, records, lengths):
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if(len(lengths)==0): return
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        frame_of = np.repeat(np.arange(len(lengths)), lengths)
+        headers = np.flatnonzero(records['KIND']==ETROC2_HEADER)
+        keep = np.ones(len(records), dtype=bool)
+        if(self.compressed_translation):
+            # Only write from the first header of every frame onwards, frames without one are not written
+            first = np.searchsorted(headers, starts)
+            first_header = np.where(first<len(headers), headers[np.minimum(first, len(headers)-1)], len(records))
+            first_header = np.where(first_header<ends, first_header, len(records))
+            keep = np.arange(len(records)) >= first_header[frame_of]
+        # Line count of etroc2_translate blocks, which held a HEADER_KEY on top of the lines
+        file_lines = np.cumsum(lengths + np.bincount(frame_of[headers], minlength=len(lengths)) - 1)
+        first = 0
+        while(first<len(lengths)):
+            self.check_rotation()
+            before = file_lines[first-1] if first>0 else 0
+            # Frames up to the one after which the file holds more than num_line lines
+            last = min(int(np.searchsorted(file_lines, self.num_line - self.file_lines + before, side='right')) + 1, len(lengths))
+            rows = slice(starts[first], ends[last-1])
+            self.outfile.write(etroc2_records_text(records[rows][keep[rows]]))
+            self.file_lines = self.file_lines + int(file_lines[last-1] - before)
+            first = last
+
+    ## Write the text lines of one frame
+    def write_lines(self, TDC_data):
+        self.check_rotation()
+        headers = [i for i, line in enumerate(TDC_data) if line.startswith("ETROC2") and " HEADER " in line]
+        if(self.compressed_translation):
+            # Only write from the header onwards
+            if(len(headers)>0): self.outfile.write("%s\n"%"\n".join(TDC_data[headers[0]:]))
+        else:
+            self.outfile.write("%s\n"%"\n".join(TDC_data))
+        # Line count of etroc2_translate blocks, which held a HEADER_KEY on top of the lines
+        self.file_lines = self.file_lines + len(TDC_data) + len(headers) - 1
+
+    def close(self):
+        if(self.outfile is not None): self.outfile.close()
+        self.outfile = None
+
+#----------------------------------------------------------------------------------------#
+## Columnar translated output (--translated_format columnar)
+## Every chunk N is two numpy.save files: TDC_Data_frames_N.npy, one record per frame (header and
+## trailer words), and TDC_Data_hits_N.npy, one record per DATA word. The hits of a frame are
+## hits[FIRST_HIT:FIRST_HIT+NHITS] of the same chunk. TDC_Data_columnar.json lists the chunks and
+## is rewritten after every chunk, so the chunks of an interrupted run can still be found.
+## Fillers are not kept, frames without a HEADER (start of the run) are dropped.
+columnar_manifest = "TDC_Data_columnar.json"
+columnar_version  = 1
+
+columnar_frame_dtype = np.dtype([
+    ('FRAME',     np.uint64),           # running frame number of the run
+    ('CHANNEL',   np.uint8),
+    ('L1COUNTER', np.uint8),
+    ('TYPE',      np.uint8),
+    ('BCID',      np.uint16),
+    ('CHIPID',    np.uint32),
+    ('STATUS',    np.uint8),
+    ('HITS',      np.uint8),
+    ('CRC',       np.uint8),
+    ('TRIGTIME',  np.uint64),           # clock cycles, see trigger_timestamps
+    ('TRIGTIME_NS', np.uint64),         # the same in ns, see trigger_time_ns
+    ('NHITS',     np.uint32),
+    ('FIRST_HIT', np.uint64),
+])
+
+columnar_hit_dtype = np.dtype([
+    ('FRAME',     np.uint64),
+    ('CHANNEL',   np.uint8),
+    ('L1COUNTER', np.uint8),
+    ('BCID',      np.uint16),
+    ('EA',        np.uint8),
+    ('COL',       np.uint8),
+    ('ROW',       np.uint8),
+    ('TOA',       np.uint16),
+    ('TOT',       np.uint16),
+    ('CAL',       np.uint16),
+])
+
+#----------------------------------------------------------------------------------------#
+## Frame and hit tables of consecutive decoded frames
+# @param[in] records etroc2_record_dtype records of the frames, every frame ends with its TRAILER
+# @param[in] lengths number of records of every frame
+# @param[in] first_frame FRAME of the first frame kept
+# @param[in] trigger_qinj trigger times of Qinj operation, see trigger_time_ns
+# return (frames, hits), FIRST_HIT counts from the first hit of these frames
+def etroc2_columns(records, lengths, first_frame=0, trigger_qinj=False):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    frame_of = np.repeat(np.arange(len(lengths)), lengths)
+    kinds = records['KIND']
+    # First HEADER of every frame, -1 if none
+    header_rows = np.flatnonzero(kinds == ETROC2_HEADER)
+    with_header, first = np.unique(frame_of[header_rows], return_index=True)
+    headers = np.full(len(lengths), -1, dtype=np.int64)
+    headers[with_header] = header_rows[first]
+    kept = np.flatnonzero(headers >= 0)
+    renumber = np.cumsum(headers >= 0) - 1
+    # DATA words after the HEADER, as written by the text format
+    data_rows = np.flatnonzero((kinds == ETROC2_DATA) & (np.arange(len(records)) > headers[frame_of]) & (headers[frame_of] >= 0))
+    hit_frames = renumber[frame_of[data_rows]]
+    nhits = np.bincount(hit_frames, minlength=len(kept))
+    header = records[headers[kept]]
+    trailer = records[np.cumsum(lengths)[kept] - 1]
+    frames = np.zeros(len(kept), dtype=columnar_frame_dtype)
+    frames['FRAME'] = first_frame + np.arange(len(kept))
+    for field in ('CHANNEL', 'L1COUNTER', 'TYPE', 'BCID'): frames[field] = header[field]
+    for field in ('CHIPID', 'STATUS', 'HITS', 'CRC', 'TRIGTIME'): frames[field] = trailer[field]
+    frames['TRIGTIME_NS'] = trigger_time_ns(frames['TRIGTIME'], trigger_qinj)
+    frames['NHITS'] = nhits
+    frames['FIRST_HIT'] = np.cumsum(nhits) - nhits
+    hits = np.zeros(len(data_rows), dtype=columnar_hit_dtype)
+    hits['FRAME'] = frames['FRAME'][hit_frames]
+    hits['L1COUNTER'] = frames['L1COUNTER'][hit_frames]
+    hits['BCID'] = frames['BCID'][hit_frames]
+    data = records[data_rows]
+    for field in ('CHANNEL', 'EA', 'COL', 'ROW', 'TOA', 'TOT', 'CAL'): hits[field] = data[field]
+    return frames, hits
+
+#----------------------------------------------------------------------------------------#
+## Writes decoded ETROC2 frames as columnar chunks, same interface as Translated_text_writer
+## A chunk is written once it holds more than num_line frames + hits
+class Translated_columnar_writer(object):
+    def __init__(self, store_dict, num_line, compressed_translation, name="Translate_data", trigger_qinj=False):
+        self.store_dict = store_dict
+        self.num_line = num_line
+        self.compressed_translation = compressed_translation
+        self.name = name
+        self.trigger_qinj = trigger_qinj
+        self.frames = []
+        self.hits = []
+        self.rows = 0
+        self.next_frame = 0
+        self.dropped = 0                    # frames without HEADER
+        self.chunks = []
+        print("{} is reading queue and translating columnar chunk {}...".format(self.name, len(self.chunks)))
+
+    def check_rotation(self):
+        if(self.rows<=self.num_line): return
+        frames = np.concatenate(self.frames)
+        hits = np.concatenate(self.hits)
+        # Cut after every frame that fills a chunk
+        rows = np.arange(1, len(frames)+1) + np.cumsum(frames['NHITS'], dtype=np.int64)
+        first_frame, first_hit = 0, 0
+        while(rows[-1] - (rows[first_frame-1] if first_frame>0 else 0) > self.num_line):
+            cut = int(np.searchsorted(rows, (rows[first_frame-1] if first_frame>0 else 0) + self.num_line, side='right')) + 1
+            nhits = int(np.sum(frames['NHITS'][first_frame:cut]))
+            self.write_chunk(frames[first_frame:cut], hits[first_hit:first_hit+nhits])
+            print("{} is reading queue and translating columnar chunk {}...".format(self.name, len(self.chunks)))
+            first_frame, first_hit = cut, first_hit + nhits
+        self.frames = [frames[first_frame:]]
+        self.hits = [hits[first_hit:]]
+        self.rows = len(self.frames[0]) + len(self.hits[0])
+
+    def write_chunk(self, frames, hits):
+        frames = frames.copy()
+        frames['FIRST_HIT'] = np.cumsum(frames['NHITS'], dtype=np.uint64) - frames['NHITS']
+        counter = len(self.chunks)
+        np.save(os.path.join(self.store_dict, "TDC_Data_frames_%d.npy"%counter), frames)
+        np.save(os.path.join(self.store_dict, "TDC_Data_hits_%d.npy"%counter), hits)
+        self.chunks.append({'frames': "TDC_Data_frames_%d.npy"%counter, 'hits': "TDC_Data_hits_%d.npy"%counter,
+                            'first_frame': int(frames['FRAME'][0]) if len(frames)>0 else self.next_frame, 'nframes': len(frames), 'nhits': len(hits)})
+        self.write_manifest()
+
+    def write_manifest(self, complete=False):
+        manifest = {'version': columnar_version, 'complete': complete, 'compressed_translation': self.compressed_translation, 'trigger_qinj': self.trigger_qinj,
+                    'frame_dtype': columnar_frame_dtype.descr, 'hit_dtype': columnar_hit_dtype.descr,
+                    'frames': sum(chunk['nframes'] for chunk in self.chunks), 'hits': sum(chunk['nhits'] for chunk in self.chunks),
+                    'frames_without_header': self.dropped, 'chunks': self.chunks}
+        path = os.path.join(self.store_dict, columnar_manifest)
+        with open(path + ".tmp", 'w') as outfile:
+            json.dump(manifest, outfile, indent=1)
+        os.replace(path + ".tmp", path)
+
+    ## Add decoded frames given as concatenated records and number of records per frame
+    def write_records(self, records, lengths):
+        if(len(lengths)==0): return
+        frames, hits = etroc2_columns(records, lengths, self.next_frame, self.trigger_qinj)
+        self.dropped += len(lengths) - len(frames)
+        self.next_frame += len(frames)
+        self.frames.append(frames)
+        self.hits.append(hits)
+        self.rows += len(frames) + len(hits)
+        self.check_rotation()
+
+    ## Add a list of decoded frames (records ending with a trailer)
+    def write_frames(self, frames):
+        if(len(frames)==0): return
+        # Joining the bytes is much faster than np.concatenate of many small structured arrays
+        records = np.frombuffer(b''.join(frame.tobytes() for frame in frames), dtype=etroc2_record_dtype)
+        self.write_records(records, [len(frame) for frame in frames])
+
+    def write_frame(self, frame):
+        self.write_frames([frame])
+
+    ## Write what is left and mark the run complete in the manifest
+    def close(self):
+        if(self.frames is None): return
+        if(self.rows>0 or len(self.chunks)==0):
+            frames = np.concatenate(self.frames) if self.frames else np.zeros(0, dtype=columnar_frame_dtype)
+            hits = np.concatenate(self.hits) if self.hits else np.zeros(0, dtype=columnar_hit_dtype)
+            self.write_chunk(frames, hits)
+        self.write_manifest(complete=True)
+        self.frames = self.hits = None
+
+#----------------------------------------------------------------------------------------#
+## Columnar chunks of a translated run, memory-mapped
+# return list of (frames, hits) per chunk, FIRST_HIT counts within the chunk
+def columnar_chunks(store_dict, mmap_mode='r'):
+    with open(os.path.join(store_dict, columnar_manifest)) as infile:
+        manifest = json.load(infile)
+    if(manifest['version']!=columnar_version):
+        raise ValueError("%s has unknown columnar version %d"%(store_dict, manifest['version']))
+    return [(np.load(os.path.join(store_dict, chunk['frames']), mmap_mode=mmap_mode), np.load(os.path.join(store_dict, chunk['hits']), mmap_mode=mmap_mode)) for chunk in manifest['chunks']]
+
+#----------------------------------------------------------------------------------------#
+## Load the columnar output of a run as (frames, hits), FIRST_HIT is made run-wide
+## A run of one chunk is returned memory-mapped, several chunks are concatenated in memory
+def load_columnar(store_dict, mmap_mode='r'):
+    chunks = columnar_chunks(store_dict, mmap_mode)
+    if(len(chunks)==1): return chunks[0]
+    frames = np.concatenate([chunk[0] for chunk in chunks])
+    frames['FIRST_HIT'] += np.repeat(np.cumsum([0] + [len(chunk[1]) for chunk in chunks[:-1]]), [len(chunk[0]) for chunk in chunks]).astype(np.uint64)
+    return frames, np.concatenate([chunk[1] for chunk in chunks])
+
+#----------------------------------------------------------------------------------------#
+## Decoding statistics of a translated run (TDC_Link_stats.json), see etroc2_stat_names
+## counts per channel and for all the channels, written once the translation is done
+link_stats_file    = "TDC_Link_stats.json"
+link_stats_version = 1
+
+# @param[in] stats int array (channel, etroc2_stat_names)
+def write_link_stats(store_dict, stats, writer, fpga=0):
+    stats = np.asarray(stats)
+    info = {'version': link_stats_version, 'writer': writer, 'fpga': fpga, 'stat_names': etroc2_stat_names,
+            'channels': {str(channel): dict(zip(etroc2_stat_names, stats[channel].tolist())) for channel in range(len(stats))},
+            'total': dict(zip(etroc2_stat_names, stats.sum(axis=0).tolist()))}
+    path = os.path.join(store_dict, link_stats_file)
+    with open(path + ".tmp", 'w') as outfile:
+        json.dump(info, outfile, indent=1)
+    os.replace(path + ".tmp", path)
+
+## Statistics of a translated run as an int array (channel, etroc2_stat_names)
+def load_link_stats(store_dict):
+    with open(os.path.join(store_dict, link_stats_file)) as infile:
+        info = json.load(infile)
+    if(info['version']!=link_stats_version):
+        raise ValueError("%s has unknown link stats version %d"%(store_dict, info['version']))
+    channels = sorted(info['channels'], key=int)
+    return np.array([[info['channels'][channel].get(name, 0) for name in etroc2_stat_names] for channel in channels], dtype=np.int64)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import time
+import queue
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script is composed of the live metrics of the DAQ threads: every thread counts the words,
+bytes and frames it handles and times what it waits on (queue get/put, FIFO reads, file writes).
+The counters are served in the Prometheus text format on localhost (HTTP port or UNIX socket)
+and summarized in one line every few seconds
+'''
+#--------------------------------------------------------------------------#
+## Counters and timers of one DAQ thread
+## Only the owning thread writes them, readers take copies (snapshot), so there is no lock.
+## counters are running totals (words, bytes, frames...), timers running seconds spent in a call.
+## A timer is (seconds of the closed calls, perf_counter start of the open call or None), set in
+## one assignment: a snapshot also counts the open part, so intervals never get more than their time
+class Stage_metrics(object):
+    def __init__(self, stage, fpga=0, counters=(), timers=()):
+        self.stage = stage
+        self.fpga = fpga
+        self.counters = {name: 0 for name in counters}
+        self.timers = {name: (0., None) for name in timers}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    ## Counters kept somewhere else (e.g. by the decoder), copied over as they are
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def add_time(self, name, seconds):
+        total, start = self.timers.get(name, (0., None))
+        self.timers[name] = (total + seconds, start)
+
+    def start_timer(self, name):
+        self.timers[name] = (self.timers.get(name, (0., None))[0], time.perf_counter())
+
+    def stop_timer(self, name):
+        total, start = self.timers[name]
+        self.timers[name] = (total + time.perf_counter() - start, None)
+
+    ## with metrics.timer('write'): ...
+    def timer(self, name):
+        return Stage_timer(self, name)
+
+    def snapshot(self):
+        now = time.perf_counter()
+        timers = {name: total + (now - start if start is not None else 0.) for name, (total, start) in dict(self.timers).items()}
+        return {'stage': self.stage, 'fpga': self.fpga, 'time': time.time(), 'counters': dict(self.counters), 'timers': timers}
+
+class Stage_timer(object):
+    __slots__ = ('metrics', 'name')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.start_timer(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.stop_timer(self.name)
+        return False
+
+#--------------------------------------------------------------------------#
+## All the stages and queues of a run
+## Queues are DAQ_queue or Shared_ring_buffer (depth in items or words, high-water, dropped).
+## Other processes (Translate_process) send their snapshots through a multiprocessing queue
+## (add_remote), the last one received is served with the local stages
+class Metrics_registry(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.stages = []
+        self.queues = []
+        self.remotes = []
+        self.remote_snapshots = {}
+
+    def stage(self, stage, fpga=0, counters=(), timers=()):
+        metrics = Stage_metrics(stage, fpga, counters, timers)
+        with self.lock: self.stages.append(metrics)
+        return metrics
+
+    def add_queue(self, name, daq_queue, fpga=0):
+        with self.lock: self.queues.append((name, fpga, daq_queue))
+
+    def add_remote(self, remote_queue):
+        with self.lock: self.remotes.append(remote_queue)
+
+    ## {'time', 'stages': [Stage_metrics.snapshot()], 'queues': [{'queue', 'fpga', 'depth', 'high_water', 'dropped'}]}
+    def snapshot(self):
+        with self.lock:
+            for i, remote_queue in enumerate(self.remotes):
+                try:
+                    while True: self.remote_snapshots[i] = remote_queue.get_nowait()
+                except (queue.Empty, OSError, ValueError):
+                    pass
+            stages = [metrics.snapshot() for metrics in self.stages]
+            queues = [{'queue': name, 'fpga': fpga, 'depth': daq_queue.qsize(), 'high_water': daq_queue.high_water,
+                       'dropped': getattr(daq_queue, 'dropped_items', getattr(daq_queue, 'words_lost', 0))} for name, fpga, daq_queue in self.queues]
+            for remote in self.remote_snapshots.values():
+                stages += remote['stages']
+                queues += remote['queues']
+        return {'time': time.time(), 'stages': stages, 'queues': queues}
+
+    ## Prometheus text exposition format
+    def prometheus_text(self):
+        snapshot = self.snapshot()
+        metrics = {}                    # name -> (type, help, [(labels, value)])
+        def add(name, kind, help_text, labels, value):
+            metrics.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+        add('etroc_daq_uptime_seconds', 'gauge', 'Seconds since the metrics were started', '', snapshot['time'] - self.start_time)
+        for stage in snapshot['stages']:
+            labels = '{fpga="%d",stage="%s"}'%(stage['fpga'], stage['stage'])
+            for name, value in stage['counters'].items():
+                add('etroc_daq_%s_total'%name, 'counter', '%s of the DAQ stage'%name.replace('_', ' '), labels, value)
+            for name, value in stage['timers'].items():
+                add('etroc_daq_%s_seconds_total'%name, 'counter', 'Seconds spent in %s'%name.replace('_', ' '), labels, value)
+        for daq_queue in snapshot['queues']:
+            labels = '{fpga="%d",queue="%s"}'%(daq_queue['fpga'], daq_queue['queue'])
+            add('etroc_daq_queue_depth', 'gauge', 'Items waiting in the queue (words for the ring buffer)', labels, daq_queue['depth'])
+            add('etroc_daq_queue_high_water', 'gauge', 'Most items seen waiting in the queue', labels, daq_queue['high_water'])
+            add('etroc_daq_queue_dropped_total', 'counter', 'Items dropped by the queue policy (words lost for the ring buffer)', labels, daq_queue['dropped'])
+        lines = []
+        for name, (kind, help_text, values) in metrics.items():
+            lines.append('# HELP %s %s'%(name, help_text))
+            lines.append('# TYPE %s %s'%(name, kind))
+            lines += ['%s%s %s'%(name, labels, repr(float(value)) if isinstance(value, float) else value) for labels, value in values]
+        return '\n'.join(lines) + '\n'
+
+#--------------------------------------------------------------------------#
+## One line with the rates of every stage since the previous snapshot
+## counters as per second rates, timers as the fraction of the time spent in them. Rates use the
+## time of every stage snapshot, those of other processes are up to metrics_publish_time old
+def format_rate(value):
+    for scale, unit in ((1e9, 'G'), (1e6, 'M'), (1e3, 'k')):
+        if abs(value) >= scale: return '%.2f%s'%(value/scale, unit)
+    return '%.1f'%value
+
+def summary_line(previous, current):
+    before = {(stage['fpga'], stage['stage']): stage for stage in previous['stages']}
+    fpgas = len(set(stage['fpga'] for stage in current['stages'])) > 1
+    parts = []
+    for stage in current['stages']:
+        old = before.get((stage['fpga'], stage['stage']), {'time': previous['time'], 'counters': {}, 'timers': {}})
+        elapsed = max(stage['time'] - old['time'], 1e-9)
+        items = ['%s %s/s'%(format_rate((value - old['counters'].get(name, 0))/elapsed), name) for name, value in stage['counters'].items()]
+        items += ['%s %.0f%%'%(name, 100*(value - old['timers'].get(name, 0.))/elapsed) for name, value in stage['timers'].items()]
+        parts.append('%s%s: %s'%('FPGA_%d '%stage['fpga'] if fpgas else '', stage['stage'], ', '.join(items)))
+    if len(current['queues']) > 0:
+        parts.append('queues: ' + ', '.join('%s%s %d'%('FPGA_%d '%daq_queue['fpga'] if fpgas else '', daq_queue['queue'], daq_queue['depth']) for daq_queue in current['queues']))
+    return 'metrics %.0f s | %s'%(current['time'] - previous['time'], ' | '.join(parts))
+
+#--------------------------------------------------------------------------#
+## Prints summary_line every interval seconds and/or sends the snapshots to another process
+# @param[in] interval seconds between summaries, 0 for none
+# @param[in] publish multiprocessing queue for the snapshots (see Metrics_registry.add_remote)
+metrics_publish_time = 1                    # seconds between snapshots sent to the parent process
+
+class Metrics_reporter(threading.Thread):
+    def __init__(self, name, registry, interval, publish=None):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self.publish = publish
+        self.stop_event = threading.Event()
+
+    def run(self):
+        previous = self.registry.snapshot()
+        next_summary = time.time() + self.interval
+        period = metrics_publish_time if self.publish is not None else self.interval
+        while not self.stop_event.wait(period):
+            self.report()
+            if self.interval > 0 and time.time() >= next_summary:
+                current = self.registry.snapshot()
+                print(summary_line(previous, current))
+                previous = current
+                next_summary = time.time() + self.interval
+        # Last (partial) interval and the final counts for the other process
+        self.report()
+        if self.interval > 0: print(summary_line(previous, self.registry.snapshot()))
+
+    def report(self):
+        if self.publish is None: return
+        snapshot = self.registry.snapshot()
+        self.publish.put({'stages': snapshot['stages'], 'queues': snapshot['queues']})
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(5)
+
+#--------------------------------------------------------------------------#
+## GET on any path returns the metrics, the same handler serves the HTTP port and the UNIX socket
+class Metrics_handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.registry.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class Unix_metrics_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    ## BaseHTTPRequestHandler wants a (host, port) client address
+    def get_request(self):
+        request, client_address = socketserver.UnixStreamServer.get_request(self)
+        return request, ('unix', 0)
+
+## Serve the registry on 127.0.0.1:port (curl localhost:port/metrics) and/or a UNIX socket
+## (curl --unix-socket path http://localhost/metrics), return the servers for stop_metrics_servers
+def serve_metrics(registry, port=None, socket_path=None):
+    servers = []
+    if port:
+        server = ThreadingHTTPServer(('127.0.0.1', port), Metrics_handler)
+        servers.append(server)
+        print("Metrics served on http://127.0.0.1:%d/metrics"%server.server_address[1])
+    if socket_path:
+        if os.path.exists(socket_path): os.unlink(socket_path)
+        server = Unix_metrics_server(socket_path, Metrics_handler)
+        servers.append(server)
+        print("Metrics served on UNIX socket %s"%socket_path)
+    for server in servers:
+        server.registry = registry
+        threading.Thread(target=server.serve_forever, name="Metrics_server", daemon=True).start()
+    return servers
+
+def stop_metrics_servers(servers):
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        if isinstance(server, Unix_metrics_server) and os.path.exists(server.server_address): os.unlink(server.server_address)
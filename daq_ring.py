@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import queue
+import numpy as np
+from collections import namedtuple
+from multiprocessing import shared_memory
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script is composed of the shared-memory ring buffer that carries FIFO chunks from the
+DAQ threads to a translation process, without pickling
+'''
+#--------------------------------------------------------------------------#
+## One readout of the data FIFO, this is what travels between the DAQ threads
+# seq       : running number of the readout
+# recv_time : time.time() when the readout was received
+# words     : numpy array of 32 bit words
+fifo_chunk = namedtuple('fifo_chunk', ['seq', 'recv_time', 'words'])
+
+#--------------------------------------------------------------------------#
+## Single producer / single consumer ring of FIFO chunks in shared memory
+## Control block (uint64, each on its own 64 byte line): head, tail, closed, capacity, reader gone
+## head and tail are running word counts, only the producer writes head and only the consumer
+## writes tail, so no lock is needed. A message is [nwords, seq, recv_time (2 words)] + words,
+## a message never wraps: the rest of the ring is skipped (ring_wrap marker) instead.
+ring_header_bytes = 512
+ring_head         = 0
+ring_tail         = 8
+ring_closed       = 16
+ring_capacity     = 24
+ring_reader_gone  = 32
+ring_wrap         = 0xFFFFFFFF
+ring_poll_time    = 0.0005
+
+class Shared_ring_buffer(object):
+    ## constructor
+    # @param[in] name shared memory block to attach to, None to create one
+    # @param[in] capacity size of the ring in 32 bit words, when creating
+    def __init__(self, name=None, capacity=1<<24):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=ring_header_bytes + 4*capacity)
+            self.control = np.ndarray((ring_header_bytes//8,), dtype=np.uint64, buffer=self.shm.buf)
+            self.control[:] = 0
+            self.control[ring_capacity] = capacity
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.control = np.ndarray((ring_header_bytes//8,), dtype=np.uint64, buffer=self.shm.buf)
+            self.owner = False
+        self.name = self.shm.name
+        self.capacity = int(self.control[ring_capacity])
+        self.data = np.ndarray((self.capacity,), dtype=np.uint32, buffer=self.shm.buf, offset=ring_header_bytes)
+        self.wait_time = 0                  # seconds the producer waited for room
+        self.high_water = 0                 # max words in the ring seen by the producer
+        self.words_lost = 0                 # words put after the consumer went away
+
+    ## words in the ring
+    def qsize(self):
+        return int(self.control[ring_head]) - int(self.control[ring_tail])
+
+    def empty(self):
+        return self.qsize() == 0
+
+    ## producer: no more chunks will be put
+    def close(self):
+        self.control[ring_closed] = 1
+
+    def closed(self):
+        return self.control[ring_closed] != 0
+
+    ## producer: copy a chunk into the ring, wait for room if needed
+    def put(self, chunk, block=True, timeout=None):
+        words = np.asarray(chunk.words, dtype=np.uint32)
+        if self.control[ring_reader_gone]:
+            self.words_lost += len(words)
+            return
+        header = np.zeros(4, dtype=np.uint32)
+        header[1] = chunk.seq & 0xFFFFFFFF
+        header[2:4] = np.array([chunk.recv_time], dtype=np.float64).view(np.uint32)
+        # Messages bigger than half the ring are split
+        max_words = self.capacity//2 - 4
+        for start in range(0, max(len(words), 1), max_words):
+            piece = words[start:start+max_words]
+            head = int(self.control[ring_head])
+            position = head % self.capacity
+            need = 4 + len(piece)
+            skip = self.capacity - position if position + need > self.capacity else 0
+            wait_start = time.time()
+            while self.capacity - (head - int(self.control[ring_tail])) < skip + need:
+                if self.control[ring_reader_gone]:
+                    self.words_lost += len(words) - start
+                    return
+                if not block or (timeout is not None and time.time() - wait_start > timeout): raise queue.Full
+                time.sleep(ring_poll_time)
+            self.wait_time += time.time() - wait_start
+            if skip > 0:
+                self.data[position] = ring_wrap
+                head += skip
+                position = 0
+            header[0] = len(piece)
+            self.data[position:position+4] = header
+            self.data[position+4:position+need] = piece
+            self.control[ring_head] = head + need                   # publish
+            self.high_water = max(self.high_water, head + need - int(self.control[ring_tail]))
+
+    ## consumer: next chunk, same interface as Queue.get
+    def get(self, block=True, timeout=None):
+        wait_start = time.time()
+        while True:
+            tail = int(self.control[ring_tail])
+            if tail != int(self.control[ring_head]):
+                position = tail % self.capacity
+                if self.capacity - position < 4 or self.data[position] == ring_wrap:
+                    self.control[ring_tail] = tail + self.capacity - position
+                    continue
+                header = self.data[position:position+4].copy()
+                nwords = int(header[0])
+                words = self.data[position+4:position+4+nwords].copy()
+                self.control[ring_tail] = tail + 4 + nwords             # release
+                return fifo_chunk(int(header[1]), float(header[2:4].view(np.float64)[0]), words)
+            if not block or (timeout is not None and time.time() - wait_start > timeout): raise queue.Empty
+            time.sleep(ring_poll_time)
+
+    def summary(self):
+        return "translate ring: {:.1f} MB, high-water {} words, producer waited {:.2f} s, {} words lost".format(4*self.capacity/1e6, self.high_water, self.wait_time, self.words_lost)
+
+    ## detach, the creating side also frees the shared memory
+    ## the consumer detaching makes the producer drop further chunks instead of waiting forever
+    def release(self):
+        if not self.owner: self.control[ring_reader_gone] = 1
+        del self.control
+        del self.data
+        self.shm.close()
+        if self.owner: self.shm.unlink()
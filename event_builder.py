@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+from collections import deque
+
+from translate_data import *
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script builds events out of the decoded ETROC2 frames: frames of all the channels with the
+same L1COUNTER are put together, and every event is written as one compact record plus an array
+of its hits. Used online by Translate_data and offline by translate_offline.py
+'''
+#--------------------------------------------------------------------------#
+## One record per event, its hits are hits[FIRST_HIT:FIRST_HIT+NHITS] of the same file
+event_dtype = np.dtype([
+    ('EVENT',     np.uint64),           # running event number of the run
+    ('L1COUNTER', np.uint8),
+    ('BCID',      np.uint16),           # BCID of the first frame
+    ('TRIGTIME',  np.uint64),           # trigger time of the first frame (clock cycles, see trigger_timestamps)
+    ('TRIGTIME_NS', np.uint64),         # the same in ns, see trigger_time_ns
+    ('CHANNELS',  np.uint8),            # bit mask of the channels with a frame
+    ('FLAGS',     np.uint8),            # event_incomplete | event_mismatch
+    ('NHITS',     np.uint32),
+    ('FIRST_HIT', np.uint64),
+])
+
+hit_dtype = np.dtype([
+    ('EVENT',   np.uint64),
+    ('CHANNEL', np.uint8),
+    ('EA',      np.uint8),
+    ('COL',     np.uint8),
+    ('ROW',     np.uint8),
+    ('TOA',     np.uint16),
+    ('TOT',     np.uint16),
+    ('CAL',     np.uint16),
+])
+
+event_incomplete = 1                    # left the reorder window without a frame of every channel
+event_mismatch   = 2                    # the frames have the same L1COUNTER but not the same BCID
+
+#--------------------------------------------------------------------------#
+## Group frames into events by L1COUNTER
+## Frames come in stream order, channel after channel in any order. An event waits in the reorder
+## window until every expected channel has a frame; events leave the window in the order they were
+## opened, an event still missing channels when the window is full goes out as incomplete.
+# @param[in] channels the channels expected in every event (see active_channels_key)
+# @param[in] window max events waiting for frames, keep it well below 256 (L1COUNTER is 8 bits)
+# @param[in] store_dict directory for the TDC_Events_N.npz files, None to keep the events in memory (take())
+# @param[in] trigger_qinj trigger times of Qinj operation, see trigger_time_ns
+class Event_builder(object):
+    def __init__(self, channels, window=64, store_dict=None, events_per_file=100000, trigger_qinj=False):
+        self.channels_mask = sum(1 << channel for channel in channels)
+        self.window = window
+        self.store_dict = store_dict
+        self.events_per_file = events_per_file
+        self.trigger_qinj = trigger_qinj
+        self.pending = deque()                  # [event, L1COUNTER, BCID, channel mask, flags, DATA records of its frames, trigger time]
+        self.open_events = {}                   # L1COUNTER -> pending events with that L1COUNTER
+        self.next_event = 0
+        self.events = []
+        self.hits = []
+        self.nhits = 0
+        self.file_counter = 0
+        self.built = 0
+        self.incomplete = 0
+        self.mismatched = 0
+        self.headerless = 0                     # frames without HEADER (start of the run, compressed translation)
+
+    ## Add one decoded frame (records ending with its TRAILER)
+    def add_frame(self, frame):
+        kinds = frame['KIND']
+        if(kinds[0] != ETROC2_HEADER):
+            headers = np.flatnonzero(kinds == ETROC2_HEADER)
+            if(len(headers)==0):
+                self.headerless += 1
+                return
+            header = frame[headers[0]]
+        else:
+            header = frame[0]
+        channel = int(header['CHANNEL'])
+        L1COUNTER = int(header['L1COUNTER'])
+        BCID = int(header['BCID'])
+        # The oldest open event with this L1COUNTER that has no frame of this channel yet
+        for event in self.open_events.get(L1COUNTER, ()):
+            if not event[3] & (1 << channel): break
+        else:
+            event = [self.next_event, L1COUNTER, BCID, 0, 0, [], int(header['TRIGTIME'])]
+            self.next_event += 1
+            self.pending.append(event)
+            self.open_events.setdefault(L1COUNTER, []).append(event)
+        if(BCID != event[2]): event[4] |= event_mismatch
+        event[3] |= 1 << channel
+        event[5].append(frame[kinds == ETROC2_DATA])
+        while(len(self.pending)>0 and (self.pending[0][3] & self.channels_mask == self.channels_mask or len(self.pending)>self.window)):
+            self.emit(self.pending.popleft())
+
+    def add_frames(self, frames):
+        for frame in frames: self.add_frame(frame)
+
+    ## Record a finished event, its hits are only copied out in take()
+    def emit(self, event):
+        number, L1COUNTER, BCID, channels, flags, data, trigger_time = event
+        open_events = self.open_events[L1COUNTER]
+        open_events.remove(event)
+        if(len(open_events)==0): del self.open_events[L1COUNTER]
+        if(channels & self.channels_mask != self.channels_mask): flags |= event_incomplete
+        nhits = sum(len(hits) for hits in data)
+        self.events.append((number, L1COUNTER, BCID, trigger_time, 0, channels, flags, nhits, self.nhits))
+        self.hits += data
+        self.nhits += nhits
+        self.built += 1
+        if(flags & event_incomplete): self.incomplete += 1
+        if(flags & event_mismatch): self.mismatched += 1
+        if(self.store_dict is not None and len(self.events)>=self.events_per_file): self.write()
+
+    ## Events built since the last take()/write(), as (events, hits) arrays
+    def take(self):
+        events = np.array(self.events, dtype=event_dtype)
+        events['TRIGTIME_NS'] = trigger_time_ns(events['TRIGTIME'], self.trigger_qinj)
+        hits = np.zeros(self.nhits, dtype=hit_dtype)
+        if(self.nhits>0):
+            # Joining the bytes is much faster than np.concatenate of many small structured arrays
+            data = np.frombuffer(b''.join(hits.tobytes() for hits in self.hits), dtype=etroc2_record_dtype)
+            hits['EVENT'] = np.repeat(events['EVENT'], events['NHITS'])
+            for field in hit_dtype.names[1:]: hits[field] = data[field]
+        self.events, self.hits, self.nhits = [], [], 0
+        return events, hits
+
+    def write(self):
+        events, hits = self.take()
+        if(len(events)==0): return
+        np.savez(os.path.join(self.store_dict, "TDC_Events_%d.npz"%self.file_counter), events=events, hits=hits)
+        self.file_counter += 1
+
+    ## Empty the reorder window, write what is left
+    def close(self):
+        while(len(self.pending)>0): self.emit(self.pending.popleft())
+        if(self.store_dict is not None): self.write()
+
+    def summary(self):
+        return "event builder: {:d} events, {:d} incomplete, {:d} BCID mismatch, {:d} frames without header".format(self.built, self.incomplete, self.mismatched, self.headerless)
+
+#--------------------------------------------------------------------------#
+## Load the events of a run directory
+# return (events, hits), FIRST_HIT is made run-wide
+def load_events(store_dict):
+    names = [name for name in os.listdir(store_dict) if name.startswith("TDC_Events_") and name.endswith(".npz")]
+    names.sort(key=lambda name: int(name[len("TDC_Events_"):-len(".npz")]))
+    events, hits = [], []
+    offset = 0
+    for name in names:
+        with np.load(os.path.join(store_dict, name)) as loaded:
+            file_events = loaded['events']
+            file_events['FIRST_HIT'] += offset
+            events.append(file_events)
+            hits.append(loaded['hits'])
+            offset += len(loaded['hits'])
+    if(len(events)==0): return np.zeros(0, dtype=event_dtype), np.zeros(0, dtype=hit_dtype)
+    return np.concatenate(events), np.concatenate(hits)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import time
+import socket
+import struct
+import threading
+import numpy as np
+from optparse import OptionParser
+
+from board_details import *
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script is a stand-in for the FPGA control_interface module, so the DAQ can be run
+and benchmarked without hardware. It answers the 32-bit big-endian command words sent
+by command_interpret (config/status registers, pulse register, memory, data FIFO) and
+fills the data FIFO with a synthetic ETROC2 + control word stream at a target rate.
+Run it, then point run_script.py at it: --hostname 127.0.0.1 --port <port>
+For a run of several FPGAs start one per FPGA, each with its own --port and --fpga.
+'''
+#--------------------------------------------------------------------------#
+pattern_3c5c = '0011110001011100'
+
+#--------------------------------------------------------------------------#
+## 40 bit ETROC2 words of one frame, as bit strings
+def etroc2_frame_bits(rng, board_ID, l1counter, bcid, hits):
+    frame = [pattern_3c5c + '00' + format(l1counter, '08b') + '00' + format(bcid, '012b')]
+    pixels = rng.choice(256, size=hits, replace=False)
+    for pixel in pixels:
+        frame.append('1' + format(rng.integers(4), '02b') + format(pixel%16, '04b') + format(pixel//16, '04b')
+                     + format(rng.integers(1024), '010b') + format(rng.integers(512), '09b') + format(rng.integers(1024), '010b'))
+    frame.append('0' + board_ID + format(rng.integers(64), '06b') + format(hits, '08b') + format(rng.integers(256), '08b'))
+    return frame
+
+#--------------------------------------------------------------------------#
+## 40 bit filler words, a frame filler or a firmware filler
+def etroc2_filler_bits(rng, l1counter, bcid):
+    if(rng.random()<0.5): return pattern_3c5c + '10' + format(l1counter, '08b') + '00' + format(bcid, '012b')
+    return pattern_3c5c + '11' + format(int(rng.integers(1<<22)), '022b')
+
+#--------------------------------------------------------------------------#
+## Bit string to FIFO words with the '11'+channel prefix
+def bits_to_words(bits, channel):
+    nwords = len(bits)//28
+    values = np.frombuffer(bits[:28*nwords].encode(), dtype=np.uint8).reshape(nwords, 28) - 48
+    weights = (1 << np.arange(27, -1, -1)).astype(np.uint32)
+    return ((values.astype(np.uint32) @ weights).astype(np.uint32)) | np.uint32((0xC | channel) << 28)
+
+#--------------------------------------------------------------------------#
+## Synthetic stream of one ETROC2 channel
+## The stream starts with a few junk bits, so the 3c5c alignment is needed, then loops over
+## a fixed set of frames whose length is a multiple of 28 bits, so the loop has no seam.
+class ETROC2_channel_stream(object):
+    def __init__(self, channel, board_ID, rng, nframes=4096, hits=2.0, fillers=0.2, errors=0.0):
+        self.channel = channel
+        words = []
+        for i in range(nframes):
+            while(rng.random()<fillers): words.append(etroc2_filler_bits(rng, i%256, i%3564))
+            frame = etroc2_frame_bits(rng, board_ID, i%256, i%3564, min(255, int(rng.poisson(hits))))
+            if(rng.random()<errors):
+                # Flip one bit of the frame
+                position = int(rng.integers(40*len(frame)))
+                word = frame[position//40]
+                frame[position//40] = word[:position%40] + ('1' if word[position%40]=='0' else '0') + word[position%40+1:]
+            words += frame
+        # lcm(40, 28) = 280, pad with firmware fillers to a multiple of 7 words
+        while(len(words)%7!=0): words.append(pattern_3c5c + '11' + '0'*22)
+        body = ''.join(words)
+        while True:
+            junk = ''.join(rng.choice(['0','1'], size=int(rng.integers(28, 56))))
+            if(not pattern_3c5c in junk + body[:15]): break
+        lead = -(-len(junk)//28)
+        stream = bits_to_words(junk + body + body, channel)
+        self.words = stream[:lead + len(body)//28]
+        self.lead = lead
+        self.cycle = len(body)//28
+        self.position = 0
+
+    def take(self, count):
+        index = np.arange(self.position, self.position + count, dtype=np.int64)
+        self.position += count
+        looped = index >= self.lead
+        index[looped] = self.lead + (index[looped] - self.lead) % self.cycle
+        return self.words[index]
+
+#--------------------------------------------------------------------------#
+## Data source of the FIFO, interleaves the enabled channels and adds control words
+class Synthetic_data_source(object):
+    def __init__(self, board_ID, seed=0, hits=2.0, fillers=0.2, errors=0.0, trigger_period=64):
+        rng = np.random.default_rng(seed)
+        self.streams = [ETROC2_channel_stream(channel, board_ID[channel], rng, hits=hits, fillers=fillers, errors=errors) for channel in range(4)]
+        self.trigger_period = trigger_period
+        self.words_made = 0
+        self.triggers_made = 0
+        self.normtrig = 0
+        self.msbtime = 0
+
+    def control_words(self, count):
+        # NORMTRIG counts up, MSBTIME follows every NORMTRIG overflow
+        words = []
+        for i in range(count):
+            self.triggers_made += 1
+            self.normtrig = (self.normtrig + 32) % (1<<26)
+            words.append(0x80000000 | self.normtrig)
+            if(self.normtrig < 32):
+                self.msbtime = (self.msbtime + 1) % (1<<26)
+                words.append(0x8C000000 | self.msbtime)
+        return words
+
+    def take(self, count, channels, timestamp):
+        active = [stream for stream in self.streams if (channels >> stream.channel) & 1]
+        ntrig = 0
+        if(timestamp and self.trigger_period > 0):
+            ntrig = (self.words_made + count)//self.trigger_period - self.words_made//self.trigger_period
+        self.words_made += count
+        control = np.array(self.control_words(ntrig), dtype=np.uint32)[:count]
+        ndata = count - len(control)
+        if(len(active)==0):
+            data = np.full(ndata, 0x98000000, dtype=np.uint32)        # control fillers
+        else:
+            split = [ndata//len(active) + (1 if i < ndata%len(active) else 0) for i in range(len(active))]
+            data = np.concatenate([stream.take(n) for stream, n in zip(active, split)])
+        if(len(control)==0): return data
+        positions = np.linspace(0, ndata, len(control), endpoint=False).astype(np.int64)
+        return np.insert(data, positions, control)
+
+#--------------------------------------------------------------------------#
+## Registers, memory, I2C slaves and data FIFO of the emulated FPGA
+class Mock_FPGA(object):
+    def __init__(self, source, rate, fifo_depth, channels, trigger="always"):
+        self.lock = threading.Lock()
+        self.source = source
+        self.rate = rate
+        self.fifo_depth = fifo_depth
+        self.default_channels = channels
+        self.trigger = trigger
+        self.config_reg = [0]*32
+        self.status_reg = [0]*16
+        self.status_reg[2] = 0x000a                 # data synced, trigger synced, no errors
+        self.memory = {}
+        self.memory_count = 0
+        self.memory_address = 0
+        self.memory_data = 0
+        self.iic_reg = {}
+        self.iic_pointer = {}
+        self.fc_commands = set()
+        self.running = (trigger=="always")
+        self.fifo_words = 0
+        self.fifo_time = time.time()
+        self.words_sent = 0
+        self.words_lost = 0
+        self.triggers = 0
+
+    def channels(self):
+        return (self.config_reg[15] & 0xf) if self.config_reg[15] else self.default_channels
+
+    def fill_fifo(self):
+        now = time.time()
+        if(self.running):
+            if(self.rate > 0): self.fifo_words += self.rate*(now - self.fifo_time)
+            else: self.fifo_words = self.fifo_depth
+            if(self.fifo_words > self.fifo_depth):
+                self.words_lost += int(self.fifo_words - self.fifo_depth)
+                self.fifo_words = self.fifo_depth
+        self.fifo_time = now
+
+    def read_fifo(self, count):
+        with self.lock:
+            self.fill_fifo()
+            ndata = min(count, int(self.fifo_words))
+            self.fifo_words -= ndata
+            words = np.zeros(count, dtype=np.uint32)
+            if(ndata > 0):
+                timestamp = (self.config_reg[13] & 0x1)==0          # active low
+                words[:ndata] = self.source.take(ndata, self.channels(), timestamp)
+                self.words_sent += ndata
+                self.triggers = self.source.triggers_made
+        return words
+
+    def write_pulse(self, data):
+        if(data & 0x0001): self.iic_transaction()
+        if(data & 0x0002):                                          # clear FIFO
+            with self.lock:
+                self.fill_fifo()
+                self.fifo_words = 0
+        if(data & 0x0004) and data!=0x0006:                         # fast command memory start
+            if(self.trigger=="l1a"): self.running = 0x6 in self.fc_commands
+            self.fc_commands = set()
+        if(data==0x0006):                                           # clear error
+            self.status_reg[2] = 0x000a
+        if(data & 0x0010):                                          # fast command init
+            self.fc_commands.add(self.config_reg[12] & 0xf)
+
+    def iic_transaction(self):
+        val = self.config_reg[5] << 16 | self.config_reg[4]
+        mode = (val >> 24) & 0x3
+        slave_addr = (val >> 17) & 0x7f
+        wr = (val >> 16) & 0x1
+        reg_addr = (val >> 8) & 0xff
+        if(wr==1):
+            self.status_reg[0] = self.iic_reg.get((slave_addr, self.iic_pointer.get(slave_addr, reg_addr)), 0)
+        elif(mode==0):
+            self.iic_pointer[slave_addr] = reg_addr                 # address only
+        else:
+            self.iic_pointer[slave_addr] = reg_addr
+            self.iic_reg[(slave_addr, reg_addr)] = val & 0xff
+
+    def read_status(self, addr):
+        if(addr in (3, 4)):  return (self.words_sent >> (16*(addr - 3))) & 0xffff
+        if(addr in (5, 6)):  return (self.triggers >> (16*(addr - 5))) & 0xffff
+        if(addr in (8, 9)):  return (self.triggers >> (16*(addr - 8))) & 0xffff
+        return self.status_reg[addr] if addr < len(self.status_reg) else 0
+
+    ## Handle one command word, return the reply bytes
+    def command(self, word):
+        read = word >> 31
+        cmd = (word >> 16) & 0x7fff
+        data = word & 0xffff
+        if(cmd & 0x0020):
+            if(read): return struct.pack('>I', self.config_reg[cmd & 0x1f])
+            self.config_reg[cmd & 0x1f] = data
+        elif(cmd==0x000b):
+            self.write_pulse(data)
+        elif(cmd==0x0019):
+            return self.read_fifo(data + 1).astype('>u4').tobytes()
+        elif(cmd==0x0014 and read):
+            values = [self.memory.get(self.memory_address + i, 0) for i in range(self.memory_count)]
+            return np.array(values, dtype='>u4').tobytes()
+        elif(cmd==0x0010): self.memory_count = data
+        elif(cmd==0x0011): self.memory_address = (self.memory_address & 0xffff0000) | data
+        elif(cmd==0x0012): self.memory_address = (self.memory_address & 0xffff) | (data << 16)
+        elif(cmd==0x0013): self.memory_data = (self.memory_data & 0xffff0000) | data
+        elif(cmd==0x0014):
+            self.memory_data = (self.memory_data & 0xffff) | (data << 16)
+            self.memory[self.memory_address] = self.memory_data
+        elif(read):
+            return struct.pack('>I', self.read_status(cmd))
+        return b''
+
+#--------------------------------------------------------------------------#
+## One client connection, commands may arrive several per packet
+class Mock_FPGA_client(threading.Thread):
+    def __init__(self, name, conn, fpga):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.conn = conn
+        self.fpga = fpga
+
+    def run(self):
+        pending = b''
+        try:
+            while True:
+                packet = self.conn.recv(65536)
+                if not packet: break
+                pending += packet
+                nwords = len(pending)//4
+                replies = [self.fpga.command(word) for word in struct.unpack('>%dI'%nwords, pending[:4*nwords])]
+                pending = pending[4*nwords:]
+                reply = b''.join(replies)
+                if reply: self.conn.sendall(reply)
+        except (ConnectionError, OSError) as e:
+            print("%s connection error: %s"%(self.getName(), e))
+        finally:
+            self.conn.close()
+        print("%s closed, %d words sent, %d words lost to FIFO overflow"%(self.getName(), self.fpga.words_sent, self.fpga.words_lost))
+
+#--------------------------------------------------------------------------#
+## Listening socket, one Mock_FPGA shared by all connections
+class Mock_FPGA_server(threading.Thread):
+    def __init__(self, name, fpga, hostname="127.0.0.1", port=1024):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.fpga = fpga
+        self.ss = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.ss.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.ss.bind((hostname, port))
+        self.ss.listen(4)
+        self.port = self.ss.getsockname()[1]
+        self.alive = True
+
+    def run(self):
+        clients = 0
+        while self.alive:
+            try:
+                conn, address = self.ss.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Mock_FPGA_client("Mock_FPGA_client_%d"%clients, conn, self.fpga).start()
+            clients += 1
+
+    def close(self):
+        self.alive = False
+        self.ss.close()
+
+#--------------------------------------------------------------------------#
+def getOptionParser():
+    parser = OptionParser()
+    parser.add_option("--hostname", dest="hostname", action="store", type="string", help="Address to listen on", default="127.0.0.1")
+    parser.add_option("--port", dest="port", action="store", type="int", help="Port to listen on", default=1024)
+    parser.add_option("--rate", dest="rate", action="store", type="float", help="Data FIFO fill rate in words/s, 0 for as fast as it is read", default=1e6)
+    parser.add_option("--fifo_depth", dest="fifo_depth", action="store", type="int", help="Data FIFO depth in words, words beyond it are lost", default=1<<22)
+    parser.add_option("--channels", dest="channels", action="store", type="int", help="Enabled channel mask until register 15 is written", default=active_channels_key & 0xf)
+    parser.add_option("--hits", dest="hits", action="store", type="float", help="Mean number of hits per frame", default=2.0)
+    parser.add_option("--fillers", dest="fillers", action="store", type="float", help="Probability of a filler word between frames", default=0.2)
+    parser.add_option("--errors", dest="errors", action="store", type="float", help="Fraction of frames with one flipped bit", default=0.0)
+    parser.add_option("--trigger_period", dest="trigger_period", action="store", type="int", help="Data words per NORMTRIG control word, 0 for none", default=64)
+    parser.add_option("--trigger", dest="trigger", action="store", type="choice", choices=["always", "l1a"], default="always", help="always: data flows from the start, l1a: data flows once an L1A fast command cycle is started")
+    parser.add_option("--seed", dest="seed", action="store", type="int", help="Random seed of the synthetic stream", default=0)
+    parser.add_option("--fpga", dest="fpga", action="store", type="int", help="Which FPGA of the board lists to be, its chip IDs are board_ID[4*fpga:4*fpga+4]", default=0)
+    return parser
+
+if __name__ == "__main__":
+    parser = getOptionParser()
+    (options, args) = parser.parse_args()
+    chip_IDs = board_ID[4*options.fpga:4*options.fpga+4]
+    if(options.fpga < 0 or len(chip_IDs) < 4):
+        print("board_details only lists the boards of %d FPGAs, no chip IDs for FPGA %d"%(len(board_ID)//4, options.fpga))
+        sys.exit(1)
+    source = Synthetic_data_source(chip_IDs, options.seed, options.hits, options.fillers, options.errors, options.trigger_period)
+    fpga = Mock_FPGA(source, options.rate, options.fifo_depth, options.channels, options.trigger)
+    server = Mock_FPGA_server("Mock_FPGA_server", fpga, options.hostname, options.port)
+    print("Mock FPGA listening on %s:%d"%(options.hostname, server.port))
+    server.start()
+    try:
+        while server.is_alive():
+            server.join(0.5)
+    except KeyboardInterrupt:
+        server.close()
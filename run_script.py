@@ -8,8 +8,10 @@ import time
 import struct
 import socket
 import threading
+import multiprocessing
 import datetime
 #import heartrate
+import queue
 from queue import Queue
 import numpy as np
 import matplotlib.pyplot as plt
@@ -43,12 +45,14 @@ def main_process(IPC_queue, options, log_file = None):
     try:
         # initial socket
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Commands are a few bytes each, do not hold them back waiting for ACKs (Nagle)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     except socket.error:
         print("Failed to create socket!")
         sys.exit()
     try:
         # connect socket
-        s.connect((options.hostname, port))
+        s.connect((options.hostname, options.port))
     except socket.error:
         print("failed to connect to ip " + options.hostname)
         sys.exit()
@@ -162,15 +166,35 @@ def get_fpga_data(cmd_interpret, time_limit, overwrite, output_directory, isQInj
         fpga_data.alive = False
         fpga_data.join()
 
+#--------------------------------------------------------------------------#
+## Live metrics of the run (see daq_metrics.py): endpoint on --metrics_port/--metrics_socket and
+## a summary line every --metrics_interval seconds
+def start_metrics(options, metrics):
+    servers = serve_metrics(metrics, options.metrics_port, options.metrics_socket)
+    reporter = None
+    if(options.metrics_interval > 0):
+        reporter = Metrics_reporter('Metrics_reporter', metrics, options.metrics_interval)
+        reporter.start()
+    return servers, reporter
+
+def stop_metrics(servers, reporter):
+    if(reporter is not None): reporter.stop()
+    stop_metrics_servers(servers)
+
+#--------------------------------------------------------------------------#
 ## main function
-def main(options, cmd_interpret, IPC_queue = None):
+## fpga: index of this FPGA in the board lists (board_details), fc_barrier: see multi_fpga_process
+## metrics: Metrics_registry shared by several FPGAs (multi_fpga_process), main() serves its own if not given
+## return the numbers of the reader when the DAQ ran
+def main(options, cmd_interpret, IPC_queue = None, fpga = 0, fc_barrier = None, metrics = None):
     
     if(options.firmware):
         print("Setting firmware...")
-        active_channels(cmd_interpret, key = active_channels_key)
-        timestamp(cmd_interpret, key = options.timestamp)
-        triggerBitDelay(cmd_interpret, options.trigger_bit_delay)
-        Enable_FPGA_Descramblber(cmd_interpret, options.polarity)
+        with cmd_interpret.transaction() as batch:
+            active_channels(batch, key = active_channels_key)
+            timestamp(batch, key = options.timestamp)
+            triggerBitDelay(batch, options.trigger_bit_delay)
+            Enable_FPGA_Descramblber(batch, options.polarity)
     
     if(options.clear_fifo):
         time.sleep(0.1)                                 # delay 1000 milliseconds
@@ -203,23 +227,22 @@ def main(options, cmd_interpret, IPC_queue = None):
         start_periodic_L1A_WS(cmd_interpret)
 
     if(options.verbose):
-        read_register_7 = cmd_interpret.read_config_reg(7)
+        # Read back all the registers in one round trip
+        with cmd_interpret.transaction() as batch:
+            for addr in (7, 8, 11, 12, 13, 14, 15): batch.read_config_reg(addr)
+        read_register_7, read_register_8, read_register_11, read_register_12, register_13, register_14, register_15 = batch.replies
         string_7   = format(read_register_7, '016b')
         print("Time (s) for counting stats in FPGA: ", string_7[-6:], int(string_7[-6:], base=2))
         print('\n')
-        read_register_8 = cmd_interpret.read_config_reg(8)
         string_8   = format(read_register_8, '016b')
         print("Written into Reg 8: ", string_8)
         print("Enhance data LED (LED Page 011): ", string_8[-12])
         print("Enable L1A upon Rx trigger bit : ", string_8[-11])
         print("10 bit delay (trigger bit->L1A): ", string_8[-10:], int(string_8[-10:], base=2))
         print('\n')
-        read_register_11 = cmd_interpret.read_config_reg(11)
-        read_register_12 = cmd_interpret.read_config_reg(12)
         print("Written into Reg 11: ", format(read_register_11, '016b'))
         print("Written into Reg 12: ", format(read_register_12, '016b'))
         print('\n')
-        register_13 = cmd_interpret.read_config_reg(13)
         string_13   = format(register_13, '016b')
         print("Written into Reg 13: ", string_13)
         print("Data Rate              : ", string_13[-7:-5])
@@ -227,7 +250,6 @@ def main(options, cmd_interpret, IPC_queue = None):
         print("Testmode               : ", string_13[-2])
         print("Timestamp (active low) : ", string_13[-1])
         print('\n')
-        register_14 = cmd_interpret.read_config_reg(14)
         string_14   = format(register_14, '016b')
         print("Written into Reg 14: ", string_14)
         print("Enable Memo FC mode: ", string_14[-4])
@@ -235,7 +257,6 @@ def main(options, cmd_interpret, IPC_queue = None):
         print("Disable GTX        : ", string_14[-2])
         print("Enable Descrambler : ", string_14[-1])
         print('\n')
-        register_15 = cmd_interpret.read_config_reg(15)
         string_15   = format(register_15, '016b')
         print("Written into Reg 15: ", string_15)
         print("Channel Enable     : ", string_15[-4:])
@@ -284,56 +305,203 @@ def main(options, cmd_interpret, IPC_queue = None):
     if(not options.nodaq):
         ## start receive_data, write_data, daq_plotting threading
         store_dict = userdefine_dir
-        read_queue = Queue()
-        translate_queue = Queue() 
-        plot_queue = Queue()
+        own_metrics = metrics is None
+        if(own_metrics): metrics = Metrics_registry()
+        read_queue = DAQ_queue('read_queue', options.read_queue_size, options.queue_policy, options.queue_prescale, options.spill_directory)
+        translate = options.make_plots or (not options.binary_only)
+        # Only worth a process (and its ring buffer) when there is something to translate
+        use_translate_process = translate and options.translate_process
+        if(use_translate_process):
+            # Chunks go to the translation process through shared memory, the ring always blocks when full
+            translate_queue = Shared_ring_buffer(capacity=options.ring_size*(1<<18))
+        else:
+            translate_queue = DAQ_queue('translate_queue', options.translate_queue_size, options.queue_policy, options.queue_prescale, options.spill_directory)
+        # Plotting must never hold up the translation, its queue drops instead of blocking
+        plot_queue = DAQ_queue('plot_queue', options.plot_queue_size, 'drop' if options.queue_policy=='block' else options.queue_policy, options.queue_prescale, options.spill_directory)
         read_thread_handle = threading.Event()    # This is how we stop the read thread
         write_thread_handle = threading.Event()   # This is how we stop the write thread
         translate_thread_handle = threading.Event() # This is how we stop the translate thread (if translate enabled) (set down below...)
         plotting_thread_handle = threading.Event() # This is how we stop the plotting thread (if plotting enabled) (set down below...)
         stop_DAQ_event = threading.Event()     # This is how we notify the Read thread that we are done taking data
                                                # Kill order is read, write, translate
-        receive_data = Receive_data('Receive_data', read_queue, cmd_interpret, options.num_fifo_read, read_thread_handle, write_thread_handle, options.time_limit, options.useIPC, stop_DAQ_event, IPC_queue)
-        write_data = Write_data('Write_data', read_queue, translate_queue, options.num_line, store_dict, options.binary_only, options.compressed_binary, options.skip_binary, options.make_plots, read_thread_handle, write_thread_handle, translate_thread_handle, stop_DAQ_event)
-        if(options.make_plots or (not options.binary_only)):
+        receive_data = Receive_data('Receive_data', read_queue, cmd_interpret, options.num_fifo_read, read_thread_handle, write_thread_handle, options.time_limit, options.useIPC, stop_DAQ_event, IPC_queue, fc_barrier, metrics.stage('Receive_data', fpga))
+        run_info = {'options': vars(options), 'board_ID': board_ID, 'timestamp': options.timestamp, 'start_time': time.time(), 'fpga': fpga, 'hostname': options.hostname}
+        fpga_boards = slice(etroc2_channels*fpga, etroc2_channels*(fpga+1))
+        write_data = Write_data('Write_data', read_queue, translate_queue, options.num_line, store_dict, options.binary_only, options.compressed_binary, options.skip_binary, options.make_plots, read_thread_handle, write_thread_handle, translate_thread_handle, stop_DAQ_event, options.raw_format, run_info, metrics.stage('Write_data', fpga))
+        metrics.add_queue('read_queue', read_queue, fpga)
+        metrics.add_queue('translate_ring' if use_translate_process else 'translate_queue', translate_queue, fpga)
+        # One decoder process per channel enabled in register 15
+        enabled_channels = [channel for channel in range(etroc2_channels) if (active_channels_key >> channel) & 1]
+        translate_channels = enabled_channels if options.translate_workers else None
+        event_window = options.event_window if options.build_events else None
+        if(use_translate_process):
+            # The metrics of the translation process come back through a queue
+            metrics_queue = multiprocessing.Queue()
+            metrics.add_remote(metrics_queue)
+            translate_process = Translate_process('Translate_process', translate_queue.name, options.num_line, options.timestamp, store_dict, options.binary_only, options.make_plots, board_ID, options.compressed_translation, options.plot_queue_size, board_type[fpga_boards], board_size[fpga_boards], options.plot_queue_time, translate_channels, fpga, event_window, enabled_channels, options.translated_format, metrics_queue, options.trigger_qinj)
+            translate = False
+        elif(translate):
             # translate_thread_handle = threading.Event()
-            translate_data = Translate_data('Translate_data', translate_queue, plot_queue, cmd_interpret, options.num_line, options.timestamp, store_dict, options.binary_only, options.make_plots, board_ID, write_thread_handle, translate_thread_handle, plotting_thread_handle, options.compressed_translation, stop_DAQ_event)
-        if(options.make_plots):
+            translate_data = Translate_data('Translate_data', translate_queue, plot_queue, cmd_interpret, options.num_line, options.timestamp, store_dict, options.binary_only, options.make_plots, board_ID, write_thread_handle, translate_thread_handle, plotting_thread_handle, options.compressed_translation, stop_DAQ_event, translate_channels, fpga, Event_builder(enabled_channels, event_window, store_dict, trigger_qinj=options.trigger_qinj) if options.build_events else None, options.translated_format, metrics.stage('Translate_data', fpga), options.trigger_qinj)
+            metrics.add_queue('plot_queue', plot_queue, fpga)
+        plotting = options.make_plots and not use_translate_process
+        if(plotting):
             # plotting_thread_handle = threading.Event()
-            daq_plotting = DAQ_Plotting('DAQ_Plotting', plot_queue, options.timestamp, store_dict, options.pixel_address, board_type, board_size, options.plot_queue_time, translate_thread_handle, plotting_thread_handle)
+            daq_plotting = DAQ_Plotting('DAQ_Plotting', plot_queue, options.timestamp, store_dict, board_type[fpga_boards], board_size[fpga_boards], options.plot_queue_time, translate_thread_handle, plotting_thread_handle, metrics.stage('DAQ_Plotting', fpga))
+        if(own_metrics): metrics_servers, metrics_reporter = start_metrics(options, metrics)
         # read_write_data.start()
         try:
             # Start the thread
             receive_data.start()
             write_data.start()
-            if(options.make_plots or (not options.binary_only)): translate_data.start()
-            if(options.make_plots): daq_plotting.start()
+            if(translate): translate_data.start()
+            if(plotting): daq_plotting.start()
+            if(use_translate_process): translate_process.start()
             # If the child thread is still running
             while receive_data.is_alive():
                 # Try to join the child thread back to parent for 0.5 seconds
                 receive_data.join(0.5)
-            if(options.make_plots or (not options.binary_only)):
+            if(translate):
                 while translate_data.is_alive():
                     translate_data.join(0.5)
             while write_data.is_alive():
                 write_data.join(0.5)
-            if(options.make_plots):
+            if(plotting):
                 while daq_plotting.is_alive():
                     daq_plotting.join(0.5)
+            if(use_translate_process):
+                translate_queue.close()
+                while translate_process.is_alive():
+                    translate_process.join(0.5)
         # When ctrl+c is received
         except KeyboardInterrupt as e:
             # Set the alive attribute to false
             receive_data.alive = False
             write_data.alive = False
-            if(options.make_plots or (not options.binary_only)): translate_data.alive = False
-            if(options.make_plots): daq_plotting.alive = False
+            if(translate): translate_data.alive = False
+            if(plotting): daq_plotting.alive = False
             # Block until child thread is joined back to the parent
             receive_data.join()
-            if(options.make_plots or (not options.binary_only)): translate_data.join()
+            if(translate): translate_data.join()
             write_data.join()
-            if(options.make_plots): daq_plotting.join()
+            if(plotting): daq_plotting.join()
+            # The translation process got the ctrl+c too
+            if(use_translate_process):
+                translate_queue.close()
+                translate_process.join()
+        if(own_metrics): stop_metrics(metrics_servers, metrics_reporter)
+        for daq_queue in (read_queue, translate_queue, plot_queue):
+            print(daq_queue.summary())
+            if(daq_queue is translate_queue and use_translate_process): translate_queue.release()
+            else: daq_queue.close()
         # wait for thread to finish before proceeding)
         # read_write_data.join()
+        return {'fpga': fpga, 'hostname': options.hostname, 'port': options.port, 'chunks': receive_data.chunks_read, 'words': receive_data.words_read, 'data_words': write_data.words_written, 'seconds': receive_data.run_time}
+
+#--------------------------------------------------------------------------#
+## Several FPGAs in one run, --hostname is a comma separated list of hostname[:port]
+## Every FPGA gets its own connection and runs main() in its own thread, writing to
+## output_directory/FPGA_<n>. L1A is started and stopped on all of them together: the FC programs
+## go to every reader through its IPC queue and the readers send them behind a common barrier
+multi_fpga_stop_grace = 30                  # readers stop on their own this long after -t, if never told to
+
+def fpga_hosts(options):
+    hosts = []
+    for host in options.hostname.split(','):
+        hostname, separator, host_port = host.strip().partition(':')
+        hosts.append((hostname, int(host_port) if host_port else options.port))
+    return hosts
+
+def multi_fpga_process(IPC_queue, options, log_file = None):
+    if log_file is not None:
+        sys.stdout = open(log_file + ".out", "w")
+    hosts = fpga_hosts(options)
+    print('start main process for %d FPGAs'%len(hosts))
+    # Without its chip IDs every trailer of an FPGA fails the chip ID check and all its data is dropped
+    if(len(board_ID) < etroc2_channels*len(hosts)):
+        print("ERROR! board_details only lists the boards (board_ID) of %d FPGAs, %d FPGAs given: list %d chip IDs per FPGA, FPGA after FPGA"%(len(board_ID)//etroc2_channels, len(hosts), etroc2_channels))
+        sys.exit(1)
+    sockets = []
+    for hostname, host_port in hosts:
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            s.connect((hostname, host_port))
+        except socket.error:
+            print("failed to connect to ip " + hostname)
+            sys.exit()
+        sockets.append(s)
+    run_directory = "../ETROC-Data/" + datetime.date.today().isoformat() + "_Array_Test_Results/" + options.output_directory
+    os.makedirs(run_directory, exist_ok=True)               # main() checks overwriting of every FPGA directory
+    # --memo_fc starts L1A on all the FPGAs together instead of one by one
+    start_fc = options.start_fc if options.start_fc is not None else ('start L1A' if options.memo_fc else None)
+    stop_fc = options.stop_fc if options.stop_fc is not None else ('stop L1A' if options.memo_fc else None)
+    fc_barrier = threading.Barrier(len(hosts))
+    IPC_queues = [Queue() for host in hosts]
+    results = [None]*len(hosts)
+    # One metrics endpoint and summary for all the FPGAs
+    metrics = Metrics_registry()
+    metrics_servers, metrics_reporter = start_metrics(options, metrics)
+    def run_fpga(fpga, fpga_options, cmd_interpret):
+        results[fpga] = main(fpga_options, cmd_interpret, IPC_queues[fpga], fpga, fc_barrier, metrics)
+    threads = []
+    for fpga, ((hostname, host_port), s) in enumerate(zip(hosts, sockets)):
+        fpga_options = copy.copy(options)
+        fpga_options.hostname = hostname
+        fpga_options.port = host_port
+        fpga_options.output_directory = options.output_directory + "/FPGA_%d"%fpga
+        fpga_options.memo_fc = False
+        fpga_options.useIPC = True
+        fpga_options.time_limit = options.time_limit + multi_fpga_stop_grace if options.time_limit > 0 else sys.maxsize
+        threads.append(threading.Thread(target=run_fpga, args=(fpga, fpga_options, command_interpret(s)), name="FPGA_%d"%fpga))
+    for thread in threads: thread.start()
+    start_time = time.time()
+    try:
+        if(start_fc is not None):
+            for fpga_queue in IPC_queues: fpga_queue.put(start_fc)
+        while all(thread.is_alive() for thread in threads):
+            if(options.time_limit > 0 and time.time()-start_time > options.time_limit): break
+            # Messages for the run go to every FPGA
+            if(IPC_queue is not None):
+                try:
+                    message = IPC_queue.get(True, 0.1)
+                    for fpga_queue in IPC_queues: fpga_queue.put(message)
+                except queue.Empty:
+                    pass
+            else:
+                time.sleep(0.1)
+    except KeyboardInterrupt as e:
+        print("Stopping all the FPGAs")
+    if(stop_fc is not None):
+        for fpga_queue in IPC_queues: fpga_queue.put(stop_fc)
+    for fpga_queue in IPC_queues:
+        fpga_queue.put('allow threads to exit')
+        fpga_queue.put('stop run')
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+    for s in sockets: s.close()
+    stop_metrics(metrics_servers, metrics_reporter)
+    write_run_summary(run_directory, hosts, results, time.time()-start_time)
+
+## Per FPGA and total readout rates of a multi FPGA run, printed and saved as run_summary.txt
+def write_run_summary(run_directory, hosts, results, elapsed):
+    lines = ["Run of {:d} FPGAs, {:.1f} s".format(len(hosts), elapsed)]
+    total_words = 0
+    # Rates are of the data words, the FIFO reads are padded with fillers
+    for fpga, (hostname, host_port) in enumerate(hosts):
+        result = results[fpga]
+        if(result is None):
+            lines.append("FPGA_{:d} {}:{:d}: no data".format(fpga, hostname, host_port))
+            continue
+        total_words += result['data_words']
+        lines.append("FPGA_{:d} {}:{:d}: {:d} data words ({:d} read in {:d} reads), {:.1f} s, {:.0f} words/s".format(fpga, hostname, host_port, result['data_words'], result['words'], result['chunks'], result['seconds'], result['data_words']/max(result['seconds'], 1e-9)))
+    run_time = max([result['seconds'] for result in results if result is not None], default=elapsed)
+    lines.append("Total: {:d} data words, {:.0f} words/s".format(total_words, total_words/max(run_time, 1e-9)))
+    print("\n".join(lines))
+    with open(os.path.join(run_directory, "run_summary.txt"), "w") as summary_file:
+        summary_file.write("\n".join(lines) + "\n")
+
 #--------------------------------------------------------------------------#
 ## if statement
 
@@ -343,7 +511,8 @@ def getOptionParser():
         setattr(parser.values, option.dest, list(map(int, value.split(','))))
 
     parser = OptionParser()
-    parser.add_option("--hostname", dest="hostname", action="store", type="string", help="FPGA IP Address", default="192.168.2.3")
+    parser.add_option("--hostname", dest="hostname", action="store", type="string", help="FPGA IP Address, a comma separated list of hostname[:port] reads several FPGAs in one run", default="192.168.2.3")
+    parser.add_option("--port", dest="port", action="store", type="int", help="FPGA port number", default=port)
     parser.add_option("-l", "--num_line", dest="num_line", action="store", type="int", help="Number of lines per file created by DAQ script", default=50000)
     parser.add_option("-r", "--num_fifo_read", dest="num_fifo_read", action="store", type="int", help="Number of lines read per call of fifo readout", default=50000)
     parser.add_option("-t", "--time_limit", dest="time_limit", action="store", type="int", help="Number of integer seconds to run this code", default=-1)
@@ -351,7 +520,24 @@ def getOptionParser():
     parser.add_option("--binary_only",action="store_true", dest="binary_only", default=False, help="Save only the untranslated FPGA binary data (raw output)")
     parser.add_option("--compressed_binary",action="store_true", dest="compressed_binary", default=False, help="Save FPGA binary data (raw output) in int format")
     parser.add_option("--skip_binary",action="store_true", dest="skip_binary", default=False, help="DO NOT save (raw) binary outputsto files")
+    parser.add_option("--raw_format", dest="raw_format", action="store", type="choice", choices=["txt", "bin"], default="txt", help="Format of the (raw) binary output files, txt: TDC_Data_N.dat lines, bin: packed uint32 words in TDC_Data_N.bin (see daq_io.py)")
+    parser.add_option("--read_queue_size", dest="read_queue_size", action="store", type="int", help="Max FIFO chunks waiting to be written, 0 for unbounded", default=0)
+    parser.add_option("--translate_queue_size", dest="translate_queue_size", action="store", type="int", help="Max FIFO chunks waiting to be translated, 0 for unbounded", default=0)
+    parser.add_option("--plot_queue_size", dest="plot_queue_size", action="store", type="int", help="Max translated chunks waiting to be plotted, 0 for unbounded", default=0)
+    parser.add_option("--queue_policy", dest="queue_policy", action="store", type="choice", choices=queue_policies, default="block", help="What a full queue does: block (the reader waits), drop, prescale (keep 1 in --queue_prescale from half full on) or spill (to a temporary file, replayed in order). The plot queue drops instead of blocking")
+    parser.add_option("--queue_prescale", dest="queue_prescale", action="store", type="int", help="Prescale factor of the prescale queue policy", default=10)
+    parser.add_option("--spill_directory", dest="spill_directory", action="store", type="string", help="Directory for the spill queue policy files (system temporary directory if not given)", default=None)
+    parser.add_option("--translate_process",action="store_true", dest="translate_process", default=False, help="Translate (and plot) in a separate process fed through a shared memory ring buffer")
+    parser.add_option("--translate_workers",action="store_true", dest="translate_workers", default=False, help="Decode every active channel (active_channels_key) in its own process, merged back in stream order")
+    parser.add_option("--build_events",action="store_true", dest="build_events", default=False, help="Group the frames of all the enabled channels by L1COUNTER into TDC_Events_N.npz files (see event_builder.py)")
+    parser.add_option("--event_window", dest="event_window", action="store", type="int", help="Max events waiting for the frames of all channels with --build_events", default=64)
+    parser.add_option("--trigger_qinj",action="store_true", dest="trigger_qinj", default=False, help="Trigger times of Qinj operation (25*32 ns per NORMTRIG count) for the ns times of the columnar and event outputs")
+    parser.add_option("--ring_size", dest="ring_size", action="store", type="int", help="Size (MB) of the --translate_process ring buffer", default=256)
     parser.add_option("--compressed_translation",action="store_true", dest="compressed_translation", default=False, help="Save only FPGA translated data frames with DATA")
+    parser.add_option("--translated_format", dest="translated_format", action="store", type="choice", choices=["text", "columnar"], default="text", help="text: TDC_Data_translated_N.dat files, columnar: TDC_Data_frames_N.npy/TDC_Data_hits_N.npy chunks and a TDC_Data_columnar.json manifest (see daq_io.py)")
+    parser.add_option("--metrics_port", dest="metrics_port", action="store", type="int", help="Serve live counters and timers of the DAQ threads (Prometheus text format) on http://127.0.0.1:PORT/metrics, 0 for none", default=0)
+    parser.add_option("--metrics_socket", dest="metrics_socket", action="store", type="string", help="Serve the same metrics on this UNIX socket (curl --unix-socket PATH http://localhost/metrics)", default=None)
+    parser.add_option("--metrics_interval", dest="metrics_interval", action="store", type="float", help="Seconds between the one line rate summaries of the DAQ threads, 0 for none", default=10)
     parser.add_option("-s", "--timestamp", type="int",action="store", dest="timestamp", default=0x000C, help="Set timestamp binary, see daq_helpers for more info")
     parser.add_option("-p", "--polarity", type="int",action="store", dest="polarity", default=0x000b, help="Set fc polarity, see daq_helpers for more info")
     parser.add_option("-d", "--trigger_bit_delay", type="int",action="store", dest="trigger_bit_delay", default=0x0400, help="Set trigger bit delay, see daq_helpers for more info")
@@ -362,6 +548,8 @@ def getOptionParser():
     parser.add_option("--make_plots",action="store_true", dest="make_plots", default=False, help="Enable plotting of real time hits")
     parser.add_option("--plot_queue_time", dest="plot_queue_time", action="store", type="float", help="Time (s) used to pop lines off the queue for plotting", default=0.1)
     parser.add_option("--nodaq",action="store_true", dest="nodaq", default=False, help="Switch off DAQ via the FPGA")
+    parser.add_option("--start_fc", dest="start_fc", action="store", type="choice", choices=list(fc_programs), default=None, help="FC program started on all the FPGAs together when reading several FPGAs ('start L1A' with --memo_fc)")
+    parser.add_option("--stop_fc", dest="stop_fc", action="store", type="choice", choices=list(fc_programs), default=None, help="FC program run on all the FPGAs together at the end when reading several FPGAs ('stop L1A' with --memo_fc)")
     parser.add_option("--useIPC",action="store_true", dest="useIPC", default=False, help="Use Inter Process Communication to control L1A enable/disable")
     parser.add_option("-f", "--firmware",action="store_true", dest="firmware", default=False, help="Configure FPGA firmware settings")
     parser.add_option("--memo_fc",action="store_true", dest="memo_fc", default=False, help="(DEV ONLY) Do Fast Command with Memory")
@@ -398,15 +586,20 @@ if __name__ == "__main__":
         print("--------Set of inputs from the USER--------")
         print("Overwrite previously saved files: ", options.overwrite)
         print("FPGA IP Address: ", options.hostname)
+        print("FPGA port number: ", options.port)
         print("Number of lines per file created by DAQ script: ", options.num_line)
         print("Number of lines read per call of fifo readout: ", options.num_fifo_read)
         print("Number of seconds to run this code (>0 means effective): ", options.time_limit)
         print("User defined Output Directory: ", options.output_directory)
         print("Save only the untranslated FPGA binary data (raw output): ", options.binary_only)
         print("Save FPGA binary data (raw output) in int format: ", options.compressed_binary)
+        print("Format of FPGA binary data (raw output) files: ", options.raw_format)
         print("Save only FPGA translated data frames with DATA: ", options.compressed_translation)
+        print("Format of the translated data files: ", options.translated_format)
         print("DO NOT save binary data (raw output): ", options.skip_binary)
         print("Enable plotting of real time hits: ", options.make_plots)
+        print("Queue sizes (read, translate, plot), 0 is unbounded: ", options.read_queue_size, options.translate_queue_size, options.plot_queue_size)
+        print("Full queue policy: ", options.queue_policy)
         print("--------End of inputs from the USER--------")
         print("-------------------------------------------")
         print("\n")
@@ -424,4 +617,7 @@ if __name__ == "__main__":
         print("ERROR! Can't make plots without translating data!")
         sys.exit(1)
     
-    main_process(None, options)
+    if(len(fpga_hosts(options))>1):
+        multi_fpga_process(None, options)
+    else:
+        main_process(None, options)
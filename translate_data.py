@@ -24,201 +24,649 @@ def etroc1_translate(line, timestamp):
     return TDC_data, 1
 
 #----------------------------------------------------------------------------------------#
-def etroc2_translate(line, timestamp, queues, links, board_ID, hitmap, compressed_translation):
+## Frame assembler of one channel of etroc2_translate
+## The bits waiting for the next 40 bit word are kept in an integer (bits, nbits) and the lines of
+## the frame being built in a list allocated once (lines[:nlines], doubled when a frame does not
+## fit), HEADER_KEY markers included. Iterating gives what the deque of the channel used to hold:
+## the frame lines, then the pending bits as a string
+etroc2_header_marker = "HEADER_KEY"
+etroc2_frame_lines   = 64                                       # first size of the lines list
+
+class ETROC2_frame_assembler(object):
+    def __init__(self, channel, board_ID):
+        self.channel = channel
+        self.prefix = "ETROC2 {:d} ".format(channel)
+        self.header_key = etroc2_pattern_3c5c << 2              # first 18 bits of the words
+        self.trailer_key = int('0'+board_ID, base=2)
+        self.frame_key = (etroc2_pattern_3c5c << 2) | 2
+        self.firmware_key = (etroc2_pattern_3c5c << 2) | 3
+        self.bits = 0                                           # previous payload while looking for 3c5c
+        self.nbits = 0
+        self.lines = [None]*etroc2_frame_lines
+        self.nlines = 0
+        self.hitmap = 0                                         # bit row*16+col of the pixels hit in the frame
+
+    def append(self, line):
+        if(self.nlines==len(self.lines)): self.lines.extend([None]*len(self.lines))
+        self.lines[self.nlines] = line
+        self.nlines += 1
+
+    ## Drop the frame being built and the pending bits, as on any error
+    def clear(self):
+        self.bits = 0
+        self.nbits = 0
+        self.nlines = 0
+        self.hitmap = 0
+
+    def __len__(self):
+        return self.nlines + (self.nbits>0)
+
+    def __iter__(self):
+        items = self.lines[:self.nlines]
+        if(self.nbits>0): items.append(format(self.bits, '0{:d}b'.format(self.nbits)))
+        return iter(items)
+
+## Position of the first 0x3c5c in a window of nbits bits (0 is the most significant bit), -1 if there is none
+def etroc2_find_3c5c(window, nbits):
+    for position in range(nbits-15):
+        if((window >> (nbits-16-position)) & 0xFFFF == etroc2_pattern_3c5c): return position
+    return -1
+
+#----------------------------------------------------------------------------------------#
+## Count a decoding error of etroc2_translate in stats (see etroc2_stat_names), before the frame
+## of the channel is cleared: the lines of the frame being built are dropped with it
+# @param[in] queue ETROC2_frame_assembler of the channel
+def etroc2_translate_error(stats, channel, reason, queue):
+    stats[channel][reason] += 1
+    dropped = sum(1 for item in queue if item.startswith("ETROC2"))
+    if(dropped>0):
+        stats[channel][etroc2_stat_frames_dropped] += 1
+        stats[channel][etroc2_stat_words_dropped] += dropped
+
+## queues: one entry per channel, the empty deques given by the caller are replaced by the
+## ETROC2_frame_assembler of the channel at its first word. links: link state of every channel
+## hitmap: not used any more (the assembler keeps the pixels of the frame), kept for the callers
+## stats: int array (channel, etroc2_stat_names) counting the errors and the lost data, None for no counting
+def etroc2_translate(line, timestamp, queues, links, board_ID, hitmap, compressed_translation, stats=None):
     TDC_data = []
-    pattern_3c5c = '0011110001011100'
     trail_found = False
-    channel = int(line[2:4], base=2)
+    if (len(line)!=32): print("Tried to unpack ETROC2 data with fewer than required data bits / line", line[4:], " ", type(line), len(line)-4)
+    word = int(line, base=2)
+    channel = (word >> 28) & 0x3
     # Discard first 4 bits which are 11+channel
-    data = line[4:]
-    if (len(data)!=28): print("Tried to unpack ETROC2 data with fewer than required data bits / line", data, " ", type(data), len(data))
-    # append new line to the right of deque if deque is empty, or is linked and previously translated
-    # If the link is not established and deque was empty, check if you're adding a line with the fixed pattern in it and if so only keep relevant part of the stream
-    # Function returns empty list
-    if (len(queues[channel])==0): 
-        if(len(links[channel])>0):
-            queues[channel].append(data)
-        else:
-            if(pattern_3c5c in data):
-                links[channel] = "START"
-                staring_index = data.find(pattern_3c5c)
-                queues[channel].append(data[staring_index:])
-            else: queues[channel].append(data)
-        return TDC_data, 2
-    if(len(links[channel])>0):
-        if(queues[channel][-1][0]!='0' and queues[channel][-1][0]!='1'): 
-            queues[channel].append(data)
-            return TDC_data, 2
-    # else unpack last element to complete lines
-    last_element = queues[channel].pop()
-    # If not linked yet, check for fixed pattern in the old + new data
+    data = word & etroc2_payload_mask
+    assembler = queues[channel]
+    if(not isinstance(assembler, ETROC2_frame_assembler)):
+        assembler = queues[channel] = ETROC2_frame_assembler(channel, board_ID[channel])
+    # If not linked yet, look for the fixed pattern in the previous + new payload and only keep the
+    # stream from there, otherwise keep the new payload for the next search
     if(len(links[channel])==0):
-        new_line = last_element + data
-        # If not found, discard old element and return empty list
-        if(not pattern_3c5c in new_line):
-            queues[channel].append(data)
+        window = (assembler.bits << 28) | data
+        nbits = assembler.nbits + 28
+        staring_index = etroc2_find_3c5c(window, nbits)
+        if(staring_index<0):
+            if(stats is not None): stats[channel][etroc2_stat_skipped_bits] += assembler.nbits
+            assembler.bits = data
+            assembler.nbits = 28
             return TDC_data, 2
-        # If found, prepare last_element and data with 40 bit words + residual if possible, proceed to attempt translation
-        else:
-            links[channel] = "START"
-            staring_index = new_line.find(pattern_3c5c)
-            new_line = new_line[staring_index:]
-            nl_res_len = 40 - len(new_line)
-            last_element = new_line[0:40]
-            if(nl_res_len>=0): data = ""
-            else: data = new_line[nl_res_len:]
-    # If linked already, prepare last_element and data with 40 bit words + residual if possible, proceed to attempt translation
+        links[channel] = "START"
+        if(stats is not None):
+            stats[channel][etroc2_stat_skipped_bits] += staring_index
+            stats[channel][etroc2_stat_alignments] += 1
+        nbits -= staring_index
+        bits = window & ((1 << nbits) - 1)
     else:
-        # ETROC2 word length is 40 bits
-        residual_len = 40 - len(last_element)
-        # Note overspills are handled correctly in Python 3.6.8
-        last_element = last_element + data[0:residual_len]
-        data = data[residual_len:]
-    if(len(last_element)>40): 
-        print("ERROR! MORE THAN 40 BITS BEING TREATED AS A WORD!")
-        sys.exit(1)
-    # If last_element is less than 40 bits, push back and hope for new data
-    elif(len(last_element)< 40): queues[channel].append(last_element)
-    # If it is 40 bits, we can translate!
-    elif(len(last_element)==40):
-        #-------Translate 40bit ETROC word--------#
-        last_line = "ETROC2 " + "{:d} ".format(channel)
-        if(last_element[0:18]==pattern_3c5c+'00'):
-            # Translating frame header
+        bits = (assembler.bits << 28) | data
+        nbits = assembler.nbits + 28
+    # If there are less than 40 bits, keep them and hope for new data
+    if(nbits<40):
+        assembler.bits = bits
+        assembler.nbits = nbits
+        return TDC_data, 2
+    # ETROC2 word length is 40 bits, the residual waits for the next payload
+    nbits -= 40
+    value = bits >> nbits
+    assembler.bits = bits & ((1 << nbits) - 1)
+    assembler.nbits = nbits
+    #-------Translate 40bit ETROC word--------#
+    in_frame = links[channel]=="HEADER" or links[channel]=="DATA"
+    top = value >> 22
+    error = -1
+    if(top==assembler.header_key):
+        if(in_frame): error = etroc2_header_in_frame
+        else:
             # We add a unique element here to track how many data lines there are in this block
-            queues[channel].append("HEADER_KEY")
-            last_line = last_line + "HEADER "
-            last_line = last_line + "L1COUNTER " + last_element[18:26] + " "
-            last_line = last_line + "TYPE " + last_element[26:28] + " "
-            # last_line = last_line + "BCID " + last_element[28:40]
-            last_line = last_line + "BCID " + f"{int(last_element[28:40], base=2)}"
-            # Expected
-            if(links[channel]=="START" or links[channel]=="FILLER" or links[channel]=="TRAILER"): links[channel] = "HEADER"
-            # Error in frame, clear queue, reset link, exit function
-            elif(links[channel]=="DATA" or links[channel]=="HEADER"):
-                # print("QD at HEADER, because found after",links[channel])
-                # print(list(queues[channel]))
-                queues[channel].clear()
-                links[channel]==""
-                hitmap[channel] = np.zeros((16,16))
-                return TDC_data, 2
-            # Unexpected invalid link state
-            else: 
-                print("ERROR! LINKS[CH] in invalid state at HEADER")
-                sys.exit(1)
-        elif(last_element[0:18]=='0'+board_ID[channel]):
-            # Translating frame trailer
+            assembler.append(etroc2_header_marker)
+            last_line = assembler.prefix + "HEADER L1COUNTER {:08b} TYPE {:02b} BCID {:d}".format((value >> 14) & 0xFF, (value >> 12) & 0x3, value & 0xFFF)
+            links[channel] = "HEADER"
+    elif(top==assembler.trailer_key):
+        if(not in_frame): error = etroc2_trailer_outside_frame
+        else:
             trail_found = True
-            last_line = last_line + "TRAILER "
-            last_line = last_line + "CHIPID " + f"{hex(int(last_element[1:18], base=2))}" + " "
-            last_line = last_line + "STATUS " + last_element[18:24] + " "
-            last_line = last_line + "HITS " + f"{int(last_element[24:32], base=2)}" + " "
-            last_line = last_line + "CRC " + last_element[32:40]
-            # Expected
-            if(links[channel]=="HEADER" or links[channel]=="DATA"): links[channel] = "TRAILER"
-            # Error in frame, clear queue, reset link, exit function
-            elif(links[channel]=="TRAILER" or links[channel]=="FILLER" or links[channel]=="START"):
-                # print("QD at Trailer, because found after",links[channel])
-                # print(list(queues[channel]))
-                queues[channel].clear()
-                links[channel]==""
-                hitmap[channel] = np.zeros((16,16))
-                return TDC_data, 2
-            # Unexpected invalid link state
-            else: 
-                print("ERROR! LINKS[CH] in invalid state at TRAILER")
-                sys.exit(1)
-        elif(last_element[0:18]==pattern_3c5c+'10'):
-            # Translating frame filler
-            last_line = last_line + "FRAMEFILLER "
-            last_line = last_line + "L1COUNTER " + last_element[18:26] + " "
-            last_line = last_line + "EBS " + last_element[26:28] + " "
-            last_line = last_line + "BCID " + f"{int(last_element[28:40], base=2)}"
-            # Expected
-            if(links[channel]=="START" or links[channel]=="FILLER" or links[channel]=="TRAILER"): links[channel] = "FILLER"
-            # Error in frame, clear queue, reset link, exit function
-            elif(links[channel]=="DATA" or links[channel]=="HEADER"):
-                # print("QD at FF, because found after",links[channel])
-                # print(list(queues[channel]))
-                queues[channel].clear()
-                links[channel]==""
-                hitmap[channel] = np.zeros((16,16))
-                return TDC_data, 2
-            # Unexpected invalid link state
-            else: 
-                print("ERROR! LINKS[CH] in invalid state at FRAME FILLER")
-                sys.exit(1)
-        elif(last_element[0:18]==pattern_3c5c+'11'):
-            # Translating firmware filler
-            last_line = last_line + "FIRMWAREFILLER "
-            last_line = last_line + "MISSINGCOUNT " + last_element[18:40]
-            # Expected
-            if(links[channel]=="START" or links[channel]=="FILLER" or links[channel]=="TRAILER"): links[channel] = "FILLER"
-            # Error in frame, clear queue, reset link, exit function
-            elif(links[channel]=="DATA" or links[channel]=="HEADER"):
-                # print("QD at F, because found after",links[channel])
-                # print(list(queues[channel]))
-                queues[channel].clear()
-                links[channel]==""
-                hitmap[channel] = np.zeros((16,16))
-                return TDC_data, 2
-            # Unexpected invalid link state
-            else: 
-                print("ERROR! LINKS[CH] in invalid state at FIRMWARE FILLER")
-                sys.exit(1)
-        elif(last_element[0]=='1'):
-            # Translating data
-            last_line = last_line + "DATA "
-            last_line = last_line + "EA " + last_element[1:3] + " "
-            last_line = last_line + "COL " + "{:d} ".format(int(last_element[3:7], base=2))
-            last_line = last_line + "ROW " + "{:d} ".format(int(last_element[7:11], base=2))
-            last_line = last_line + "TOA " + "{:d} ".format(int(last_element[11:21], base=2))
-            last_line = last_line + "TOT " + "{:d} ".format(int(last_element[21:30], base=2))
-            last_line = last_line + "CAL " + "{:d} ".format(int(last_element[30:40], base=2))
-            # last_line = last_line + last_element[11:11+4] + " " + last_element[15:15+4] + " "
-            # last_line = last_line + last_element[19:19+12] + " " + last_element[31:40]
-            # Expected
-            if(links[channel]=="HEADER" or links[channel]=="DATA"): links[channel] = "DATA"
-            # Error in frame, clear queue, reset link, exit function
-            elif(links[channel]=="TRAILER" or links[channel]=="FILLER" or links[channel]=="START"):
-                # print("QD at Data, because found after",links[channel])
-                # print(list(queues[channel]))
-                queues[channel].clear()
-                links[channel]==""
-                hitmap[channel] = np.zeros((16,16))
-                return TDC_data, 2
-            # Unexpected invalid link state
-            else: 
-                print("ERROR! LINKS[CH] in invalid state at DATA")
-                sys.exit(1)
-            # Check for the hitmap's integrity, clear if >1 hit from the same pixel
-            if(hitmap[channel][int(last_element[7:11], base=2),int(last_element[3:7], base=2)]>0):
-                print("Dumped at hitmap")
-                queues[channel].clear()
-                links[channel]==""
-                hitmap[channel] = np.zeros((16,16))
-                return TDC_data, 2
-            else: hitmap[channel][int(last_element[7:11], base=2),int(last_element[3:7], base=2)] += 1
-
-        # When the 40 bit word is none of the above, clear queue, reset link, exit function
+            last_line = assembler.prefix + "TRAILER CHIPID {} STATUS {:06b} HITS {:d} CRC {:08b}".format(hex(top & 0x1FFFF), (value >> 16) & 0x3F, (value >> 8) & 0xFF, value & 0xFF)
+            links[channel] = "TRAILER"
+    elif(top==assembler.frame_key):
+        if(in_frame): error = etroc2_filler_in_frame
         else:
-            # print("QD at INVALID 40 Word")
-            queues[channel].clear()
-            links[channel]==""
-            hitmap[channel] = np.zeros((16,16))
-            return TDC_data, 2
-        #-----------------------------------------#
-        queues[channel].append(last_line)
-        # If we found a trailing line, we can dump the deque into our main queue
-        if(trail_found):
-            if(not compressed_translation or np.any(hitmap[channel]>0)): TDC_data = list(queues[channel])
-            queues[channel].clear()
-            links[channel]==""
-            hitmap[channel] = np.zeros((16,16))
-        if(len(data)>0): queues[channel].append(data)
-
+            last_line = assembler.prefix + "FRAMEFILLER L1COUNTER {:08b} EBS {:02b} BCID {:d}".format((value >> 14) & 0xFF, (value >> 12) & 0x3, value & 0xFFF)
+            links[channel] = "FILLER"
+    elif(top==assembler.firmware_key):
+        if(in_frame): error = etroc2_filler_in_frame
+        else:
+            last_line = assembler.prefix + "FIRMWAREFILLER MISSINGCOUNT {:022b}".format(value & 0x3FFFFF)
+            links[channel] = "FILLER"
+    elif(value >> 39):
+        # Check for the hitmap's integrity, clear if >1 hit from the same pixel
+        pixel = ((value >> 29) & 0xF)*16 + ((value >> 33) & 0xF)
+        if(not in_frame): error = etroc2_data_outside_frame
+        elif((assembler.hitmap >> pixel) & 1): error = etroc2_duplicate_hit
+        else:
+            assembler.hitmap |= 1 << pixel
+            last_line = assembler.prefix + "DATA EA {:02b} COL {:d} ROW {:d} TOA {:d} TOT {:d} CAL {:d} ".format((value >> 37) & 0x3, (value >> 33) & 0xF, (value >> 29) & 0xF, (value >> 19) & 0x3FF, (value >> 10) & 0x1FF, value & 0x3FF)
+            links[channel] = "DATA"
+    # When the 40 bit word is none of the above
+    else: error = etroc2_invalid_word
+    # Error in frame, clear the frame and the pending bits, exit function (the link state is kept)
+    if(error>=0):
+        if(stats is not None): etroc2_translate_error(stats, channel, error, assembler)
+        assembler.clear()
+        return TDC_data, 2
+    #-----------------------------------------#
+    assembler.append(last_line)
+    # If we found a trailing line, we can dump the frame into our main queue
+    if(trail_found):
+        if(stats is not None): stats[channel][etroc2_stat_frames] += 1
+        if(not compressed_translation or assembler.hitmap!=0): TDC_data = assembler.lines[:assembler.nlines]
+        assembler.nlines = 0
+        assembler.hitmap = 0
     return TDC_data, 2
 
+#----------------------------------------------------------------------------------------#
+## Vectorized ETROC2 decoding
+## The stream of one channel is handled as an array of 28 bit payloads (the 32 bit FIFO
+## word without the 11+channel prefix). 40 bit words are rebuilt with integer shifts and
+## classified with masks; the link and hitmap rules are the ones of etroc2_translate.
+ETROC2_HEADER         = 0
+ETROC2_DATA           = 1
+ETROC2_TRAILER        = 2
+ETROC2_FRAMEFILLER    = 3
+ETROC2_FIRMWAREFILLER = 4
+ETROC2_INVALID        = 5
+
+etroc2_kind_names = ["HEADER", "DATA", "TRAILER", "FRAMEFILLER", "FIRMWAREFILLER", "INVALID"]
+
+## One decoded 40 bit word, fields not used by a KIND are left at 0
+## INDEX is the position (in the payload array given to etroc2_decode) of the word completing it
+etroc2_record_dtype = np.dtype([
+    ('CHANNEL',      np.uint8),
+    ('KIND',         np.uint8),
+    ('INDEX',        np.int64),
+    ('L1COUNTER',    np.uint8),
+    ('TYPE',         np.uint8),
+    ('BCID',         np.uint16),
+    ('EA',           np.uint8),
+    ('COL',          np.uint8),
+    ('ROW',          np.uint8),
+    ('TOA',          np.uint16),
+    ('TOT',          np.uint16),
+    ('CAL',          np.uint16),
+    ('CHIPID',       np.uint32),
+    ('STATUS',       np.uint8),
+    ('HITS',         np.uint8),
+    ('CRC',          np.uint8),
+    ('EBS',          np.uint8),
+    ('MISSINGCOUNT', np.uint32),
+    ('TRIGTIME',     np.uint64),                                # see trigger_timestamps, 0 before the first trigger
+])
+
+etroc2_pattern_3c5c = 0x3c5c
+etroc2_payload_mask = 0xFFFFFFF
+etroc2_channels     = 4                                         # 2 bit channel field, per FPGA
+
+## Decoding statistics of a link, one int64 per name
+## The errors (first etroc2_error_count) are why the frame being built is dropped, each one also
+## loses the pending bits: decoding starts again at the next payload. frames_dropped/words_dropped
+## count the errors that dropped decoded words and those words, skipped_bits the bits before the
+## 3c5c alignment (alignments, only once per link: it is never looked for again)
+etroc2_header_in_frame       = 0                                # HEADER after a HEADER or DATA
+etroc2_trailer_outside_frame = 1                                # TRAILER after a TRAILER or filler
+etroc2_filler_in_frame       = 2                                # frame or firmware filler after a HEADER or DATA
+etroc2_data_outside_frame    = 3                                # DATA after a TRAILER or filler
+etroc2_invalid_word          = 4                                # 40 bit word of no known kind
+etroc2_duplicate_hit         = 5                                # second hit of a pixel in a frame
+etroc2_error_count           = 6
+etroc2_stat_frames           = 6                                # frames closed by a TRAILER (before compressed_translation)
+etroc2_stat_frames_dropped   = 7
+etroc2_stat_words_dropped    = 8
+etroc2_stat_skipped_bits     = 9
+etroc2_stat_alignments       = 10
+etroc2_stat_names = ["header_in_frame", "trailer_outside_frame", "filler_in_frame", "data_outside_frame", "invalid_word", "duplicate_hit",
+                     "frames", "frames_dropped", "words_dropped", "skipped_bits", "alignments"]
+
+## Error of a 40 bit word that can not come next, in_frame is the state before it
+def etroc2_error_reason(kind, in_frame):
+    if kind == ETROC2_HEADER: return etroc2_header_in_frame
+    if kind == ETROC2_TRAILER: return etroc2_trailer_outside_frame
+    if kind == ETROC2_FRAMEFILLER or kind == ETROC2_FIRMWAREFILLER: return etroc2_filler_in_frame
+    if kind == ETROC2_DATA: return etroc2_duplicate_hit if in_frame else etroc2_data_outside_frame
+    return etroc2_invalid_word
+
+## Decoding errors since previous (same shape), one part per channel with errors, "" if there are none
+# @param[in] stats (channel, etroc2_stat_names)
+def etroc2_stats_summary(stats, previous=None):
+    stats = np.asarray(stats) - (0 if previous is None else np.asarray(previous))
+    parts = []
+    for channel in np.flatnonzero(np.any(stats[:, :etroc2_error_count] > 0, axis=1)):
+        reasons = ["{} {:d}".format(etroc2_stat_names[reason], stats[channel, reason]) for reason in np.flatnonzero(stats[channel, :etroc2_error_count])]
+        parts.append("channel {:d}: {:d} frames decoded, {:d} dropped ({:d} words), {}".format(channel, stats[channel, etroc2_stat_frames], stats[channel, etroc2_stat_frames_dropped], stats[channel, etroc2_stat_words_dropped], ", ".join(reasons)))
+    return "; ".join(parts)
+
+## Decoder state of one channel, same role as queues/links/hitmap in etroc2_translate
+# @param[in] hitmap view into ETROC2_links.hitmaps, own array if not given
+# @param[in] stats view into ETROC2_links.stats (etroc2_stat_names), own array if not given
+class ETROC2_link_state(object):
+    def __init__(self, channel, board_ID, hitmap=None, stats=None):
+        self.channel = channel
+        self.trailer_key = int('0'+board_ID, base=2)            # first 18 bits of a trailer
+        self.linked = False                                     # found 3c5c, never unset (as in etroc2_translate)
+        self.in_frame = False                                   # last good word was a HEADER or DATA
+        self.last_word = None                                   # previous payload while looking for 3c5c
+        self.bits = 0                                           # bits waiting for the next 40 bit word
+        self.nbits = 0
+        self.block = np.zeros(0, dtype=etroc2_record_dtype)     # words of the frame being built
+        self.hitmap = np.zeros(256, dtype=bool) if hitmap is None else hitmap   # row*16+col of the frame being built
+        self.stats = np.zeros(len(etroc2_stat_names), dtype=np.int64) if stats is None else stats
+
+    ## Count an error, the frame being built is dropped with it (see clear)
+    def error(self, reason, dropped_words):
+        self.stats[reason] += 1
+        if dropped_words > 0:
+            self.stats[etroc2_stat_frames_dropped] += 1
+            self.stats[etroc2_stat_words_dropped] += dropped_words
+
+    ## Drop the frame being built, as etroc2_translate does on any error
+    def clear(self):
+        self.bits = 0
+        self.nbits = 0
+        self.block = self.block[:0]
+        self.hitmap[:] = False
+
+## Decoder states of all the (fpga, channel) links, the board lists (board_ID, ...) give
+## etroc2_channels entries per FPGA, FPGA after FPGA. links[fpga] is the row of one FPGA, indexed
+## by the channel field of its words. The per link arrays are shared by all the states
+## The board lists have to cover nfpga FPGAs, no trailer would pass the chip ID check otherwise
+class ETROC2_links(object):
+    def __init__(self, board_ID, nfpga=1):
+        if(len(board_ID) < nfpga*etroc2_channels):
+            raise ValueError("board_ID lists the chips of %d FPGAs, %d needed"%(len(board_ID)//etroc2_channels, nfpga))
+        nfpga = (len(board_ID) + etroc2_channels - 1)//etroc2_channels
+        self.shape = (nfpga, etroc2_channels)
+        board_ID = list(board_ID) + ["0"]*(nfpga*etroc2_channels - len(board_ID))
+        self.board_ID = np.array(board_ID, dtype=object).reshape(self.shape)
+        self.hitmaps = np.zeros(self.shape + (256,), dtype=bool)
+        self.stats = np.zeros(self.shape + (len(etroc2_stat_names),), dtype=np.int64)
+        self.states = np.empty(self.shape, dtype=object)
+        for fpga, channel in np.ndindex(self.shape):
+            self.states[fpga, channel] = ETROC2_link_state(channel, self.board_ID[fpga, channel], self.hitmaps[fpga, channel], self.stats[fpga, channel])
+
+    def __getitem__(self, key):
+        return self.states[key]
+
+    ## links that found their 3c5c, shape (fpga, channel)
+    def linked(self):
+        return np.vectorize(lambda state: state.linked, otypes=[bool])(self.states)
+
+#----------------------------------------------------------------------------------------#
+## Find the first 3c5c in the bit stream of last_word + payload
+## return index into payload of the word holding it (-1 for last_word) and its bit offset
+def etroc2_find_alignment(payload, last_word=None):
+    stream = payload if last_word is None else np.concatenate((np.array([last_word], dtype=np.uint64), payload))
+    if len(stream) == 0: return None
+    pairs = (stream << np.uint64(28)) | np.append(stream[1:], np.uint64(0))
+    shifts = np.arange(28, dtype=np.uint64)
+    windows = (pairs[:, None] >> (np.uint64(40) - shifts)) & np.uint64(0xffff)
+    found = windows == etroc2_pattern_3c5c
+    found[-1, 13:] = False                                      # would run into the next, unseen word
+    hits = np.flatnonzero(found)
+    if len(hits) == 0: return None
+    word, offset = divmod(int(hits[0]), 28)
+    if last_word is not None: word -= 1
+    return word, offset
+
+#----------------------------------------------------------------------------------------#
+## Fill the fields of decoded 40 bit words
+def etroc2_records(values, kinds, index, channel):
+    records = np.zeros(len(values), dtype=etroc2_record_dtype)
+    records['CHANNEL'] = channel
+    records['KIND'] = kinds
+    records['INDEX'] = index
+    def field(start, stop): return (values >> np.uint64(40-stop)) & np.uint64((1 << (stop-start)) - 1)
+    framing = (kinds == ETROC2_HEADER) | (kinds == ETROC2_FRAMEFILLER)
+    data = kinds == ETROC2_DATA
+    trailer = kinds == ETROC2_TRAILER
+    records['L1COUNTER'] = np.where(framing, field(18, 26), 0)
+    records['TYPE']      = np.where(kinds == ETROC2_HEADER, field(26, 28), 0)
+    records['EBS']       = np.where(kinds == ETROC2_FRAMEFILLER, field(26, 28), 0)
+    records['BCID']      = np.where(framing, field(28, 40), 0)
+    records['EA']        = np.where(data, field(1, 3), 0)
+    records['COL']       = np.where(data, field(3, 7), 0)
+    records['ROW']       = np.where(data, field(7, 11), 0)
+    records['TOA']       = np.where(data, field(11, 21), 0)
+    records['TOT']       = np.where(data, field(21, 30), 0)
+    records['CAL']       = np.where(data, field(30, 40), 0)
+    records['CHIPID']    = np.where(trailer, field(1, 18), 0)
+    records['STATUS']    = np.where(trailer, field(18, 24), 0)
+    records['HITS']      = np.where(trailer, field(24, 32), 0)
+    records['CRC']       = np.where(trailer, field(32, 40), 0)
+    records['MISSINGCOUNT'] = np.where(kinds == ETROC2_FIRMWAREFILLER, field(18, 40), 0)
+    return records
+
+#----------------------------------------------------------------------------------------#
+## Close the frames of decoded records that end with a trailer
+## Appends the closed frames to found (only frames with DATA if compressed_translation)
+## and keeps the open frame and its hitmap in state
+def etroc2_close_frames(records, state, found, compressed_translation):
+    trailers = records['KIND'] == ETROC2_TRAILER
+    ntrailers = int(np.sum(trailers))
+    if ntrailers > 0:
+        last = int(np.flatnonzero(trailers)[-1]) + 1
+        closed = records[:last]
+        if compressed_translation:
+            frame = np.cumsum(trailers[:last]) - trailers[:last]
+            with_data = np.bincount(frame[closed['KIND'] == ETROC2_DATA], minlength=ntrailers) > 0
+            closed = closed[with_data[frame]]
+        if len(closed) > 0: found.append(closed)
+        records = records[last:]
+    state.block = records
+    state.hitmap[:] = False
+    hits = records[records['KIND'] == ETROC2_DATA]
+    state.hitmap[hits['ROW'].astype(np.int64)*16 + hits['COL']] = True
+
+#----------------------------------------------------------------------------------------#
+## Word by word decoding with integers, used right after an error where the stream is
+## usually garbage and errors come every few words. Starts from an empty frame and returns
+## the position after clean_words good 40 bit words in a row (or the end of payload).
+def etroc2_decode_scalar(payload, position, state, found, compressed_translation, clean_words=32):
+    header_key, frame_key, firmware_key = etroc2_pattern_3c5c << 2, (etroc2_pattern_3c5c << 2) | 2, (etroc2_pattern_3c5c << 2) | 3
+    trailer_key = state.trailer_key
+    bits, nbits, in_frame = state.bits, state.nbits, state.in_frame
+    values, kinds, index = [], [], []
+    frame_start = 0
+    hitmap = 0
+    clean = 0
+    words = payload[position:position+4096].tolist()
+    for word in words:
+        bits = (bits << 28) | word
+        nbits += 28
+        if nbits >= 40:
+            nbits -= 40
+            value = bits >> nbits
+            bits &= (1 << nbits) - 1
+            top = value >> 22
+            if top == header_key: kind = ETROC2_HEADER
+            elif top == trailer_key: kind = ETROC2_TRAILER
+            elif top == frame_key: kind = ETROC2_FRAMEFILLER
+            elif top == firmware_key: kind = ETROC2_FIRMWAREFILLER
+            elif value >> 39: kind = ETROC2_DATA
+            else: kind = ETROC2_INVALID
+            if in_frame: good = kind == ETROC2_DATA or kind == ETROC2_TRAILER
+            else: good = kind == ETROC2_HEADER or kind == ETROC2_FRAMEFILLER or kind == ETROC2_FIRMWAREFILLER
+            if good and kind == ETROC2_DATA:
+                pixel = ((value >> 29) & 0xf)*16 + ((value >> 33) & 0xf)
+                good = not (hitmap >> pixel) & 1
+                hitmap |= 1 << pixel
+            if not good:
+                # Clear the frame and start again at the next payload, pending bits are lost
+                state.error(etroc2_error_reason(kind, in_frame), len(values) - frame_start)
+                del values[frame_start:], kinds[frame_start:], index[frame_start:]
+                bits, nbits, hitmap, clean = 0, 0, 0, 0
+                position += 1
+                continue
+            in_frame = kind == ETROC2_HEADER or kind == ETROC2_DATA
+            values.append(value)
+            kinds.append(kind)
+            index.append(position)
+            clean += 1
+            if kind == ETROC2_TRAILER:
+                state.stats[etroc2_stat_frames] += 1
+                if compressed_translation and hitmap == 0: del values[frame_start:], kinds[frame_start:], index[frame_start:]
+                frame_start = len(values)
+                hitmap = 0
+        position += 1
+        if clean >= clean_words: break
+    state.bits, state.nbits, state.in_frame = bits, nbits, in_frame
+    records = etroc2_records(np.array(values, dtype=np.uint64), np.array(kinds, dtype=np.uint8), np.array(index, dtype=np.int64), state.channel)
+    etroc2_close_frames(records, state, found, False)
+    return position
+
+#----------------------------------------------------------------------------------------#
+## Decode an array of 28 bit payloads of one channel
+## Returns the records of every frame closed by a trailer in this call, in stream order.
+## Frames that hit an error are dropped, as etroc2_translate does, and with
+## compressed_translation only frames with DATA are returned.
+def etroc2_decode(payload, state, compressed_translation=False):
+    payload = np.asarray(payload, dtype=np.uint64) & np.uint64(etroc2_payload_mask)
+    found = []
+    position = 0
+    if not state.linked:
+        alignment = etroc2_find_alignment(payload, state.last_word)
+        if alignment is None:
+            if len(payload) > 0: state.last_word = int(payload[-1])
+            state.stats[etroc2_stat_skipped_bits] += 28*len(payload)
+            return state.block[:0]
+        word, offset = alignment
+        # The words before (last_word was counted already, word is -1 then)
+        state.stats[etroc2_stat_skipped_bits] += 28*word + offset
+        state.stats[etroc2_stat_alignments] += 1
+        aligned_word = state.last_word if word < 0 else int(payload[word])
+        state.linked = True
+        state.last_word = None
+        state.nbits = 28 - offset
+        state.bits = aligned_word & ((1 << state.nbits) - 1)
+        position = word + 1
+    window = 4096
+    while position < len(payload):
+        # Pending bits go in front as one or two words, decoding starts 'offset' bits into the stream
+        if state.nbits == 0:
+            front = []
+        elif state.nbits <= 28:
+            front = [state.bits]
+        else:
+            front = [state.bits >> 28, state.bits & etroc2_payload_mask]
+        offset = (28*len(front) - state.nbits) if front else 0
+        segment = payload[position:position+window]
+        stream = np.concatenate((np.array(front, dtype=np.uint64), segment, np.zeros(2, dtype=np.uint64)))
+        total_bits = 28*(len(stream)-2)
+        nwords = (total_bits - offset)//40
+        starts = offset + 40*np.arange(nwords, dtype=np.int64)
+        first, shift = np.divmod(starts, 28)
+        shift = shift.astype(np.uint64)
+        high = stream[first] & ((np.uint64(1) << (np.uint64(28) - shift)) - np.uint64(1))
+        low = ((stream[first+1] << np.uint64(28)) | stream[first+2]) >> (np.uint64(44) - shift)
+        values = (high << (np.uint64(12) + shift)) | low
+        ends = position + (starts + 39)//28 - len(front)
+        #-------Classify 40 bit words, same precedence as etroc2_translate--------#
+        top = values >> np.uint64(22)
+        kinds = np.select([top == (etroc2_pattern_3c5c << 2),
+                           top == state.trailer_key,
+                           top == ((etroc2_pattern_3c5c << 2) | 2),
+                           top == ((etroc2_pattern_3c5c << 2) | 3),
+                           (values >> np.uint64(39)) == 1],
+                          [ETROC2_HEADER, ETROC2_TRAILER, ETROC2_FRAMEFILLER, ETROC2_FIRMWAREFILLER, ETROC2_DATA], ETROC2_INVALID)
+        is_data    = kinds == ETROC2_DATA
+        is_trailer = kinds == ETROC2_TRAILER
+        # HEADER/fillers are expected outside of a frame, DATA/TRAILER inside one
+        opens = (kinds == ETROC2_HEADER) | is_data
+        in_frame = np.concatenate(([state.in_frame], opens[:-1]))
+        good = np.where(in_frame, is_data | is_trailer, (kinds == ETROC2_HEADER) | (kinds == ETROC2_FRAMEFILLER) | (kinds == ETROC2_FIRMWAREFILLER))
+        error = int(np.argmin(good)) if not np.all(good) else nwords
+        # More than one hit from the same pixel in a frame is an error too
+        frame = np.cumsum(is_trailer[:error]) - is_trailer[:error]
+        hits = np.flatnonzero(is_data[:error])
+        if len(hits) > 0:
+            pixels = ((((values[hits] >> np.uint64(29)) & np.uint64(0xf)) << np.uint64(4)) | ((values[hits] >> np.uint64(33)) & np.uint64(0xf))).astype(np.int64)
+            keys = frame[hits]*256 + pixels
+            order = np.argsort(keys, kind='stable')
+            repeated = np.zeros(len(hits), dtype=bool)
+            repeated[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+            repeated |= (frame[hits] == 0) & state.hitmap[pixels]
+            if np.any(repeated): error = int(hits[np.argmax(repeated)])
+        records = etroc2_records(values[:error], kinds[:error], ends[:error], state.channel)
+        state.stats[etroc2_stat_frames] += int(np.sum(is_trailer[:error]))
+        etroc2_close_frames(np.concatenate((state.block, records)), state, found, compressed_translation)
+        if error < nwords: state.error(etroc2_error_reason(int(kinds[error]), bool(in_frame[error])), len(state.block))
+        if error > 0: state.in_frame = bool(opens[error-1])
+        if error < nwords:
+            # Clear the frame and start again at the next payload, pending bits are lost
+            state.clear()
+            position = etroc2_decode_scalar(payload, int(ends[error]) + 1, state, found, compressed_translation)
+            window = 1024
+            continue
+        # Keep the bits past the last full 40 bit word for the next call
+        state.nbits = total_bits - offset - 40*nwords
+        state.bits = 0
+        for word in stream[max(0, len(stream)-4):len(stream)-2].tolist():
+            state.bits = (state.bits << 28) | word
+        state.bits &= (1 << state.nbits) - 1
+        position += len(segment)
+        window = min(2*window, 1 << 16)
+    if len(found) == 0: return state.block[:0]
+    return np.concatenate(found)
+
+#----------------------------------------------------------------------------------------#
+## Split the ETROC2 words of a chunk of 32 bit FIFO words by channel
+# return {channel: (words, their positions in the chunk)}, channels without words are left out
+def etroc2_demux_chunk(words, timestamp):
+    if(timestamp==1): return {}                     # timestamp 0x0001 is old ETROC1 data only
+    words = np.asarray(words, dtype=np.uint32)
+    # One stable sort by channel instead of a pass over the chunk per channel
+    positions = np.flatnonzero((words >> 30) == 3)
+    channels = (words[positions] >> 28) & 3
+    order = np.argsort(channels, kind='stable')
+    positions = positions[order]
+    counts = np.bincount(channels, minlength=etroc2_channels)
+    bounds = np.cumsum(counts)
+    demuxed = {}
+    for channel in np.flatnonzero(counts):
+        channel_positions = positions[bounds[channel]-counts[channel]:bounds[channel]]
+        demuxed[int(channel)] = (words[channel_positions], channel_positions)
+    return demuxed
+
+#----------------------------------------------------------------------------------------#
+## Decode the words of one channel
+# return list of (position of the word closing the frame, frame records)
+def etroc2_decode_channel(channel_words, positions, link_state, compressed_translation=False):
+    records = etroc2_decode(channel_words, link_state, compressed_translation)
+    return [(int(positions[frame['INDEX'][-1]]), frame) for frame in etroc2_split_frames(records)]
+
+#----------------------------------------------------------------------------------------#
+## Decode the ETROC2 words of a chunk of 32 bit FIFO words channel by channel
+# @param[in] link_states one ETROC2_link_state per channel
+# return list of (position of the word closing the frame, frame records) in stream order
+def etroc2_decode_chunk(words, link_states, timestamp, compressed_translation=False):
+    frames = []
+    for channel, (channel_words, positions) in etroc2_demux_chunk(words, timestamp).items():
+        frames += etroc2_decode_channel(channel_words, positions, link_states[channel], compressed_translation)
+    frames.sort(key=lambda frame: frame[0])
+    return frames
+
+#----------------------------------------------------------------------------------------#
+## Text line of a decoded ETROC2 word, identical to the lines of etroc2_translate
+def etroc2_record_line(record):
+    channel = record['CHANNEL']
+    kind = record['KIND']
+    if(kind==ETROC2_HEADER):
+        return "ETROC2 {:d} HEADER L1COUNTER {:08b} TYPE {:02b} BCID {:d}".format(channel, record['L1COUNTER'], record['TYPE'], record['BCID'])
+    elif(kind==ETROC2_DATA):
+        return "ETROC2 {:d} DATA EA {:02b} COL {:d} ROW {:d} TOA {:d} TOT {:d} CAL {:d} ".format(channel, record['EA'], record['COL'], record['ROW'], record['TOA'], record['TOT'], record['CAL'])
+    elif(kind==ETROC2_TRAILER):
+        return "ETROC2 {:d} TRAILER CHIPID {} STATUS {:06b} HITS {:d} CRC {:08b}".format(channel, hex(record['CHIPID']), record['STATUS'], record['HITS'], record['CRC'])
+    elif(kind==ETROC2_FRAMEFILLER):
+        return "ETROC2 {:d} FRAMEFILLER L1COUNTER {:08b} EBS {:02b} BCID {:d}".format(channel, record['L1COUNTER'], record['EBS'], record['BCID'])
+    elif(kind==ETROC2_FIRMWAREFILLER):
+        return "ETROC2 {:d} FIRMWAREFILLER MISSINGCOUNT {:022b}".format(channel, record['MISSINGCOUNT'])
+    return ""
+
+## Text of many decoded ETROC2 words at once: the lines of etroc2_record_line, each one followed by "\n"
+## Every kind is written into a fixed width uint8 matrix, one column per character: fixed text,
+## binary fields, and decimal/hex numbers at their largest width whose leading zeros are blanked
+## (0). The rows are then laid end to end and the blanks squeezed out, there is no Python call per word
+## (field, base, digits) of every number, b'...' is fixed text
+etroc2_text_columns = {
+    ETROC2_HEADER:         [b" HEADER L1COUNTER ", ('L1COUNTER', 2, 8), b" TYPE ", ('TYPE', 2, 2), b" BCID ", ('BCID', 10, 4), b"\n"],
+    ETROC2_DATA:           [b" DATA EA ", ('EA', 2, 2), b" COL ", ('COL', 10, 2), b" ROW ", ('ROW', 10, 2), b" TOA ", ('TOA', 10, 4),
+                            b" TOT ", ('TOT', 10, 3), b" CAL ", ('CAL', 10, 4), b" \n"],
+    ETROC2_TRAILER:        [b" TRAILER CHIPID 0x", ('CHIPID', 16, 5), b" STATUS ", ('STATUS', 2, 6), b" HITS ", ('HITS', 10, 3), b" CRC ", ('CRC', 2, 8), b"\n"],
+    ETROC2_FRAMEFILLER:    [b" FRAMEFILLER L1COUNTER ", ('L1COUNTER', 2, 8), b" EBS ", ('EBS', 2, 2), b" BCID ", ('BCID', 10, 4), b"\n"],
+    ETROC2_FIRMWAREFILLER: [b" FIRMWAREFILLER MISSINGCOUNT ", ('MISSINGCOUNT', 2, 22), b"\n"],
+}
+
+## Characters of numbers in a given base, one row per value, leading zeros blanked unless binary
+def etroc2_text_digits(values, base, digits):
+    values = np.asarray(values, dtype=np.int64)
+    powers = base ** np.arange(digits-1, -1, -1, dtype=np.int64)
+    chars = (values[:, None] // powers) % base
+    chars = np.where(chars < 10, chars + ord('0'), chars + ord('a') - 10).astype(np.uint8)
+    if(base!=2): chars[(values[:, None] < powers) & (powers > 1)] = 0
+    return chars
+
+def etroc2_records_text(records):
+    if(len(records)==0): return ""
+    rows = []
+    for kind, columns in etroc2_text_columns.items():
+        selected = np.flatnonzero(records['KIND']==kind)
+        if(len(selected)==0): continue
+        words = records[selected]
+        parts = [np.broadcast_to(np.frombuffer(b"ETROC2 ", dtype=np.uint8), (len(words), 7)), etroc2_text_digits(words['CHANNEL'], 10, 3)]
+        for column in columns:
+            if(isinstance(column, bytes)): parts.append(np.broadcast_to(np.frombuffer(column, dtype=np.uint8), (len(words), len(column))))
+            else: parts.append(etroc2_text_digits(words[column[0]], column[1], column[2]))
+        rows.append((selected, np.hstack(parts)))
+    # Words of no known kind are empty lines
+    text = np.zeros((len(records), max([chars.shape[1] for selected, chars in rows], default=1)), dtype=np.uint8)
+    text[:, 0] = ord('\n')
+    for selected, chars in rows: text[selected, :chars.shape[1]] = chars
+    text = text.ravel()
+    return text[text!=0].tobytes().decode()
+
+#----------------------------------------------------------------------------------------#
+## Split decoded records into frames, each one ends with its trailer
+def etroc2_split_frames(records):
+    ends = np.flatnonzero(records['KIND'] == ETROC2_TRAILER) + 1
+    return np.split(records, ends[:-1]) if len(ends) > 0 else []
+
+#----------------------------------------------------------------------------------------#
+## Packed frames: (position of the word closing every frame, records of all the frames one after
+## the other, number of records of every frame), what the DAQ threads pass around instead of a
+## list of small arrays
+def etroc2_empty_frames():
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=etroc2_record_dtype), np.zeros(0, dtype=np.int64)
+
+## Decode the words of one channel into packed frames, see etroc2_decode_channel
+def etroc2_decode_channel_packed(channel_words, positions, link_state, compressed_translation=False):
+    records = etroc2_decode(channel_words, link_state, compressed_translation)
+    ends = np.flatnonzero(records['KIND'] == ETROC2_TRAILER)
+    return np.asarray(positions, dtype=np.int64)[records['INDEX'][ends]], records, np.diff(ends + 1, prepend=0)
+
+## Packed frames of several channels in stream order (by closing word position)
+def etroc2_merge_packed(packs):
+    packs = [pack for pack in packs if len(pack[0]) > 0]
+    if len(packs) == 0: return etroc2_empty_frames()
+    if len(packs) == 1: return packs[0]
+    positions = np.concatenate([pack[0] for pack in packs])
+    records = np.concatenate([pack[1] for pack in packs])
+    lengths = np.concatenate([pack[2] for pack in packs])
+    order = np.argsort(positions, kind='stable')
+    starts = np.cumsum(lengths) - lengths
+    lengths = lengths[order]
+    rows = np.repeat(starts[order] - (np.cumsum(lengths) - lengths), lengths) + np.arange(len(records))
+    return positions[order], records[rows], lengths
+
+## Decode the ETROC2 words of a chunk of 32 bit FIFO words into packed frames, see etroc2_decode_chunk
+def etroc2_decode_chunk_packed(words, link_states, timestamp, compressed_translation=False):
+    return etroc2_merge_packed([etroc2_decode_channel_packed(channel_words, positions, link_states[channel], compressed_translation)
+                                for channel, (channel_words, positions) in etroc2_demux_chunk(words, timestamp).items()])
+
 #----------------------------------------------------------------------------------------#
 def control_translate(line, timestamp):
     if(line[2:4]=='00'):
@@ -237,7 +685,93 @@ def control_translate(line, timestamp):
     return TDC_data, 1
 
 #----------------------------------------------------------------------------------------#
-def etroc_translate_binary(line, timestamp, queues, links, board_ID, hitmap, compressed_translation):
+## Absolute trigger times, vectorized version of the timecode words of control_translate
+## NORMTRIG/RANDTRIG are 26 bit clock cycle counters, MSBTIME counts the NORMTRIG overflows,
+## together they make a monotonic 52 bit count: 25 ns per count, 25*32 ns per NORMTRIG increment
+## in Qinj operation. The MSBTIME of an overflow can come after the first trigger past it, such
+## an overflow is counted right away (and not again when its MSBTIME comes)
+time_code_normtrig   = 0
+time_code_randtrig   = 1
+time_code_fillertime = 2
+time_code_msbtime    = 3
+ns_per_cycle         = 25
+ns_per_normtrig_qinj = 25*32
+
+class Trigger_time_state(object):
+    def __init__(self):
+        self.msbtime = 0
+        self.last_counter = {time_code_normtrig: 0, time_code_randtrig: 0}     # per trigger type
+        self.last_msbtime = {time_code_normtrig: 0, time_code_randtrig: 0}
+        self.overflows = {time_code_normtrig: 0, time_code_randtrig: 0}        # seen before their MSBTIME
+        self.last_time = 0                                                      # of the last trigger of any type
+        self.triggers = 0
+
+## Timecode words of 32 bit FIFO words ('10' + '00' + time code + 26 bit counter)
+# return (positions, time codes, counters)
+def trigger_time_words(words):
+    words = np.asarray(words, dtype=np.uint32)
+    positions = np.flatnonzero((words >> 28) == 0x8)
+    return positions, (words[positions] >> 26) & 3, words[positions] & 0x3FFFFFF
+
+## 52 bit times of the NORMTRIG/RANDTRIG words
+# return (positions of the trigger words, their times in clock cycles)
+def trigger_timestamps(positions, codes, counters, state):
+    codes = codes.astype(np.int64)
+    counters = counters.astype(np.int64)
+    # MSBTIME in force at every word
+    latest = np.maximum.accumulate(np.where(codes == time_code_msbtime, np.arange(len(codes)), -1)) if len(codes)>0 else np.zeros(0, dtype=np.int64)
+    msbtime = np.where(latest >= 0, counters[np.maximum(latest, 0)], state.msbtime)
+    if(len(codes)>0 and latest[-1] >= 0): state.msbtime = int(counters[latest[-1]])
+    triggers = np.flatnonzero((codes == time_code_normtrig) | (codes == time_code_randtrig))
+    times = np.zeros(len(triggers), dtype=np.int64)
+    for code in (time_code_normtrig, time_code_randtrig):
+        selected = np.flatnonzero(codes[triggers] == code)
+        if(len(selected)==0): continue
+        counter = counters[triggers[selected]]
+        msb = msbtime[triggers[selected]]
+        previous_counter = np.concatenate(([state.last_counter[code]], counter[:-1]))
+        previous_msb = np.concatenate(([state.last_msbtime[code]], msb[:-1]))
+        # Overflows since the last MSBTIME, the count starts over at every new MSBTIME
+        overflow = ((counter < previous_counter) & (msb == previous_msb)).astype(np.int64)
+        new_msb = msb != previous_msb
+        count = np.cumsum(overflow)
+        start = np.maximum.accumulate(np.where(new_msb, np.arange(len(msb)), 0))
+        overflows = count - count[start] + overflow[start]
+        if(not new_msb[0]): overflows[start == 0] += state.overflows[code]
+        times[selected] = ((msb + overflows) << 26) | counter
+        state.last_counter[code] = int(counter[-1])
+        state.last_msbtime[code] = int(msb[-1])
+        state.overflows[code] = int(overflows[-1])
+    if(len(times)>0): state.last_time = int(times[-1])
+    state.triggers += len(times)
+    return positions[triggers], times
+
+## Trigger times in ns, TRIGTIME stays in clock cycles in the records
+# @param[in] qinj the NORMTRIG counter of Qinj operation counts 32 clock cycles
+def trigger_time_ns(cycles, qinj=False):
+    return np.asarray(cycles, dtype=np.uint64) * np.uint64(ns_per_normtrig_qinj if qinj else ns_per_cycle)
+
+## Trigger time of frames: the last trigger before the word closing the frame
+# @param[in] frame_positions positions of the closing words, same reference as trigger_positions
+# @param[in] previous time of the last trigger before these trigger words
+def trigger_times_of(frame_positions, trigger_positions, trigger_times, previous):
+    index = np.searchsorted(trigger_positions, frame_positions) - 1
+    if(len(trigger_times)==0): return np.full(len(frame_positions), previous, dtype=np.int64)
+    return np.where(index >= 0, trigger_times[np.maximum(index, 0)], previous)
+
+## Set TRIGTIME of the (position, frame, ...) of a chunk
+def etroc2_attach_trigger_times(frames, trigger_positions, trigger_times, previous):
+    if(len(frames)==0): return
+    for frame, time in zip(frames, trigger_times_of(np.array([frame[0] for frame in frames]), trigger_positions, trigger_times, previous)):
+        frame[1]['TRIGTIME'] = time
+
+## Set TRIGTIME of packed frames
+def etroc2_attach_trigger_times_packed(positions, records, lengths, trigger_positions, trigger_times, previous):
+    if(len(lengths)==0): return
+    records['TRIGTIME'] = np.repeat(trigger_times_of(positions, trigger_positions, trigger_times, previous), lengths)
+
+#----------------------------------------------------------------------------------------#
+def etroc_translate_binary(line, timestamp, queues, links, board_ID, hitmap, compressed_translation, stats=None):
     data_type = ''
     if(timestamp==1): data_type = 'etroc1'              ## timestamp 0x0001: Disable Testmode & Disable TimeStamp: OLD DATA
     ########################################## CHECK IF TEST ON AND TIME OFF IS OLD DATA
@@ -247,7 +781,7 @@ def etroc_translate_binary(line, timestamp, queues, links, board_ID, hitmap, com
         elif(line[1]=='1'): data_type = 'etroc2'
 
     if(data_type == 'etroc1'): TDC_data = etroc1_translate(line, timestamp)
-    elif(data_type == 'etroc2'): TDC_data = etroc2_translate(line, timestamp, queues, links, board_ID, hitmap, compressed_translation)
+    elif(data_type == 'etroc2'): TDC_data = etroc2_translate(line, timestamp, queues, links, board_ID, hitmap, compressed_translation, stats)
     elif(data_type == 'control'): TDC_data = control_translate(line, timestamp)
 
     return TDC_data
\ No newline at end of file
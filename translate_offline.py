@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import datetime
+import numpy as np
+from multiprocessing import Pool
+from optparse import OptionParser
+
+from translate_data import *
+from daq_io import *
+from board_details import *
+from event_builder import *
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script translates the raw TDC_Data_N files of a recorded run again, without the FPGA.
+Files are read in parallel a window at a time, every channel is then decoded in its own process
+over the files in order (so partial words and link state carry over file and window boundaries)
+and the frames are written out in the order the live Translate_data thread would have written them.
+'''
+#--------------------------------------------------------------------------#
+## Read one raw file and split its ETROC2 words by channel
+# return (file index, number of words, {channel: (payloads, positions in the file)}, trigger_time_words)
+def split_raw_file(args):
+    file_index, path, timestamp = args
+    words = np.asarray(load_raw_file(path), dtype=np.uint32)
+    return file_index, len(words), etroc2_demux_chunk(words, timestamp), trigger_time_words(words)
+
+#--------------------------------------------------------------------------#
+## Decode one channel over the files of a window, in order
+## The link state comes from the previous window and goes back for the next one
+# return (link state, records of the closed frames, number of records per frame, run-wide word index closing each frame)
+def decode_channel(args):
+    link_state, compressed_translation, pieces = args
+    packs = []
+    for offset, payload, positions in pieces:
+        frame_positions, records, lengths = etroc2_decode_channel_packed(payload, positions, link_state, compressed_translation)
+        packs.append((offset + frame_positions, records, lengths))
+    keys, records, lengths = etroc2_merge_packed(packs)
+    return link_state, records, lengths, keys
+
+#--------------------------------------------------------------------------#
+## Records of a run written to a temporary file, turned into TDC_Data_translated.npy at the end
+## (the number of records is only known then), so the run never has to fit in memory
+class Translated_npy_writer(object):
+    def __init__(self, store_dict):
+        self.path = os.path.join(store_dict, "TDC_Data_translated.npy")
+        self.outfile = open(self.path + ".tmp", 'wb')
+        self.records = 0
+
+    def write_records(self, records, lengths):
+        self.outfile.write(records.tobytes())
+        self.records += len(records)
+
+    def close(self):
+        self.outfile.close()
+        output = np.lib.format.open_memmap(self.path, mode='w+', dtype=etroc2_record_dtype, shape=(self.records,))
+        if(self.records>0):
+            records = np.memmap(self.path + ".tmp", dtype=etroc2_record_dtype, mode='r')
+            for start in range(0, self.records, 1<<20): output[start:start+(1<<20)] = records[start:start+(1<<20)]
+            del records
+        output.flush()
+        del output
+        os.remove(self.path + ".tmp")
+
+#--------------------------------------------------------------------------#
+## The run is translated --window files at a time: the files of a window are read and split in
+## parallel, every channel is then decoded in its own process over them in order, its link state
+## going on to the next window. Frames close in the window of their trailer, so writing the frames
+## of every window in the order of their trailers gives the order of the whole run
+def translate_run(options, run_directory, translated_directory):
+    raw_files = raw_file_list(run_directory)
+    if(len(raw_files)==0):
+        print("No TDC_Data_N files found in %s"%run_directory)
+        sys.exit(1)
+    timestamp = options.timestamp
+    fpga = options.fpga
+    trigger_qinj = options.trigger_qinj
+    chip_IDs = board_ID
+    if(raw_files[0].endswith('.bin')):
+        run_info, offset = read_raw_header(raw_files[0])
+        timestamp = run_info.get('timestamp', timestamp)
+        fpga = run_info.get('fpga', fpga)
+        trigger_qinj = trigger_qinj or run_info.get('options', {}).get('trigger_qinj', False)
+        chip_IDs = run_info.get('board_ID', chip_IDs)
+    # The board lists give the chips of every FPGA, FPGA after FPGA
+    chip_IDs = chip_IDs[fpga*etroc2_channels:(fpga+1)*etroc2_channels]
+    if(len(chip_IDs) < etroc2_channels):
+        print("No chip IDs for FPGA %d in board_ID"%fpga)
+        sys.exit(1)
+    print("Translating %d raw files from %s with %d processes, %d files at a time"%(len(raw_files), run_directory, options.processes, options.window))
+    start_time = time.time()
+    link_states = [ETROC2_link_state(channel, chip_IDs[channel]) for channel in range(etroc2_channels)]
+    trigger_state = Trigger_time_state()
+    event_builder = None
+    if(options.translated_format=='npy'):
+        writer = Translated_npy_writer(translated_directory)
+    elif(options.translated_format=='columnar'):
+        writer = Translated_columnar_writer(translated_directory, options.num_line, options.compressed_translation, "translate_offline", trigger_qinj)
+    else:
+        writer = Translated_text_writer(translated_directory, options.num_line, options.compressed_translation, "translate_offline")
+    total_words = 0
+    total_frames = 0
+    with Pool(options.processes) as pool:
+        for first_file in range(0, len(raw_files), options.window):
+            window = raw_files[first_file:first_file+options.window]
+            split = pool.map(split_raw_file, [(i, path, timestamp) for i, path in enumerate(window)])
+            offsets = total_words + np.cumsum([0] + [nwords for file_index, nwords, channels, triggers in split])
+            total_words = int(offsets[-1])
+            tasks = []
+            for channel in range(etroc2_channels):
+                pieces = [(int(offsets[file_index]),) + channels[channel] for file_index, nwords, channels, triggers in split if channel in channels]
+                if(len(pieces)>0): tasks.append((link_states[channel], options.compressed_translation, pieces))
+            decoded = pool.map(decode_channel, tasks)
+            if(options.build_events and event_builder is None):
+                # Channels expected in every event: given, or those with words in the first window
+                event_channels = [int(channel) for channel in options.event_channels.split(',')] if options.event_channels else [task[0].channel for task in tasks]
+                event_builder = Event_builder(event_channels, options.event_window, translated_directory, trigger_qinj=trigger_qinj)
+            for link_state, records, lengths, keys in decoded: link_states[link_state.channel] = link_state
+            # Frames are written in the order their trailers were read out
+            keys, records, lengths = etroc2_merge_packed([(keys, records, lengths) for link_state, records, lengths, keys in decoded])
+            # Every frame gets the last trigger time before its trailer
+            previous = trigger_state.last_time
+            trigger_positions = np.concatenate([triggers[0] + offsets[file_index] for file_index, nwords, channels, triggers in split])
+            trigger_codes = np.concatenate([triggers[1] for file_index, nwords, channels, triggers in split])
+            trigger_counters = np.concatenate([triggers[2] for file_index, nwords, channels, triggers in split])
+            trigger_positions, trigger_times = trigger_timestamps(trigger_positions, trigger_codes, trigger_counters, trigger_state)
+            etroc2_attach_trigger_times_packed(keys, records, lengths, trigger_positions, trigger_times, previous)
+            if(event_builder is not None): event_builder.add_frames(etroc2_split_frames(records))
+            writer.write_records(records, lengths)
+            total_frames += len(lengths)
+    writer.close()
+    if(event_builder is not None):
+        event_builder.close()
+        print(event_builder.summary())
+    stats = np.zeros((etroc2_channels, len(etroc2_stat_names)), dtype=np.int64)
+    for link_state in link_states: stats[link_state.channel] = link_state.stats
+    write_link_stats(translated_directory, stats, "translate_offline", fpga)
+    if(np.any(stats[:, :etroc2_error_count])): print("Decoding errors: " + etroc2_stats_summary(stats))
+    elapsed = time.time() - start_time
+    print("Translated %d words into %d frames in %.2f s (%.0f words/s)"%(total_words, total_frames, elapsed, total_words/max(elapsed, 1e-9)))
+
+#--------------------------------------------------------------------------#
+def getOptionParser():
+    parser = OptionParser()
+    parser.add_option("-o", "--output_directory", dest="output_directory", action="store", type="string", help="User defined output directory of the run", default="unnamed_output_directory")
+    parser.add_option("--date", dest="date", action="store", type="string", help="Date (YYYY-MM-DD) of the run directory, today if not given", default=datetime.date.today().isoformat())
+    parser.add_option("--run_directory", dest="run_directory", action="store", type="string", help="Full path of the run directory, overrides -o/--date", default=None)
+    parser.add_option("--translated_directory", dest="translated_directory", action="store", type="string", help="Where to write the translated files, the run directory if not given", default=None)
+    parser.add_option("--translated_format", dest="translated_format", action="store", type="choice", choices=["text", "npy", "columnar"], default="text", help="text: TDC_Data_translated_N.dat files, npy: one TDC_Data_translated.npy array of decoded words, columnar: frame and hit chunks with a manifest (see Translated_columnar_writer)")
+    parser.add_option("--build_events",action="store_true", dest="build_events", default=False, help="Also group the frames of all the channels by L1COUNTER into TDC_Events_N.npz files (see event_builder.py)")
+    parser.add_option("--event_channels", dest="event_channels", action="store", type="string", help="Comma separated channels expected in every event, those with words in the first --window files if not given", default=None)
+    parser.add_option("--event_window", dest="event_window", action="store", type="int", help="Max events waiting for the frames of all channels", default=64)
+    parser.add_option("--trigger_qinj",action="store_true", dest="trigger_qinj", default=False, help="Trigger times of Qinj operation (25*32 ns per NORMTRIG count) for the ns times of the columnar and event outputs (read from the header of .bin files)")
+    parser.add_option("-l", "--num_line", dest="num_line", action="store", type="int", help="Number of lines per translated file", default=50000)
+    parser.add_option("-s", "--timestamp", type="int",action="store", dest="timestamp", default=0x000C, help="Timestamp setting of the run (read from the header of .bin files)")
+    parser.add_option("--fpga", type="int",action="store", dest="fpga", default=0, help="FPGA of the board lists (board_ID) the run was read from (read from the header of .bin files)")
+    parser.add_option("--compressed_translation",action="store_true", dest="compressed_translation", default=False, help="Save only FPGA translated data frames with DATA")
+    parser.add_option("--window", dest="window", action="store", type="int", help="Number of raw files read and decoded at a time, bounds the memory used", default=32)
+    parser.add_option("-j", "--processes", dest="processes", action="store", type="int", help="Number of worker processes", default=os.cpu_count())
+    parser.add_option("-w", "--overwrite",action="store_true", dest="overwrite", default=False, help="Overwrite previously translated files")
+    return parser
+
+if __name__ == "__main__":
+    parser = getOptionParser()
+    (options, args) = parser.parse_args()
+    run_directory = options.run_directory
+    if(run_directory is None):
+        run_directory = "../ETROC-Data/" + options.date + "_Array_Test_Results/" + options.output_directory
+    translated_directory = options.translated_directory if options.translated_directory is not None else run_directory
+    if(not os.path.isdir(run_directory)):
+        print("Run directory %s does not exist!"%run_directory)
+        sys.exit(1)
+    try:
+        os.makedirs(translated_directory)
+    except FileExistsError:
+        translated = ["TDC_Data_translated_0.dat", "TDC_Data_translated.npy", columnar_manifest, link_stats_file]
+        if(options.build_events): translated.append("TDC_Events_0.npz")
+        if(any(os.path.exists(os.path.join(translated_directory, name)) for name in translated) and options.overwrite != True):
+            print("Translated files already in %s and overwriting is not enabled, exiting code abruptly..."%translated_directory)
+            sys.exit(1)
+    translate_run(options, run_directory, translated_directory)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import struct
+import numpy as np
+from optparse import OptionParser
+
+from translate_data import *
+#========================================================================================#
+'''
+@date: 2026-10-18
+This script reads translated TDC_Data_translated_N.dat text files into numpy records in bulk:
+the whole file is tokenized at once with numpy instead of splitting it line by line. The records
+are cached next to the file (TDC_Data_translated_N.dat.cache), a later load of an unchanged file
+memory-maps the cache instead of parsing the text again.
+'''
+#--------------------------------------------------------------------------#
+## Lines that are not ETROC2 words get their own KIND after the ETROC2_* ones
+## ETROC1 lines fill CHANNEL, TOT, TOA and CAL, timecode lines (control_translate) fill COUNTER
+## Lines that can not be parsed are kept as ETROC2_INVALID
+text_ETROC1     = 6
+text_NORMTRIG   = 7
+text_RANDTRIG   = 8
+text_FILLERTIME = 9
+text_MSBTIME    = 10
+text_FILLER     = 11
+
+## etroc2_record_dtype plus the timecode counter, INDEX is the line number in the file (or run)
+text_record_dtype = np.dtype(etroc2_record_dtype.descr + [('COUNTER', np.uint32)])
+
+## Numbers of every kind of line: (token number in the line, field, base)
+text_fields = {
+    ETROC2_HEADER:         [(4, 'L1COUNTER', 2), (6, 'TYPE', 2), (8, 'BCID', 10)],
+    ETROC2_DATA:           [(4, 'EA', 2), (6, 'COL', 10), (8, 'ROW', 10), (10, 'TOA', 10), (12, 'TOT', 10), (14, 'CAL', 10)],
+    ETROC2_TRAILER:        [(4, 'CHIPID', 16), (6, 'STATUS', 2), (8, 'HITS', 10), (10, 'CRC', 2)],
+    ETROC2_FRAMEFILLER:    [(4, 'L1COUNTER', 2), (6, 'EBS', 2), (8, 'BCID', 10)],
+    ETROC2_FIRMWAREFILLER: [(4, 'MISSINGCOUNT', 2)],
+    text_ETROC1:           [(1, 'CHANNEL', 10), (2, 'TOT', 10), (3, 'TOA', 10), (4, 'CAL', 10)],
+    text_NORMTRIG:         [(1, 'COUNTER', 10)],
+    text_RANDTRIG:         [(1, 'COUNTER', 10)],
+    text_FILLERTIME:       [(1, 'COUNTER', 10)],
+    text_MSBTIME:          [(1, 'COUNTER', 10)],
+    text_FILLER:           [],
+}
+
+## First token of every kind of line, ETROC2 lines are told apart by their third token
+text_first_tokens = {b'ETROC1': text_ETROC1, b'NORMTRIG': text_NORMTRIG, b'RANDTRIG': text_RANDTRIG,
+                     b'FILLERTIME': text_FILLERTIME, b'MSBTIME': text_MSBTIME, b'FILLER': text_FILLER}
+text_etroc2_tokens = {b'HEADER': ETROC2_HEADER, b'DATA': ETROC2_DATA, b'TRAILER': ETROC2_TRAILER,
+                      b'FRAMEFILLER': ETROC2_FRAMEFILLER, b'FIRMWAREFILLER': ETROC2_FIRMWAREFILLER}
+
+## Cache file: magic (8 bytes) | version (uint32) | header length (uint32) | key (JSON, space padded)
+## followed by the records, same layout as the raw .bin files (see daq_io.py)
+cache_magic   = b'ETROCTXT'
+cache_version = 1
+cache_suffix  = '.cache'
+
+#--------------------------------------------------------------------------#
+## Values of tokens written in one base, all at once
+# @param[in] buf file content as uint8
+# @param[in] starts, lengths tokens to convert
+# return int64 values
+def token_values(buf, starts, lengths, base):
+    if(len(starts)==0): return np.zeros(0, dtype=np.int64)
+    if(base==16):                                   # 0x prefix
+        starts, lengths = starts + 2, lengths - 2
+    width = int(lengths.max())
+    # Right aligned characters of every token, missing ones count as 0
+    columns = np.arange(width)
+    valid = columns[None, :] >= (width - lengths)[:, None]
+    chars = buf[np.where(valid, starts[:, None] + columns[None, :] - (width - lengths)[:, None], 0)].astype(np.int64)
+    digits = np.where(chars <= ord('9'), chars - ord('0'), (chars | 0x20) - ord('a') + 10)
+    digits = np.where(valid, digits, 0)
+    return digits @ (base ** np.arange(width - 1, -1, -1, dtype=np.int64))
+
+#--------------------------------------------------------------------------#
+## Tokens of the lines that start with one of the given words
+# return {word: line numbers}
+def lines_starting_with(buf, token_starts, token_lengths, tokens, words):
+    found = {}
+    for word, value in words.items():
+        candidates = np.flatnonzero(token_lengths[tokens] == len(word))
+        for i, char in enumerate(word):
+            candidates = candidates[buf[token_starts[tokens[candidates]] + i] == char]
+        found[value] = candidates
+    return found
+
+#--------------------------------------------------------------------------#
+## Parse translated text
+# @param[in] content bytes of a TDC_Data_translated_N.dat file
+# return text_record_dtype records, one per non empty line
+def parse_translated_text(content):
+    buf = np.frombuffer(b'\n' + content + b'\n', dtype=np.uint8)
+    blank = buf <= ord(' ')                         # space, tab, '\r', '\n'
+    # Tokens start after a blank, a line starts with the first token after a '\n'
+    edges = np.flatnonzero(blank[1:] != blank[:-1]) + 1
+    starts = edges[0::2]
+    lengths = edges[1::2] - starts
+    first_token = np.flatnonzero(buf[starts - 1] == ord('\n'))
+    ntokens = np.diff(first_token, append=len(starts))
+    records = np.zeros(len(first_token), dtype=text_record_dtype)
+    records['INDEX'] = np.arange(len(first_token))
+    records['KIND'] = ETROC2_INVALID
+    kinds = lines_starting_with(buf, starts, lengths, first_token, text_first_tokens)
+    etroc2 = lines_starting_with(buf, starts, lengths, first_token, {b'ETROC2': 0})[0]
+    etroc2 = etroc2[ntokens[etroc2] >= 3]
+    for kind, rows in lines_starting_with(buf, starts, lengths, first_token[etroc2] + 2, text_etroc2_tokens).items():
+        kinds[kind] = etroc2[rows]
+        records['CHANNEL'][etroc2[rows]] = token_values(buf, starts[first_token[etroc2[rows]] + 1], lengths[first_token[etroc2[rows]] + 1], 10)
+    for kind, rows in kinds.items():
+        fields = text_fields[kind]
+        # Lines with missing tokens stay invalid
+        if(len(fields)>0): rows = rows[ntokens[rows] > max(token for token, field, base in fields)]
+        records['KIND'][rows] = kind
+        for token, field, base in fields:
+            tokens = first_token[rows] + token
+            records[field][rows] = token_values(buf, starts[tokens], lengths[tokens], base)
+    return records
+
+#--------------------------------------------------------------------------#
+def cache_key(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'dtype': text_record_dtype.descr}
+
+## Memory-map the cached records of a file, None if there is no cache or it is out of date
+def read_cache(path):
+    cache = path + cache_suffix
+    try:
+        with open(cache, 'rb') as infile:
+            if(infile.read(8)!=cache_magic): return None
+            version, header_len = struct.unpack('<II', infile.read(8))
+            if(version!=cache_version): return None
+            key = json.loads(infile.read(header_len-16).decode())
+    except (OSError, ValueError):
+        return None
+    if(json.loads(json.dumps(cache_key(path)))!=key): return None
+    if(os.path.getsize(cache)<=header_len): return np.zeros(0, dtype=text_record_dtype)
+    return np.memmap(cache, dtype=text_record_dtype, mode='r', offset=header_len)
+
+## Write the cache of a file, quietly skipped if the directory is read-only
+def write_cache(path, key, records):
+    cache = path + cache_suffix
+    info = json.dumps(key).encode()
+    header_len = 16 + len(info)
+    header_len += (-header_len) % 8
+    try:
+        with open(cache + '.tmp', 'wb') as outfile:
+            outfile.write(cache_magic + struct.pack('<II', cache_version, header_len) + info.ljust(header_len-16))
+            outfile.write(records.tobytes())
+        os.replace(cache + '.tmp', cache)
+    except OSError as e:
+        print("Could not write %s: %s"%(cache, e))
+
+#--------------------------------------------------------------------------#
+## Records of one translated text file, from its cache when the file did not change since
+# @param[in] use_cache False to always parse (and not write a cache)
+def load_translated_text(path, use_cache=True):
+    if(use_cache):
+        records = read_cache(path)
+        if(records is not None): return records
+    key = cache_key(path)
+    with open(path, 'rb') as infile:
+        records = parse_translated_text(infile.read())
+    # The file changed while it was read (run still going), do not cache it
+    if(use_cache and cache_key(path)==key): write_cache(path, key, records)
+    return records
+
+#--------------------------------------------------------------------------#
+## TDC_Data_translated_N.dat files of a run directory in the order they were written
+def translated_file_list(directory):
+    files = []
+    for name in os.listdir(directory):
+        if(not name.startswith('TDC_Data_translated_') or not name.endswith('.dat')): continue
+        counter = name[len('TDC_Data_translated_'):-len('.dat')]
+        if(counter.isdigit()): files.append((int(counter), os.path.join(directory, name)))
+    return [path for counter, path in sorted(files)]
+
+## Records of all the translated text files of a run, INDEX is made run-wide
+def load_translated_run(directory, use_cache=True):
+    loaded = [load_translated_text(path, use_cache) for path in translated_file_list(directory)]
+    if(len(loaded)==0): return np.zeros(0, dtype=text_record_dtype)
+    records = np.concatenate(loaded)
+    records['INDEX'] += np.repeat(np.cumsum([0] + [len(file_records) for file_records in loaded[:-1]]), [len(file_records) for file_records in loaded])
+    return records
+
+#--------------------------------------------------------------------------#
+def getOptionParser():
+    parser = OptionParser()
+    parser.add_option("--run_directory", dest="run_directory", action="store", type="string", help="Run directory with the TDC_Data_translated_N.dat files", default=".")
+    parser.add_option("--no_cache", action="store_false", dest="use_cache", default=True, help="Always parse the text, do not read or write the cache files")
+    return parser
+
+if __name__ == "__main__":
+    parser = getOptionParser()
+    (options, args) = parser.parse_args()
+    if(not os.path.isdir(options.run_directory)):
+        print("Run directory %s does not exist!"%options.run_directory)
+        sys.exit(1)
+    start_time = time.time()
+    records = load_translated_run(options.run_directory, options.use_cache)
+    kinds = np.bincount(records['KIND'], minlength=text_FILLER+1)
+    print("Loaded %d lines in %.2f s: %d HEADER, %d DATA, %d TRAILER, %d ETROC1, %d invalid"%(len(records), time.time()-start_time, kinds[ETROC2_HEADER], kinds[ETROC2_DATA], kinds[ETROC2_TRAILER], kinds[text_ETROC1], kinds[ETROC2_INVALID]))